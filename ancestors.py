@@ -0,0 +1,64 @@
+# Binary-lifting index over the chain walk_back follows, each transaction's
+# first parent. An entry holds the transaction's depth (hops to the end of its
+# chain: genesis, or the solid frontier of a compacted tangle) and its jumps,
+# the ancestors 2, 4, 8, ... hops up for every power of two within that depth,
+# so the ancestor at any depth is reached in O(log depth) lookups. Entries are
+# built from the parent's entry: by Tangle.ancestor when it first walks a
+# chain, and from then on as transactions are integrated. Being immutable,
+# they only go stale when the chain itself changes, in Tangle.remove and
+# Tangle.retire.
+
+class AncestorIndex():
+
+	def __init__(self):
+		self.entries = {}
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, tx):
+		return tx in self.entries
+
+	def root(self, tx):
+		self.entries[tx] = (0, ())
+
+	def link(self, tx, parent):
+		entries = self.entries
+		(depth, jumps) = entries[parent]
+		depth += 1
+		jumps = [parent]
+		k = 1
+		while (1 << k) <= depth:
+			jumps.append(entries[jumps[k - 1]][1][k - 1])
+			k += 1
+		entries[tx] = (depth, tuple(jumps))
+
+	def extend(self, tx, parent):
+		# A root's first edge puts it on its parent's chain; later edges
+		# leave the chain alone. A root whose parent has no entry is
+		# dropped, for Tangle.ancestor to fill in.
+		if self.entries.get(tx) != (0, ()):
+			return
+		if parent in self.entries:
+			self.link(tx, parent)
+		else:
+			del self.entries[tx]
+
+	def ancestor(self, tx, depth):
+		# The chain ends where walk_back would stop, so deeper requests
+		# saturate at its end.
+		entries = self.entries
+		(limit, jumps) = entries[tx]
+		depth = min(depth, limit)
+		while depth:
+			k = depth.bit_length() - 1
+			tx = jumps[k]
+			depth -= 1 << k
+			jumps = entries[tx][1]
+		return tx
+
+	def discard(self, tx):
+		self.entries.pop(tx, None)
+
+	def clear(self):
+		self.entries.clear()
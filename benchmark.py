@@ -0,0 +1,292 @@
+import sys, io, time, json, random, platform, argparse, fnmatch, tracemalloc, contextlib
+
+import numpy as np
+import networkx as nx
+
+from iota import Tangle, Node
+from ids import IdAllocator
+from simulation_5 import Simulation, initialize_simulation
+from events import EventSimulation, Latency
+
+# Offline benchmarks for the Tangle/Node hot paths and a scaled simulation_5
+# run. Every case seeds the global generators, builds its fixture outside the
+# clock and times only the hot section; peak memory is the tracemalloc peak
+# above the fixture, taken on a separate traced pass so that tracing does not
+# skew the timings. Results are JSON, and --compare diffs two result files.
+
+def seed_all(seed):
+	random.seed(seed)
+	np.random.seed(seed)
+
+class Clock():
+
+	def __init__(self, trace=False):
+		self.trace = trace
+		self.elapsed = 0.0
+		self.peak = 0
+
+	def __enter__(self):
+		if self.trace:
+			tracemalloc.reset_peak()
+			self.base = tracemalloc.get_traced_memory()[0]
+		self.started = time.perf_counter()
+		return self
+
+	def __exit__(self, *exception):
+		self.elapsed += time.perf_counter() - self.started
+		if self.trace:
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1] - self.base)
+
+def grow_tangle(n_txs, width, backend='networkx', jump=False):
+	# Ticks of `width` transactions, each approving two tips of the tangle as
+	# it was at the start of the tick, which keeps roughly `width` tips alive.
+	# With jump, a first jump starts the ancestor index before anything is
+	# published, so the tangle keeps it up to date as it grows.
+	tangle = Tangle(backend=backend)
+	tangle.add_node(tangle.genesis)
+	if jump:
+		tangle.ancestor(tangle.genesis, 0)
+	tangle.tips.add(tangle.genesis)
+	time_stamp = 1
+	issued = 0
+	while issued < n_txs:
+		tips = list(tangle.tips)
+		for i in range(min(width, n_txs - issued)):
+			parents = random.sample(tips, min(2, len(tips)))
+			tx = tangle.make_transaction('benchmark', time_stamp, parents, i)
+			tangle.publish(tx, parents)
+			issued += 1
+		time_stamp += 1
+	return tangle
+
+def bench_make_transaction(clock, n_txs, ids, backend):
+	tangle = Tangle(backend=backend, allocator=IdAllocator() if ids == 'counter' else None)
+	parents = [tangle.genesis, tangle.genesis]
+	with clock:
+		for i in range(n_txs):
+			tangle.make_transaction('benchmark', i, parents, i)
+	return n_txs, 'tx'
+
+def bench_walk_back(clock, n_txs, width, walks, backend):
+	tangle = grow_tangle(n_txs, width, backend)
+	starts = random.sample(list(tangle.dag), min(walks, len(tangle.dag)))
+	tangle.walk_cache.clear()
+	with clock:
+		for start in starts:
+			tangle.walk_back(start, 14)
+	return len(starts), 'walk'
+
+def bench_ancestor(clock, n_txs, width, walks, depth, jump, backend):
+	# walk_back against what get_sites runs for a jump: the site from the
+	# ancestor index, then weigh_walk for the weights walk_back would leave.
+	tangle = grow_tangle(n_txs, width, backend, jump)
+	starts = random.sample(list(tangle.dag), min(walks, len(tangle.dag)))
+	tangle.walk_cache.clear()
+	with clock:
+		for start in starts:
+			if jump:
+				site = tangle.ancestor(start, depth)
+				tangle.weigh_walk(start, depth, site)
+			else:
+				tangle.walk_back(start, depth)
+	return len(starts), 'walk'
+
+def bench_walk_forward(clock, n_txs, width, steps, backend):
+	tangle = grow_tangle(n_txs, width, backend)
+	nodes = list(tangle.dag)
+	starts = [random.choice(nodes) for _ in range(steps)]
+	with clock:
+		for start in starts:
+			tangle.walk_forward(start, 0.001)
+	return steps, 'step'
+
+def bench_mcmc_select(clock, n_txs, width, selections, backend):
+	tangle = grow_tangle(n_txs, width, backend)
+	with clock:
+		for _ in range(selections):
+			tangle.mcmc_select(n=2, n_sites=10, w=14)
+	return selections, 'selection'
+
+def bench_integrate(clock, n_txs, width, backend):
+	global_tangle = grow_tangle(n_txs, width, backend)
+	node = Node(0, global_tangle, Tangle(backend=backend), 1, 10, [], [], {})
+	txs = list(global_tangle.dag)
+	with clock:
+		for tx in txs:
+			node.integrate(tx)
+	return len(txs), 'tx'
+
+def bench_listen_gossip(clock, n_nodes, npn, tps, bw, ticks, backend, listen_policy=None):
+	global_tangle, nodes = initialize_simulation(n_nodes, npn, tps, bw, backend=backend, listen_policy=listen_policy)
+	messages = 0
+	for time_step in range(ticks):
+		for node in nodes:
+			with clock:
+				node.listen()
+			node.transact()
+			messages += min(len(node.broadcast_queue), bw) * len(node.out)
+			with clock:
+				node.gossip()
+			node.lt.step(node.time)
+			node.time += 1
+		global_tangle.step(time_step)
+	return messages, 'message'
+
+def bench_remove(clock, n_txs, width, backend):
+	tangle = grow_tangle(n_txs, width, backend)
+	root = tangle.get_children(tangle.genesis)[0]
+	before = len(tangle.dag)
+	with clock:
+		tangle.remove(root)
+	return before - len(tangle.dag), 'tx'
+
+def bench_resolve_conflict(clock, n_txs, width, pairs, backend):
+	tangle = grow_tangle(n_txs, width, backend)
+	node = Node(0, tangle, tangle, 1, 10, [], [], {})
+	txs = [tx for tx in tangle.dag if tx != tangle.genesis]
+	conflicts = [random.sample(txs, 2) for _ in range(pairs)]
+	with clock:
+		for (tx1, tx2) in conflicts:
+			node.resolve_conflict(tx1, tx2)
+	return pairs, 'conflict'
+
+def bench_simulation(clock, n_nodes, npn, tps, bw, time_steps, backend, issuance='node'):
+	simulation = Simulation(n_nodes=n_nodes, npn=npn, tps=tps, bw=bw, time_steps=time_steps,
+		make_original_at=time_steps // 4, start_attack_at=time_steps // 2, backend=backend, verbose=False, issuance=issuance)
+	with clock, contextlib.redirect_stdout(io.StringIO()):
+		simulation.run()
+	return time_steps, 'tick', {'txs': len(simulation.tangle.dag)}
+
+def bench_event_simulation(clock, n_nodes, npn, tps, time_steps, latency, backend):
+	simulation = EventSimulation(n_nodes=n_nodes, npn=npn, tps=tps, time_steps=time_steps,
+		make_original_at=time_steps // 4, start_attack_at=time_steps // 4 + 2, backend=backend, verbose=False, latency=Latency(latency, mean=0.5))
+	with clock, contextlib.redirect_stdout(io.StringIO()):
+		simulation.run()
+	return simulation.engine.delivered, 'delivery', {'txs': len(simulation.tangle.dag)}
+
+def cases(quick=False, backends=('networkx', 'array')):
+	scale = 0.1 if quick else 1.0
+	def n(value):
+		return max(int(value * scale), 10)
+
+	for backend in backends:
+		for ids in ('hash', 'counter'):
+			yield 'make_transaction', bench_make_transaction, {'n_txs': n(50000), 'ids': ids, 'backend': backend}
+		for (n_txs, width) in ((1000, 10), (10000, 10), (10000, 100)):
+			yield 'walk_back', bench_walk_back, {'n_txs': n(n_txs), 'width': width, 'walks': n(5000), 'backend': backend}
+			yield 'walk_forward', bench_walk_forward, {'n_txs': n(n_txs), 'width': width, 'steps': n(20000), 'backend': backend}
+			yield 'mcmc_select', bench_mcmc_select, {'n_txs': n(n_txs), 'width': width, 'selections': n(500), 'backend': backend}
+		for depth in (14, 100):
+			for jump in (False, True):
+				yield 'ancestor', bench_ancestor, {'n_txs': n(10000), 'width': 10, 'walks': n(5000), 'depth': depth, 'jump': jump, 'backend': backend}
+		yield 'integrate', bench_integrate, {'n_txs': n(10000), 'width': 10, 'backend': backend}
+		for bw in (2, 10, 50):
+			yield 'listen_gossip', bench_listen_gossip, {'n_nodes': 20, 'npn': 4, 'tps': 20, 'bw': bw, 'ticks': n(100), 'backend': backend}
+			yield 'listen_gossip', bench_listen_gossip, {'n_nodes': 20, 'npn': 4, 'tps': 20, 'bw': bw, 'ticks': n(100), 'backend': backend, 'listen_policy': 'round_robin'}
+		for (n_txs, width) in ((2000, 2), (10000, 20)):
+			yield 'remove', bench_remove, {'n_txs': n(n_txs), 'width': width, 'backend': backend}
+		yield 'resolve_conflict', bench_resolve_conflict, {'n_txs': n(5000), 'width': 10, 'pairs': n(200), 'backend': backend}
+		yield 'simulation', bench_simulation, {'n_nodes': 20, 'npn': 4, 'tps': 20, 'bw': 10, 'time_steps': n(200), 'backend': backend}
+		yield 'simulation', bench_simulation, {'n_nodes': 20, 'npn': 4, 'tps': 20, 'bw': 10, 'time_steps': n(200), 'backend': backend, 'issuance': 'tick'}
+		yield 'events', bench_event_simulation, {'n_nodes': 200, 'npn': 8, 'tps': 20, 'time_steps': n(100), 'latency': 'lognormal', 'backend': backend}
+
+def case_key(name, params):
+	return '{n}[{p}]'.format(n=name, p=','.join('{k}={v}'.format(k=k, v=params[k]) for k in sorted(params)))
+
+def run_case(function, params, seed, trace):
+	seed_all(seed)
+	clock = Clock(trace)
+	outcome = function(clock, **params)
+	(operations, unit) = outcome[:2]
+	extra = outcome[2] if len(outcome) > 2 else {}
+	return clock, operations, unit, extra
+
+def run(seed=0, repeat=3, quick=False, backends=('networkx', 'array'), only=None, memory=True):
+	# Deep recursive walks (integrate, remove) go well past the default limit.
+	sys.setrecursionlimit(max(sys.getrecursionlimit(), 100000))
+	results = {}
+	for (name, function, params) in cases(quick, backends):
+		key = case_key(name, params)
+		if only and not any(fnmatch.fnmatch(key, pattern) for pattern in only):
+			continue
+		try:
+			timings = []
+			for _ in range(repeat):
+				(clock, operations, unit, extra) = run_case(function, params, seed, False)
+				timings.append(clock.elapsed)
+			result = {'name': name, 'params': params, 'operations': operations, 'unit': unit,
+				'seconds': min(timings), 'timings': timings, 'rate': operations / max(min(timings), 1e-12)}
+			for (label, count) in extra.items():
+				result['{l}_per_second'.format(l=label)] = count / max(min(timings), 1e-12)
+			if memory:
+				tracemalloc.start()
+				(clock, _, _, _) = run_case(function, params, seed, True)
+				tracemalloc.stop()
+				result['peak_bytes'] = clock.peak
+		except Exception as error:
+			result = {'name': name, 'params': params, 'error': repr(error)}
+		results[key] = result
+		print(summarize(key, result))
+		sys.stdout.flush()
+	return results
+
+def summarize(key, result):
+	if 'error' in result:
+		return '{k}: failed with {e}'.format(k=key, e=result['error'])
+	line = '{k}: {r:.1f} {u}/s'.format(k=key, r=result['rate'], u=result['unit'])
+	if 'peak_bytes' in result:
+		line += ', peak {m:.2f} MiB'.format(m=result['peak_bytes'] / 2**20)
+	return line
+
+def environment(seed, repeat, quick):
+	return {
+		'python': platform.python_version(),
+		'numpy': np.__version__,
+		'networkx': nx.__version__,
+		'platform': platform.platform(),
+		'seed': seed,
+		'repeat': repeat,
+		'quick': quick,
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+	}
+
+def compare(before_path, after_path):
+	with open(before_path) as handle:
+		before = json.load(handle)['results']
+	with open(after_path) as handle:
+		after = json.load(handle)['results']
+	for key in sorted(set(before) | set(after)):
+		old = before.get(key, {})
+		new = after.get(key, {})
+		if 'rate' not in old or 'rate' not in new:
+			print('{k}: only in {f}'.format(k=key, f=before_path if 'rate' in old else after_path))
+			continue
+		line = '{k}: {o:.1f} -> {n:.1f} {u}/s ({s:.2f}x)'.format(k=key, o=old['rate'], n=new['rate'], u=new['unit'], s=new['rate'] / old['rate'])
+		if 'peak_bytes' in old and 'peak_bytes' in new:
+			line += ', peak {o:.2f} -> {n:.2f} MiB'.format(o=old['peak_bytes'] / 2**20, n=new['peak_bytes'] / 2**20)
+		print(line)
+
+def main(arguments):
+	parser = argparse.ArgumentParser(description="Benchmark the Tangle, Node and simulation_5 hot paths.")
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--quick', action='store_true')
+	parser.add_argument('--backends', default='networkx,array')
+	parser.add_argument('--only', action='append', default=None, help="fnmatch pattern over case keys, e.g. 'mcmc_select*'")
+	parser.add_argument('--no-memory', action='store_true')
+	parser.add_argument('--output', default='benchmark.json')
+	parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), default=None)
+	options = parser.parse_args(arguments[1:])
+
+	if options.compare:
+		compare(*options.compare)
+		return
+
+	results = run(seed=options.seed, repeat=options.repeat, quick=options.quick, backends=options.backends.split(','),
+		only=options.only, memory=not options.no_memory)
+	with open(options.output, 'w') as handle:
+		json.dump({'environment': environment(options.seed, options.repeat, options.quick), 'results': results}, handle, indent=1, sort_keys=True)
+	print("Saved benchmark results to {o}.".format(o=options.output))
+
+if __name__ == '__main__':
+	main(sys.argv)
@@ -0,0 +1,185 @@
+import numpy as np
+
+# Gossip transport for Node.listen/Node.gossip. Every directed connection owns
+# a preallocated ring buffer of integer transaction ids; a broadcast writes one
+# block to all of a node's out-edges at once, and a drain reproduces the
+# round-robin, newest-first pull of Node.listen for all in-edges in one pass.
+# With drop_remaining (the historical behaviour) whatever is left on a link
+# after the bandwidth cap is discarded, otherwise it waits for the next drain.
+# Every message is also stamped with its arrival order, which lets take()
+# serve links first come, first served.
+
+LISTEN_POLICIES = ('round_robin', 'weighted', 'fifo')
+
+def fair_shares(lengths, bandwidth, weights=None):
+	# Splits `bandwidth` messages over links with `lengths` waiting, max-min
+	# fair in proportion to `weights` (equal by default): no link gets more
+	# than it has, and what a short link leaves unused goes to the others.
+	# Whole messages left over go to the largest fractional shares, ties to
+	# the earlier link.
+	lengths = np.asarray(lengths, dtype=np.int64)
+	weights = np.ones(len(lengths)) if weights is None else np.asarray(weights, dtype=np.float64)
+	# A link with messages waiting needs a positive weight to get a share.
+	if not (weights[lengths > 0] > 0).all():
+		raise ValueError("Links with messages waiting need positive weights, not {w}.".format(w=weights.tolist()))
+	if lengths.sum() <= bandwidth:
+		return lengths
+	waiting = np.flatnonzero(lengths)
+	ratios = lengths[waiting] / weights[waiting]
+	order = waiting[np.argsort(ratios, kind='stable')]
+	filled = np.cumsum(lengths[order])
+	rest = weights[order].sum() - np.cumsum(weights[order])
+	# The first link (in order of length per weight) that the fair level
+	# does not cover; every link before it gets everything it has.
+	k = int(np.searchsorted(filled + lengths[order] / weights[order] * rest, bandwidth))
+	level = (bandwidth - (filled[k - 1] if k else 0)) / weights[order[k:]].sum()
+	shares = np.minimum(lengths, level * weights)
+	quotas = np.floor(shares).astype(np.int64)
+	spare = int(bandwidth - quotas.sum())
+	if spare > 0:
+		fractions = np.where(quotas < lengths, shares - quotas, -1.0)
+		quotas[np.argsort(-fractions, kind='stable')[:spare]] += 1
+	return quotas
+
+class MessageBus():
+
+	def __init__(self, connections, capacity=64, drop_remaining=True, queue_limit=100):
+		self.connections = list(connections)
+		self.edges = {connection: e for e, connection in enumerate(self.connections)}
+		self.capacity = capacity
+		self.drop_remaining = drop_remaining
+		self.queue_limit = queue_limit
+		self.buffers = np.zeros((len(self.connections), capacity), dtype=np.int64)
+		self.stamps = np.zeros((len(self.connections), capacity), dtype=np.int64)
+		self.clock = 0
+		self.heads = np.zeros(len(self.connections), dtype=np.int64)
+		self.sizes = np.zeros(len(self.connections), dtype=np.int64)
+
+		incoming = {}
+		outgoing = {}
+		for e, (x, y) in enumerate(self.connections):
+			outgoing.setdefault(x, []).append(e)
+			incoming.setdefault(y, []).append(e)
+		self.incoming = {node: np.array(edges, dtype=np.int64) for node, edges in incoming.items()}
+		self.outgoing = {node: np.array(edges, dtype=np.int64) for node, edges in outgoing.items()}
+
+		self.ids = {}
+		self.names = []
+		self.dropped = 0
+		self.overflowed = 0
+
+	def intern(self, tx):
+		i = self.ids.get(tx)
+		if i is None:
+			i = len(self.names)
+			self.ids[tx] = i
+			self.names.append(tx)
+		return i
+
+	def broadcast(self, node, txs):
+		edges = self.outgoing.get(node)
+		if edges is None or not txs:
+			return
+		block = np.array([self.intern(tx) for tx in txs[-self.capacity:]], dtype=np.int64)
+		positions = (self.heads[edges, None] + self.sizes[edges, None] + np.arange(len(block))) % self.capacity
+		self.buffers[edges[:, None], positions] = block
+		self.stamps[edges[:, None], positions] = self.clock + np.arange(len(block))
+		self.clock += len(block)
+		sizes = self.sizes[edges] + len(block)
+		overflow = np.maximum(sizes - self.capacity, 0)
+		self.overflowed += int(overflow.sum()) + (len(txs) - len(block)) * len(edges)
+		self.heads[edges] = (self.heads[edges] + overflow) % self.capacity
+		self.sizes[edges] = sizes - overflow
+
+	def drain(self, node, bandwidth):
+		edges = self.incoming.get(node)
+		if edges is None:
+			return []
+		lengths = self.sizes[edges]
+		longest = int(lengths.max()) if len(lengths) else 0
+		if longest == 0:
+			return []
+
+		# Pass j pulls the j-th newest message of every link that still has
+		# one, and passes continue while no more than `bandwidth` messages
+		# have been pulled so far.
+		depth = np.arange(longest)
+		available = lengths[None, :] > depth[:, None]
+		totals = np.cumsum(available.sum(axis=1))
+		over = np.flatnonzero(totals > bandwidth)
+		passes = int(over[0]) + 1 if len(over) else longest
+		if self.queue_limit is not None and bandwidth >= self.queue_limit:
+			# Node.listen's queue never grows past its limit, so its loop only
+			# stops once every link is empty.
+			passes = longest
+
+		taken = available[:passes]
+		(j, e) = np.nonzero(taken)
+		positions = (self.heads[edges[e]] + lengths[e] - 1 - j) % self.capacity
+		messages = self.buffers[edges[e], positions]
+		if self.queue_limit is not None:
+			messages = messages[-self.queue_limit:]
+
+		pulled = np.minimum(lengths, passes)
+		if self.drop_remaining:
+			self.dropped += int((lengths - pulled).sum())
+			self.sizes[edges] = 0
+			self.heads[edges] = 0
+		else:
+			self.sizes[edges] = lengths - pulled
+
+		return [self.names[i] for i in messages]
+
+	def backlog(self, node):
+		# How many messages wait on each of the node's in-edges, in the order
+		# of its connections.
+		edges = self.incoming.get(node)
+		if edges is None:
+			return np.zeros(0, dtype=np.int64)
+		return self.sizes[edges].copy()
+
+	def earliest(self, node, bandwidth):
+		# Quotas that serve the node's in-edges first come, first served:
+		# the `bandwidth` messages that arrived first, across all of them.
+		edges = self.incoming.get(node)
+		if edges is None:
+			return np.zeros(0, dtype=np.int64)
+		lengths = self.sizes[edges]
+		if lengths.sum() <= bandwidth:
+			return lengths.copy()
+		(e, j) = np.nonzero(lengths[:, None] > np.arange(int(lengths.max())))
+		stamps = self.stamps[edges[e], (self.heads[edges[e]] + j) % self.capacity]
+		first = np.argpartition(stamps, bandwidth - 1)[:bandwidth]
+		return np.bincount(e[first], minlength=len(edges))
+
+	def take(self, node, quotas, oldest=False):
+		# Pulls quotas[i] messages off the node's i-th in-edge, newest first
+		# like drain, or with oldest the earliest ones in arrival order.
+		edges = self.incoming.get(node)
+		if edges is None:
+			return []
+		lengths = self.sizes[edges]
+		quotas = np.minimum(np.asarray(quotas, dtype=np.int64), lengths)
+		if not quotas.any():
+			messages = np.zeros(0, dtype=np.int64)
+		else:
+			(e, j) = np.nonzero(quotas[:, None] > np.arange(int(quotas.max())))
+			if oldest:
+				positions = (self.heads[edges[e]] + j) % self.capacity
+				order = np.argsort(self.stamps[edges[e], positions], kind='stable')
+				(e, positions) = (e[order], positions[order])
+			else:
+				positions = (self.heads[edges[e]] + lengths[e] - 1 - j) % self.capacity
+			messages = self.buffers[edges[e], positions]
+
+		if self.drop_remaining:
+			self.dropped += int((lengths - quotas).sum())
+			self.sizes[edges] = 0
+			self.heads[edges] = 0
+		elif oldest:
+			self.heads[edges] = (self.heads[edges] + quotas) % self.capacity
+			self.sizes[edges] = lengths - quotas
+		else:
+			self.sizes[edges] = lengths - quotas
+
+		return [self.names[i] for i in messages]
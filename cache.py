@@ -0,0 +1,48 @@
+from collections import OrderedDict, namedtuple
+
+# Bounded per-tangle memo for Tangle's graph lookups. Unlike an lru_cache on
+# the method, each tangle owns its caches, so they die with it, can be
+# invalidated entry by entry when the graph changes, and pickle along with
+# the tangle. cache_info() mirrors functools' for reporting.
+
+MISSING = object()
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+class LRUCache():
+
+	def __init__(self, maxsize=1024):
+		self.maxsize = maxsize
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, key):
+		return key in self.entries
+
+	def lookup(self, key):
+		value = self.entries.get(key, MISSING)
+		if value is MISSING:
+			self.misses += 1
+		else:
+			self.hits += 1
+			self.entries.move_to_end(key)
+		return value
+
+	def store(self, key, value):
+		self.entries[key] = value
+		self.entries.move_to_end(key)
+		if len(self.entries) > self.maxsize:
+			self.entries.popitem(last=False)
+
+	def discard(self, key):
+		self.entries.pop(key, None)
+
+	def clear(self):
+		self.entries.clear()
+
+	def cache_info(self):
+		return CacheInfo(self.hits, self.misses, self.maxsize, len(self.entries))
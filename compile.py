@@ -1,23 +1,37 @@
 import sys
 
-import numpy as np
-
-from data_to_pomdp import data_to_pomdp
+from data_to_pomdp import data_to_pomdp, get_S, encode, ModelCounts, ACTIONS
+from discretization import Discretization
+from trajectory import is_trajectory, read_header, chunks, load_data
 
 def main(arguments):
+	# Trials may be .traj trajectory files or older pickled .npy dicts. They
+	# are counted one at a time, trajectory files chunk by chunk straight from
+	# their memory-mapped codes, so no merged data dict is ever built.
 	trials = arguments[1:]
-	trial_data = []
+
+	# The state space comes from the first trajectory that records one;
+	# pickled trials always used the default discretization.
+	discretization = Discretization()
 	for trial in trials:
-		trial_data.append(np.load(trial).item())
+		if is_trajectory(trial):
+			header, _ = read_header(trial)
+			if 'discretization' in header['params']:
+				discretization = Discretization.from_config(header['params']['discretization'])
+			break
 
-	data = {}
-	data['global'] = []
-	data['local'] = []
-	for trial in trial_data:
-		data['global'].extend(trial['global'])
-		data['local'].extend(trial['local'])
+	counts = ModelCounts(get_S(None, discretization), ACTIONS)
+	for trial in trials:
+		if not is_trajectory(trial):
+			counts.update(load_data(trial))
+			continue
+		for header, records in chunks(trial):
+			states = encode(header['states'], counts.state_codes)
+			actions = encode(header['actions'], counts.action_codes)
+			observations = encode(header['observations'], counts.observation_codes)
+			counts.update_codes(states[records['state']], actions[records['action']], observations[records['observation']])
 
-	data_to_pomdp(data)
+	data_to_pomdp(counts, discretization=discretization)
 
 if __name__ == '__main__':
-	main(sys.argv)
\ No newline at end of file
+	main(sys.argv)
@@ -0,0 +1,76 @@
+# Conflict bookkeeping for a tangle. Transactions spending the same thing
+# share a spend, their id without the '_' prefixes that mark double-spends,
+# so 'x', '_x' and '__x' are alternatives of one spend. The index only keeps
+# spends that have a double-spend in sight, mapped to the alternatives present
+# in the tangle in arrival order, so finding a transaction's rivals is a dict
+# lookup. Spends settled by compaction remember the alternative that stayed.
+
+def spend_of(tx):
+	return tx.lstrip('_') if tx[0] == '_' else tx
+
+class ConflictIndex():
+
+	def __init__(self):
+		self.spends = {}
+		self.settled = {}
+
+	def __len__(self):
+		return len(self.spends)
+
+	def add(self, tx, dag):
+		spend = spend_of(tx)
+		alternatives = self.spends.get(spend)
+		if alternatives is None:
+			if spend == tx:
+				return
+			alternatives = [spend] if spend in dag else []
+			self.spends[spend] = alternatives
+		if tx not in alternatives:
+			alternatives.append(tx)
+
+	def rivals(self, tx):
+		alternatives = self.spends.get(spend_of(tx))
+		if not alternatives:
+			return []
+		return [rival for rival in alternatives if rival != tx]
+
+	def discard(self, tx):
+		spend = spend_of(tx)
+		alternatives = self.spends.get(spend)
+		if alternatives and tx in alternatives:
+			alternatives.remove(tx)
+			if not alternatives:
+				del self.spends[spend]
+
+	def settle(self, tx):
+		spend = spend_of(tx)
+		if spend != tx or spend in self.spends:
+			self.settled[spend] = tx
+
+	def settled_against(self, tx, solid):
+		# Whether another alternative of tx's spend is settled history.
+		spend = spend_of(tx)
+		if spend != tx and spend in solid:
+			return True
+		return self.settled.get(spend, tx) != tx
+
+class Blacklist():
+	# A set, with the append and extend of the list it replaced.
+
+	def __init__(self, txs=()):
+		self.members = set(txs)
+
+	def __len__(self):
+		return len(self.members)
+
+	def __iter__(self):
+		return iter(self.members)
+
+	def __contains__(self, tx):
+		return tx in self.members
+
+	def append(self, tx):
+		self.members.add(tx)
+
+	def extend(self, txs):
+		self.members.update(txs)
@@ -0,0 +1,456 @@
+from array import array
+
+import numpy as np
+
+# Compact storage for a tangle's DAG. Transactions are interned to dense int32
+# ids on the way in and only turned back into strings on the way out, so the
+# node/edge methods below mirror the subset of nx.DiGraph that Tangle and Node
+# use, while the parent/child structure itself lives in flat typed arrays.
+#
+# Each column is an array.array, kept in `_<name>`, with a NumPy view of the
+# same memory in `<name>`. Per-transaction paths (membership, parents and
+# children, single edges, weights) index the array.array, which hands back
+# plain ints instead of NumPy scalars; bulk inserts and removals and the
+# batched walks go through the views. Parent and child rows are stored
+# row-major, so row i of a column `width` wide starts at i * width.
+
+class ArrayGraph():
+
+	def __getstate__(self):
+		# A view would pickle as a copy of its cells; the views are made
+		# again over the unpickled cells instead.
+		state = dict(self.__dict__)
+		for name in self.COLUMNS:
+			del state[name]
+		return state
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		for name in self.COLUMNS:
+			self.view(name)
+
+	def view(self, name):
+		(typecode, dtype, fill, width) = self.COLUMNS[name]
+		column = np.frombuffer(getattr(self, '_' + name), dtype=dtype)
+		if width is not None:
+			column = column.reshape(-1, getattr(self, width))
+		setattr(self, name, column)
+
+	def resize(self, name, length):
+		# New cells for a column, `length` rows long (and as wide as its
+		# width attribute says, for rows), holding the old contents.
+		(typecode, dtype, fill, width) = self.COLUMNS[name]
+		old = getattr(self, name, None)
+		size = length * (getattr(self, width) if width is not None else 1)
+		setattr(self, '_' + name, array(typecode, [fill]) * size)
+		self.view(name)
+		if old is not None:
+			getattr(self, name)[tuple(map(slice, old.shape))] = old
+
+	def __contains__(self, tx):
+		i = self.ids.get(tx)
+		return i is not None and self.present(i)
+
+	def __len__(self):
+		return self.n_alive
+
+	def __iter__(self):
+		return iter(self.nodes)
+
+	@property
+	def nodes(self):
+		names = self.names
+		return [names[i] for i in np.flatnonzero(self.mask()).tolist()]
+
+	def index(self, tx):
+		i = self.ids.get(tx)
+		if i is None or not self.present(i):
+			raise KeyError(tx)
+		return i
+
+	def add_nodes_from(self, txs):
+		for tx in txs:
+			self.add_node(tx)
+
+	def add_edges_from(self, edges):
+		for (u, v) in edges:
+			self.add_edge(u, v)
+
+	def remove_nodes_from(self, txs):
+		for tx in txs:
+			if tx in self:
+				self.remove_node(tx)
+
+	def predecessors(self, tx):
+		names = self.names
+		return [names[i] for i in self.parent_ids(self.index(tx))]
+
+	def successors(self, tx):
+		names = self.names
+		return [names[i] for i in self.child_ids(self.index(tx))]
+
+class ArrayDAG(ArrayGraph):
+
+	# name: (array typecode, NumPy dtype, fill, width attribute for rows)
+	COLUMNS = {
+		'parents': ('i', np.int32, -1, 'max_parents'),
+		'n_parents': ('b', np.int8, 0, None),
+		'children': ('i', np.int32, -1, 'max_children'),
+		'n_children': ('i', np.int32, 0, None),
+		'alive': ('B', np.bool_, 0, None),
+		'time_stamps': ('q', np.int64, -1, None),
+		'weights': ('q', np.int64, 0, None),
+	}
+
+	def __init__(self, capacity=1024, max_parents=2, max_children=4):
+		self.ids = {}
+		self.names = []
+		self.max_parents = max_parents
+		self.max_children = max_children
+		for name in self.COLUMNS:
+			self.resize(name, capacity)
+		self.n_alive = 0
+
+	def __contains__(self, tx):
+		i = self.ids.get(tx)
+		return i is not None and self._alive[i] == 1
+
+	def present(self, i):
+		return self._alive[i] == 1
+
+	def mask(self):
+		return self.alive[:len(self.names)]
+
+	def _grow(self):
+		capacity = 2 * len(self._alive)
+		for name in self.COLUMNS:
+			self.resize(name, capacity)
+
+	def _grow_children(self):
+		self.max_children *= 2
+		self.resize('children', len(self._alive))
+
+	def add_node(self, tx):
+		i = self.ids.get(tx)
+		if i is None:
+			i = len(self.names)
+			if i == len(self._alive):
+				self._grow()
+			self.ids[tx] = i
+			self.names.append(tx)
+		elif self._alive[i]:
+			return i
+		self._alive[i] = 1
+		self.n_alive += 1
+		return i
+
+	def has_edge(self, u, v):
+		if u not in self or v not in self:
+			return False
+		i, j = self.ids[u], self.ids[v]
+		return i in self.parent_ids(j)
+
+	def add_edge(self, u, v):
+		i = self.add_node(u)
+		j = self.add_node(v)
+		n = self._n_parents[j]
+		start = j * self.max_parents
+		if i in self._parents[start:start + n]:
+			return
+		if n == self.max_parents:
+			raise ValueError("Transaction {t} already has {n} parents.".format(t=v, n=n))
+		self._parents[start + n] = i
+		self._n_parents[j] = n + 1
+		m = self._n_children[i]
+		if m == self.max_children:
+			self._grow_children()
+		self._children[i * self.max_children + m] = j
+		self._n_children[i] = m + 1
+
+	def add_nodes_from(self, txs):
+		txs = list(txs)
+		while len(self.names) + len(txs) > len(self._alive):
+			self._grow()
+		for tx in txs:
+			self.add_node(tx)
+
+	def add_edges_from(self, edges):
+		# Appends to the parent and child rows in edge order, as add_edge
+		# one edge at a time would, skipping edges already present.
+		edges = list(edges)
+		if not edges:
+			return
+		for (u, v) in edges:
+			self.add_node(u)
+			self.add_node(v)
+		us = np.array([self.ids[u] for (u, v) in edges], dtype=np.int64)
+		vs = np.array([self.ids[v] for (u, v) in edges], dtype=np.int64)
+		(_, first) = np.unique(us * len(self.names) + vs, return_index=True)
+		first.sort()
+		(us, vs) = (us[first], vs[first])
+		fresh = ~(self.parents[vs] == us[:, None]).any(axis=1)
+		(us, vs) = (us[fresh], vs[fresh])
+
+		slots = self.n_parents[vs] + self._ranks(vs)
+		if len(slots) and slots.max() >= self.max_parents:
+			v = self.names[vs[np.argmax(slots)]]
+			raise ValueError("Transaction {t} already has {n} parents.".format(t=v, n=self.max_parents))
+		columns = self.n_children[us] + self._ranks(us)
+		while len(columns) and columns.max() >= self.max_children:
+			self._grow_children()
+		self.parents[vs, slots] = us
+		self.children[us, columns] = vs
+		np.add.at(self.n_parents, vs, 1)
+		np.add.at(self.n_children, us, 1)
+
+	def _ranks(self, keys):
+		# How many earlier entries share each entry's key.
+		order = np.argsort(keys, kind='stable')
+		ordered = keys[order]
+		starts = np.flatnonzero(np.concatenate(([True], ordered[1:] != ordered[:-1])))
+		sizes = np.diff(np.append(starts, len(keys)))
+		ranks = np.empty(len(keys), dtype=np.int64)
+		ranks[order] = np.arange(len(keys)) - np.repeat(starts, sizes)
+		return ranks
+
+	def _unlink(self, row, count, index, value):
+		n = count[index]
+		values = row[index, :n]
+		keep = values[values != value]
+		row[index, :len(keep)] = keep
+		row[index, len(keep):n] = -1
+		count[index] = len(keep)
+
+	def remove_edge(self, u, v):
+		if not self.has_edge(u, v):
+			raise ValueError("The edge {u}-{v} is not in the tangle.".format(u=u, v=v))
+		i, j = self.ids[u], self.ids[v]
+		self._unlink(self.parents, self.n_parents, j, i)
+		self._unlink(self.children, self.n_children, i, j)
+
+	def remove_node(self, tx):
+		i = self.index(tx)
+		for parent in self.parent_ids(i):
+			self._unlink(self.children, self.n_children, parent, i)
+		for child in self.child_ids(i):
+			self._unlink(self.parents, self.n_parents, child, i)
+		self.parents[i] = -1
+		self.n_parents[i] = 0
+		self.children[i] = -1
+		self.n_children[i] = 0
+		self.time_stamps[i] = -1
+		self.alive[i] = False
+		self.n_alive -= 1
+
+	def remove_nodes_from(self, txs):
+		removed = np.array([self.ids[tx] for tx in txs if tx in self], dtype=np.int64)
+		if not len(removed):
+			return
+		gone = np.zeros(len(self.alive), dtype=bool)
+		gone[removed] = True
+
+		# Survivors next to the removed set keep their remaining links, in
+		# order and left-packed, as _unlink would leave them.
+		neighbours = np.concatenate((self.parents[removed].ravel(), self.children[removed].ravel()))
+		neighbours = np.unique(neighbours[neighbours >= 0])
+		neighbours = neighbours[~gone[neighbours]]
+		for (rows, counts) in ((self.parents, self.n_parents), (self.children, self.n_children)):
+			block = rows[neighbours]
+			keep = (block >= 0) & ~gone[np.maximum(block, 0)]
+			packed = np.take_along_axis(block, np.argsort(~keep, axis=1, kind='stable'), axis=1)
+			kept = keep.sum(axis=1)
+			packed[np.arange(block.shape[1])[None, :] >= kept[:, None]] = -1
+			rows[neighbours] = packed
+			counts[neighbours] = kept
+
+		self.parents[removed] = -1
+		self.n_parents[removed] = 0
+		self.children[removed] = -1
+		self.n_children[removed] = 0
+		self.time_stamps[removed] = -1
+		self.alive[removed] = False
+		self.n_alive -= len(removed)
+
+	def predecessors(self, tx):
+		# parent_ids and index, inlined: Tangle asks on every walk step.
+		i = self.ids.get(tx)
+		if i is None or not self._alive[i]:
+			raise KeyError(tx)
+		names = self.names
+		start = i * self.max_parents
+		return [names[j] for j in self._parents[start:start + self._n_parents[i]]]
+
+	def successors(self, tx):
+		i = self.ids.get(tx)
+		if i is None or not self._alive[i]:
+			raise KeyError(tx)
+		names = self.names
+		start = i * self.max_children
+		return [names[j] for j in self._children[start:start + self._n_children[i]]]
+
+	def parent_ids(self, i):
+		start = i * self.max_parents
+		return self._parents[start:start + self._n_parents[i]].tolist()
+
+	def child_ids(self, i):
+		start = i * self.max_children
+		return self._children[start:start + self._n_children[i]].tolist()
+
+	def child_matrix(self, current):
+		width = max(int(self.n_children[current].max()), 1)
+		children = self.children[current, :width]
+		valid = (children >= 0) & self.alive[current][:, None]
+		return children, valid
+
+	def set_time_stamp(self, tx, time_stamp):
+		if tx in self:
+			self.time_stamps[self.ids[tx]] = time_stamp
+
+# One node's view of a shared ArrayDAG. The transaction structure lives once
+# in the store; the view only records when each transaction became visible
+# locally and which of its parent edges the node has linked, so edges and
+# removals behave exactly like a private DAG would. The store lists children
+# in the order they were published anywhere; each linked edge also gets a
+# rank from a local counter, and children are handed out in rank order, the
+# order a private DAG would have appended them in.
+
+class DAGView(ArrayGraph):
+
+	COLUMNS = {
+		'arrival': ('i', np.int32, -1, None),
+		'linked': ('B', np.uint8, 0, None),
+		'weights': ('i', np.int32, 0, None),
+		'ranks': ('q', np.int64, -1, 'max_parents'),
+	}
+
+	def __init__(self, store):
+		self.store = store
+		self.ids = store.ids
+		self.names = store.names
+		self.max_parents = store.max_parents
+		self.now = 0
+		self.n_links = 0
+		for name in self.COLUMNS:
+			self.resize(name, 0)
+		self.n_alive = 0
+		self._sync()
+
+	def _sync(self):
+		capacity = len(self.store._alive)
+		if len(self._arrival) < capacity:
+			for name in self.COLUMNS:
+				self.resize(name, capacity)
+
+	def present(self, i):
+		return i < len(self._arrival) and self._arrival[i] >= 0
+
+	def mask(self):
+		self._sync()
+		return self.arrival[:len(self.names)] >= 0
+
+	def _slot(self, i, j):
+		start = j * self.store.max_parents
+		parents = self.store._parents[start:start + self.store.max_parents].tolist()
+		if i not in parents:
+			raise ValueError("The edge {u}-{v} is not in the global tangle.".format(u=self.names[i], v=self.names[j]))
+		return parents.index(i)
+
+	def add_node(self, tx):
+		i = self.ids[tx]
+		self._sync()
+		if self._arrival[i] < 0:
+			self._arrival[i] = self.now
+			self.n_alive += 1
+		return i
+
+	def has_edge(self, u, v):
+		if u not in self or v not in self:
+			return False
+		i, j = self.ids[u], self.ids[v]
+		return i in self.store.parent_ids(j) and (self._linked[j] >> self._slot(i, j)) & 1 == 1
+
+	def add_edge(self, u, v):
+		i = self.add_node(u)
+		j = self.add_node(v)
+		slot = self._slot(i, j)
+		if (self._linked[j] >> slot) & 1:
+			return
+		self._linked[j] |= 1 << slot
+		self._ranks[j * self.max_parents + slot] = self.n_links
+		self.n_links += 1
+
+	def remove_edge(self, u, v):
+		if not self.has_edge(u, v):
+			raise ValueError("The edge {u}-{v} is not in the tangle.".format(u=u, v=v))
+		i, j = self.ids[u], self.ids[v]
+		self._linked[j] &= ~(1 << self._slot(i, j))
+
+	def remove_node(self, tx):
+		i = self.index(tx)
+		for child in self.child_ids(i):
+			self._linked[child] &= ~(1 << self._slot(i, child))
+		self._arrival[i] = -1
+		self._linked[i] = 0
+		self.n_alive -= 1
+
+	def parent_ids(self, i):
+		self._sync()
+		linked = self._linked[i]
+		arrival = self._arrival
+		return [parent for (slot, parent) in enumerate(self.store.parent_ids(i)) if (linked >> slot) & 1 and arrival[parent] >= 0]
+
+	def child_ids(self, i):
+		self._sync()
+		arrival = self._arrival
+		linked = self._linked
+		ranks = self._ranks
+		children = []
+		if arrival[i] >= 0:
+			for child in self.store.child_ids(i):
+				slot = self._slot(i, child)
+				if arrival[child] >= 0 and (linked[child] >> slot) & 1:
+					children.append((ranks[child * self.max_parents + slot], child))
+		children.sort()
+		return [child for (rank, child) in children]
+
+	def child_matrix(self, current):
+		self._sync()
+		store = self.store
+		width = max(int(store.n_children[current].max()), 1)
+		children = store.children[current, :width]
+		valid = children >= 0
+		safe = np.where(valid, children, 0)
+		slots = np.arange(store.max_parents)
+		linked = (self.linked[safe][..., None] >> slots) & 1
+		edge = (store.parents[safe] == current[:, None, None]) & (linked == 1)
+		valid &= (self.arrival[safe] >= 0) & edge.any(axis=2) & (self.arrival[current] >= 0)[:, None]
+		# Rank order within each row; invalid cells sort to the end.
+		ranks = np.where(edge, self.ranks[safe], -1).max(axis=2)
+		order = np.argsort(np.where(valid, ranks, np.iinfo(np.int64).max), axis=1, kind='stable')
+		return np.take_along_axis(children, order, axis=1), np.take_along_axis(valid, order, axis=1)
+
+	def set_time_stamp(self, tx, time_stamp):
+		if tx in self:
+			self.store.set_time_stamp(tx, time_stamp)
+
+# Counter-style access to a weight column, so Tangle code that does
+# cumulative_weight[tx] += 1 keeps working while batched walks read the
+# weights straight from the array.
+
+class ArrayWeights():
+
+	def __init__(self, dag):
+		self.dag = dag
+
+	def __getitem__(self, tx):
+		dag = self.dag
+		i = dag.ids.get(tx)
+		if i is None or i >= len(dag._weights):
+			return 0
+		return dag._weights[i]
+
+	def __setitem__(self, tx, weight):
+		dag = self.dag
+		if isinstance(dag, DAGView):
+			dag._sync()
+		dag._weights[dag.ids[tx]] = weight
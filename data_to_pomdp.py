@@ -1,6 +1,4 @@
-from collections import Counter
-
-import itertools
+import numpy as np
 
 """
 discount: 1.0
@@ -26,33 +24,28 @@ R: build : * : * : * -epsilon
 	R: * : * : <win-state> : * 1.0
 """
 
-alphabet = {}
-alphabet[0] = 'a'
-alphabet[1] = 'b'
-alphabet[2] = 'c'
-alphabet[3] = 'd'
-alphabet[4] = 'e'
-alphabet[5] = 'f'
-alphabet[6] = 'g'
-alphabet[7] = 'h'
-alphabet[8] = 'i'
-alphabet[9] = 'j'
-alphabet[10] = 'k'
-
-def data_to_pomdp(data, fname='tangle.POMDP'):
+from discretization import Discretization
+
+ACTIONS = ['back', 'wait', 'build']
+
+def data_to_pomdp(data, fname='tangle.POMDP', discretization=None, prior=1, sparse=True):
+	# With sparse output, rows without any data are written once as uniform
+	# and every other row as a single vector, so the file grows with the rows
+	# that have data, not with |S|^2.
+	if discretization is None:
+		discretization = Discretization()
 	with open(fname,'w') as pomdp_file:
-		S = get_S(data)
-		A = ['back', 'wait', 'build']
-		T = get_T(S, A[1:], data)
-		O = get_O(S, A, data)
+		S = get_S(data, discretization)
+		A = ACTIONS
+		data = counts_for(S, A, data)
 
 		O_states = S
 
-		win_states = get_R(S, A, data)
+		win_states = get_R(S, A, data, discretization)
 
 		discount = 0.9
 		epsilon = -0.0001
-		start = 'a-a'
+		start = discretization.start()
 
 		pomdp_file.write("# Tangle File \n")
 		pomdp_file.write("discount: {f} \n".format(f=discount))
@@ -66,11 +59,22 @@ def data_to_pomdp(data, fname='tangle.POMDP'):
 		pomdp_file.write("T: back : * : {st} 1.0 \n".format(st=start))
 		for win_state in win_states:
 			pomdp_file.write("T: * : {ws} : {st} 1.0 \n".format(ws=win_state, st=start))
-		for (action, start_state, end_state, probability) in T:
-			pomdp_file.write("T: {a} : {ss} : {es} {p} \n".format(a=action, ss=start_state, es=end_state, p=probability))
 
-		for (end_state, observation, probability) in O:
-			pomdp_file.write("O: * : {es} : {o} {p} \n".format(es=end_state, o=observation, p=probability))
+		if sparse:
+			for action in A[1:]:
+				pomdp_file.write("T: {a} : * \nuniform \n".format(a=action))
+				for (row, probabilities) in data.transition_rows(action, prior):
+					write_row(pomdp_file, "T: {a} : {ss}".format(a=action, ss=S[row]), probabilities)
+
+			pomdp_file.write("O: * : * \nuniform \n")
+			for (row, probabilities) in data.observation_rows(prior):
+				write_row(pomdp_file, "O: * : {es}".format(es=S[row]), probabilities)
+		else:
+			for (action, start_state, end_state, probability) in get_T(S, A[1:], data, prior):
+				pomdp_file.write("T: {a} : {ss} : {es} {p} \n".format(a=action, ss=start_state, es=end_state, p=probability))
+
+			for (end_state, observation, probability) in get_O(S, A, data, prior):
+				pomdp_file.write("O: * : {es} : {o} {p} \n".format(es=end_state, o=observation, p=probability))
 
 		pomdp_file.write("R: build : * : * : * {eps} \n".format(eps=epsilon))
 		for win_state in win_states:
@@ -78,83 +82,157 @@ def data_to_pomdp(data, fname='tangle.POMDP'):
 
 	return pomdp_file
 
-def get_S(data):
+def get_S(data, discretization=None):
 	#S = ['(1,0)', '(1,1)', '(1,2)']
-	S = []
-	for i in range(11):
-		for j in range(11):
-			S.append("{}-{}".format(alphabet[i], alphabet[j]))
-	return S
-
-def get_T(S, A, data):
+	if discretization is None:
+		discretization = Discretization()
+	return discretization.states()
+
+class ModelCounts():
+
+	# Transition and observation counts over integer state codes, kept as
+	# sorted (flat index, count) pairs so that only cells seen in the data
+	# take memory. Steps can be fed in chunks (e.g. one trial file at a time);
+	# the last step of a chunk is carried over so the transition into the next
+	# chunk is still counted, exactly as if all chunks had been concatenated.
+
+	def __init__(self, S, A, O_states=None):
+		self.S = list(S)
+		self.A = list(A)
+		self.O_states = list(S if O_states is None else O_states)
+		self.state_codes = {state: i for i, state in enumerate(self.S)}
+		self.action_codes = {action: i for i, action in enumerate(self.A)}
+		self.observation_codes = {observation: i for i, observation in enumerate(self.O_states)}
+		self.transition_keys = np.zeros(0, dtype=np.int64)
+		self.transition_counts = np.zeros(0, dtype=np.int64)
+		self.observation_keys = np.zeros(0, dtype=np.int64)
+		self.observation_counts = np.zeros(0, dtype=np.int64)
+		self.last = None
+
+	@property
+	def transitions(self):
+		return densify(self.transition_keys, self.transition_counts, (len(self.A), len(self.S), len(self.S)))
+
+	@property
+	def observations(self):
+		return densify(self.observation_keys, self.observation_counts, (len(self.S), len(self.O_states)))
+
+	def update(self, data):
+		states = encode([step[0] for step in data['global']], self.state_codes)
+		actions = encode([step[1] for step in data['global']], self.action_codes)
+		observations = encode(data['local'], self.observation_codes)
+		self.update_codes(states, actions, observations)
+
+	def update_codes(self, states, actions, observations):
+		states = np.asarray(states, dtype=np.int64)
+		actions = np.asarray(actions, dtype=np.int64)
+		observations = np.asarray(observations, dtype=np.int64)
+		if len(states) == 0:
+			return
+
+		seen = observations >= 0
+		seen &= states >= 0
+		flat = states[seen] * len(self.O_states) + observations[seen]
+		(self.observation_keys, self.observation_counts) = accumulate(self.observation_keys, self.observation_counts, flat)
+
+		if self.last is not None:
+			(last_state, last_action) = self.last
+			states = np.concatenate(([last_state], states))
+			actions = np.concatenate(([last_action], actions))
+		(start, action, end) = (states[:-1], actions[:-1], states[1:])
+		seen = (start >= 0) & (action >= 0) & (end >= 0)
+		flat = (action[seen] * len(self.S) + start[seen]) * len(self.S) + end[seen]
+		(self.transition_keys, self.transition_counts) = accumulate(self.transition_keys, self.transition_counts, flat)
+		self.last = (states[-1], actions[-1])
+
+	def transition_rows(self, action, prior=1):
+		block = len(self.S) * len(self.S)
+		offset = self.action_codes[action] * block
+		(first, last) = np.searchsorted(self.transition_keys, [offset, offset + block])
+		return sparse_rows(self.transition_keys[first:last] - offset, self.transition_counts[first:last], len(self.S), prior)
+
+	def observation_rows(self, prior=1):
+		return sparse_rows(self.observation_keys, self.observation_counts, len(self.O_states), prior)
+
+def accumulate(keys, counts, flat):
+	(unique, added) = np.unique(flat, return_counts=True)
+	keys = np.concatenate((keys, unique))
+	counts = np.concatenate((counts, added))
+	(keys, inverse) = np.unique(keys, return_inverse=True)
+	return keys, np.bincount(inverse.reshape(-1), weights=counts, minlength=len(keys)).astype(np.int64)
+
+def densify(keys, counts, shape):
+	dense = np.zeros(int(np.prod(shape)), dtype=np.int64)
+	dense[keys] = counts
+	return dense.reshape(shape)
+
+def sparse_rows(keys, counts, n_columns, prior=1):
+	# (row, probabilities) for every row with data. The whole row is returned,
+	# zeros included, since it replaces the uniform row written before it.
+	rows = keys // n_columns
+	columns = keys % n_columns
+	starts = np.flatnonzero(np.diff(rows, prepend=-1))
+	ends = np.append(starts[1:], len(keys))
+	for (first, last) in zip(starts.tolist(), ends.tolist()):
+		row_columns = columns[first:last]
+		row_counts = counts[first:last]
+		total = row_counts.sum() + prior * n_columns
+		dense = np.full(n_columns, prior, dtype=np.float64)
+		dense[row_columns] += row_counts
+		yield int(rows[first]), (dense / total).tolist()
+
+def write_row(pomdp_file, prefix, probabilities):
+	pomdp_file.write("{pr} \n{p} \n".format(pr=prefix, p=' '.join(str(p) for p in probabilities)))
+
+def encode(labels, codes):
+	# Labels missing from `codes` become -1 and are left out of the counts.
+	if len(labels) == 0:
+		return np.zeros(0, dtype=np.int64)
+	(unique, inverse) = np.unique(np.asarray(labels), return_inverse=True)
+	lookup = np.array([codes.get(label, -1) for label in unique.tolist()], dtype=np.int64)
+	return lookup[inverse.reshape(-1)]
+
+def counts_for(S, A, data):
+	if isinstance(data, ModelCounts):
+		return data
+	counts = ModelCounts(S, A)
+	counts.update(data)
+	return counts
+
+def normalize(counts, prior=1):
+	# Rows without any counts (only possible without a prior) are uniform.
+	counts = counts + prior
+	totals = counts.sum(axis=-1, keepdims=True)
+	return np.where(totals > 0, counts / np.maximum(totals, 1e-300), 1.0 / counts.shape[-1])
+
+def get_T(S, A, data, prior=1):
 	#T = [('wait', '(1,0)', '(1,0)', 0.50), ('wait', '(1,0)', '(1,1)', 0.50), ('build', '(1,0)', '(1,1)', 0.50), ('build', '(1,0)', '(1,2)', 0.50), ('build', '(1,1)', '(1,2)', 1.0)]
 	T = []
 
+	counts = counts_for(S, A, data)
+	transitions = counts.transitions
 	for action in A:
-		transition_counters = {}
-		for state in S:
-			transition_counters[state] = Counter()
-
-		for (start_state, end_state) in itertools.product(S, S):
-			transition_counters[start_state][end_state] += 1
-
-		for i, step in enumerate(data['global']):
-			start_state = step[0]
-			if step[1] is not action:
-				continue
-
-			if i == len(data['global']) - 1:
-				break
-			end_state = data['global'][i+1][0]
-			transition_counters[start_state][end_state] += 1
-
-		probabilities = []
-
-		for start_state in transition_counters:
-			total = 0.0
-			for end_state in transition_counters[start_state]:
-				total += transition_counters[start_state][end_state]
-			for end_state in transition_counters[start_state]:
-				T_tuple = (action, start_state, end_state, transition_counters[start_state][end_state] / total)
-				probabilities.append(T_tuple)
-
-		for p in probabilities:
-			T.append(p)
+		probabilities = normalize(transitions[counts.action_codes[action]], prior).tolist()
+		for i, start_state in enumerate(counts.S):
+			for j, end_state in enumerate(counts.S):
+				T.append((action, start_state, end_state, probabilities[i][j]))
 
 	return T
 
-def get_O(S, A, data):
+def get_O(S, A, data, prior=1):
 	#O = [('(1,0)', '(100, 0)', 1.0), ('(1,1)', '(50, 50)', 1.0), ('(1,2)', '(33,67)', 1.0)]
 	O = []
 
-	transition_counters = {}
-	for state in S:
-		transition_counters[state] = Counter()
-
-	for (event, observation) in itertools.product(S, S):
-		transition_counters[event][observation] += 1
-
-	for step, observation in zip(data['global'], data['local']):
-		event = step[0]
-		transition_counters[event][observation] += 1
-
-	for state in transition_counters:
-		total = 0.0
-		for observation in transition_counters[state]:
-			total += transition_counters[state][observation]
-		for observation in transition_counters[state]:
-			O_tuple = (state, observation, transition_counters[state][observation] / total)
-			O.append(O_tuple)
-		
+	counts = counts_for(S, A, data)
+	probabilities = normalize(counts.observations, prior).tolist()
+	for i, state in enumerate(counts.S):
+		for j, observation in enumerate(counts.O_states):
+			O.append((state, observation, probabilities[i][j]))
+
 	return O
 
-def get_R(S, A, data):
+def get_R(S, A, data, discretization=None):
 	#R = ['(1,2)']
-	R = []
-	#for i in range(51, 100):
-	#	for j in range(i+1, 100):
-	#		R.append("({orig},{doub})".format(orig=i, doub=j))
-	for i in range(11):
-		for j in range(i+1, 11):
-			R.append("{orig}-{doub}".format(orig=alphabet[i], doub=alphabet[j]))
-	return R
\ No newline at end of file
+	if discretization is None:
+		discretization = Discretization()
+	return discretization.win_states()
@@ -0,0 +1,69 @@
+import string
+import itertools
+from bisect import bisect_right
+from math import floor
+
+# State discretization shared by simulation_5 (which labels every logged step)
+# and data_to_pomdp (which enumerates the state space). A state is the bucket
+# of the original's and the double-spend's approval share, optionally followed
+# by the bucket of extra features, e.g. the tip count or the ticks since the
+# attack started, each cut at the given edges. Levels are written as letters
+# while they fit (so the default 11x11 space keeps its 'a-a' ... 'k-k' labels)
+# and as zero-padded numbers otherwise.
+
+FEATURES = ('tips', 'since_attack')
+
+class Discretization():
+
+	def __init__(self, buckets=11, tips=(), since_attack=()):
+		self.buckets = buckets
+		self.edges = {'tips': list(tips), 'since_attack': list(since_attack)}
+		self.features = [feature for feature in FEATURES if self.edges[feature]]
+		self.levels = [buckets, buckets] + [len(self.edges[feature]) + 1 for feature in self.features]
+
+	def config(self):
+		config = {'buckets': self.buckets}
+		for feature in self.features:
+			config[feature] = self.edges[feature]
+		return config
+
+	@classmethod
+	def from_config(cls, config):
+		return cls(**config)
+
+	def weight_bucket(self, count, n_tips):
+		if not n_tips:
+			return 0
+		return min(floor(count * ((self.buckets - 1) / n_tips)), self.buckets - 1)
+
+	def feature_buckets(self, n_tips, since_attack):
+		values = {'tips': n_tips, 'since_attack': since_attack}
+		return [bisect_right(self.edges[feature], values[feature]) for feature in self.features]
+
+	def symbol(self, level, n_levels):
+		if n_levels <= len(string.ascii_lowercase):
+			return string.ascii_lowercase[level]
+		return str(level).zfill(len(str(n_levels - 1)))
+
+	def label(self, codes):
+		return '-'.join(self.symbol(code, n_levels) for code, n_levels in zip(codes, self.levels))
+
+	def state(self, original, double_spend, n_tips, since_attack=0):
+		codes = [self.weight_bucket(original, n_tips), self.weight_bucket(double_spend, n_tips)]
+		return self.label(codes + self.feature_buckets(n_tips, since_attack))
+
+	def states(self):
+		return [self.label(codes) for codes in itertools.product(*[range(n_levels) for n_levels in self.levels])]
+
+	def start(self):
+		return self.label([0] * len(self.levels))
+
+	def win_states(self):
+		# The double-spend has a strictly larger share than the original.
+		extras = list(itertools.product(*[range(n_levels) for n_levels in self.levels[2:]]))
+		states = []
+		for i in range(self.buckets):
+			for j in range(i + 1, self.buckets):
+				for extra in extras:
+					states.append(self.label([i, j] + list(extra)))
+		return states
@@ -0,0 +1,232 @@
+import heapq
+from itertools import count
+from math import log
+
+import numpy as np
+
+import simulation_5
+from simulation_5 import Simulation, output_name
+
+# Discrete-event stepping for the iota Node model. Instead of every node
+# listening, transacting and gossiping once per tick, each node issues
+# transactions as a Poisson process in continuous time and every gossiped
+# transaction reaches each neighbour after a latency drawn for that link, so
+# the run is a single heap of (time, sequence, event) entries. A node with
+# nothing arriving and nothing to issue has no entries and costs nothing.
+# With uplink on, a node's bandwidth caps its uplink: it puts one transaction
+# on the wire every 1/bw ticks, transactions wait their turn behind earlier
+# ones, and once as many wait as its broadcast queue holds, new ones are
+# dropped.
+# Ticks remain the unit of time: transactions are stamped with the tick they
+# were issued in, local tangles step when their node first acts in a tick,
+# and EventSimulation observes at tick boundaries like simulation_5.
+
+ISSUE = 0
+DELIVER = 1
+CALL = 2
+
+LATENCY_KINDS = ('constant', 'exponential', 'lognormal', 'uniform')
+
+class Latency():
+
+	def __init__(self, kind='constant', mean=1.0, sigma=0.5, low=0.0, high=1.0):
+		if kind not in LATENCY_KINDS:
+			raise ValueError("Unknown latency distribution {k}.".format(k=kind))
+		self.kind = kind
+		self.mean = mean
+		self.sigma = sigma
+		self.low = low
+		self.high = high
+
+	def sample(self, np_rng, size=None):
+		if self.kind == 'constant':
+			return self.mean if size is None else np.full(size, self.mean)
+		if self.kind == 'exponential':
+			return np_rng.exponential(self.mean, size)
+		if self.kind == 'lognormal':
+			# Parameterized by its mean rather than by the mean of its log.
+			return np_rng.lognormal(log(self.mean) - self.sigma ** 2 / 2, self.sigma, size)
+		return np_rng.uniform(self.low, self.high, size)
+
+class EventEngine():
+
+	def __init__(self, nodes, latency=None, link_latency=None, uplink=False, np_rng=np.random):
+		# `latency` applies to every link unless `link_latency` maps the
+		# connection to a Latency of its own.
+		self.nodes = {node.name: node for node in nodes}
+		self.latency = latency or Latency()
+		self.link_latency = link_latency or {}
+		self.uplink = uplink
+		self.np_rng = np_rng
+		self.queue = []
+		self.sequence = count()
+		self.uplink_free = {}
+		self.now = 0.0
+		self.issued = 0
+		self.processed = 0
+		self.delivered = 0
+		self.duplicates = 0
+		self.dropped = 0
+		self.instruments = None
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if self.np_rng is np.random:
+			state['np_rng'] = None
+		state['sequence'] = next(self.sequence)
+		return state
+
+	def __setstate__(self, state):
+		if state['np_rng'] is None:
+			state['np_rng'] = np.random
+		state['sequence'] = count(state['sequence'])
+		self.__dict__.update(state)
+
+	def __len__(self):
+		return len(self.queue)
+
+	def schedule(self, time, kind, first=None, second=None):
+		heapq.heappush(self.queue, (time, next(self.sequence), kind, first, second))
+
+	def at(self, time, callback):
+		self.schedule(time, CALL, callback)
+
+	def start(self):
+		# First issuance of every node that issues at all, in one draw.
+		nodes = [node for node in self.nodes.values() if node.tps > 0]
+		gaps = self.np_rng.exponential(1.0 / np.array([node.tps for node in nodes], dtype=np.float64))
+		for (node, gap) in zip(nodes, gaps):
+			self.schedule(self.now + gap, ISSUE, node.name)
+
+	def run(self, until):
+		queue = self.queue
+		while queue and queue[0][0] < until:
+			(time, _, kind, first, second) = heapq.heappop(queue)
+			self.now = time
+			self.processed += 1
+			if kind == DELIVER:
+				self.deliver(first, second, time)
+			elif kind == ISSUE:
+				self.issue(self.nodes[first], time)
+			else:
+				first()
+		self.now = until
+		if self.instruments is not None:
+			self.instruments.count('events', self.processed)
+			self.processed = 0
+
+	def wake(self, node, time):
+		tick = int(time)
+		if tick > node.time:
+			node.time = tick
+			node.lt.step(tick)
+
+	def issue(self, node, time):
+		self.wake(node, time)
+		self.schedule(time + self.np_rng.exponential(1.0 / node.tps), ISSUE, node.name)
+		parents = node.select_batch(1)[0]
+		if not parents:
+			return
+		# The issue count keeps ids apart when a node approves the same tips
+		# twice within a tick.
+		tx = node.lt.make_transaction(node.name, node.time, parents, self.issued)
+		self.issued += 1
+		node.publish(tx, parents)
+		node.integrate(tx)
+		self.gossip(node, [tx], time)
+
+	def deliver(self, connection, tx, time):
+		node = self.nodes[connection[1]]
+		self.wake(node, time)
+		self.delivered += 1
+		if node.receive(tx):
+			self.gossip(node, [tx], time, exclude=connection[0])
+		else:
+			self.duplicates += 1
+			if self.instruments is not None:
+				self.instruments.count('duplicates')
+
+	def gossip(self, node, txs, time, exclude=None):
+		if self.uplink and node.bw:
+			free = max(time, self.uplink_free.get(node.name, time))
+			if node.broadcast_queue.maxlen is not None:
+				room = max(int(round((time - free) * node.bw)) + node.broadcast_queue.maxlen, 0)
+				if room < len(txs):
+					self.dropped += len(txs) - room
+					if self.instruments is not None:
+						self.instruments.count('dropped', len(txs) - room)
+					txs = txs[:room]
+			sent = free + np.arange(1, len(txs) + 1) / node.bw
+			self.uplink_free[node.name] = sent[-1] if len(txs) else free
+		else:
+			sent = np.full(len(txs), time)
+		for connection in node.out:
+			if connection[1] == exclude:
+				continue
+			latency = self.link_latency.get(connection, self.latency)
+			delays = latency.sample(self.np_rng, len(txs))
+			for (tx, at) in zip(txs, sent + delays):
+				self.schedule(float(at), DELIVER, connection, tx)
+
+	def flush(self, node, time=None):
+		# Sends whatever the node queued for broadcast outside the engine,
+		# e.g. an adversary's original transaction or its double-spend.
+		txs = list(node.broadcast_queue)
+		node.broadcast_queue.clear()
+		self.gossip(node, txs, self.now if time is None else time)
+
+class EventSimulation(Simulation):
+
+	def __init__(self, latency=None, link_latency=None, uplink=False, **params):
+		self.latency = latency
+		self.link_latency = link_latency
+		self.uplink = uplink
+		Simulation.__init__(self, **params)
+		if self.instruments is not None:
+			self.engine.instruments = self.instruments
+
+	def initialize(self):
+		if self.message_bus:
+			raise ValueError("Event runs deliver gossip themselves and take no message bus.")
+		if self.issuance != 'node':
+			raise ValueError("Event runs issue transactions per node, not per tick.")
+		if self.listen_policy is not None:
+			raise ValueError("Event runs deliver transactions one at a time and take no listen policy.")
+		Simulation.initialize(self)
+		self.engine = EventEngine(self.nodes, latency=self.latency, link_latency=self.link_latency, uplink=self.uplink)
+		self.engine.start()
+
+	def params(self):
+		params = Simulation.params(self)
+		params['engine'] = 'events'
+		params['latency'] = vars(self.engine.latency)
+		params['uplink'] = self.uplink
+		return params
+
+	def advance(self):
+		time_step = self.time_step
+		launch = self.scheduled(time_step, self.make_original_at)
+		strike = self.scheduled(time_step, self.start_attack_at)
+		for adversary in self.nodes[:self.adversaries]:
+			if not (launch or strike):
+				break
+			self.engine.wake(adversary, time_step)
+			if launch:
+				self.launch(adversary)
+			if strike:
+				adversary.transact_double_spend()
+				self.struck(adversary)
+			self.engine.flush(adversary, time_step)
+		self.engine.run(until=time_step + 1)
+		self.tangle.step(time_step)
+
+def main():
+	simulation = EventSimulation(n_nodes=simulation_5.N_NODES, npn=simulation_5.NEIGHBORS_PER_NODE, tps=simulation_5.TPS, bw=simulation_5.BANDWIDTH_LIMIT,
+		time_steps=simulation_5.TIME_STEPS, make_original_at=simulation_5.MAKE_ORIGINAL_AT, start_attack_at=simulation_5.START_ATTACK_AT,
+		backend=simulation_5.BACKEND, tip_selection=simulation_5.TIP_SELECTION, ids=simulation_5.IDS, compaction=simulation_5.COMPACTION,
+		latency=Latency('lognormal', mean=0.5, sigma=0.5),
+		trajectory=output_name(simulation_5.N_NODES, simulation_5.NEIGHBORS_PER_NODE, simulation_5.TPS, simulation_5.BANDWIDTH_LIMIT) + 'E.traj')
+	simulation.run()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,52 @@
+import hashlib
+
+# Counter ids for Tangle.make_transaction. One allocator is shared by the
+# global and every local tangle, so ids are unique network-wide; an id is the
+# decimal string of a counter, which keeps the '_' prefix of double-spends
+# working. The sha3 content hash a hash-mode tangle would have given a
+# transaction is only computed (and memoized) when asked for, from the
+# recorded issuer, time and parents; sweep results name transactions by it.
+
+GENESIS = '0'
+
+class IdAllocator():
+
+	def __init__(self):
+		self.records = [(None, None, [], None)]
+		self.hashes = {}
+
+	def __len__(self):
+		return len(self.records)
+
+	def allocate(self, node_name, time_stamp, parents, nonce=None):
+		n = len(self.records)
+		self.records.append((node_name, time_stamp, list(parents), nonce))
+		return str(n)
+
+	def content_hash(self, tx):
+		# Parents always hold lower ids, but a deep tangle would still overflow
+		# a recursive walk, so unhashed ancestors are resolved from a stack.
+		stack = [tx]
+		while stack:
+			current = stack[-1]
+			if current in self.hashes:
+				stack.pop()
+				continue
+			if current[0] == '_':
+				if current[1:] in self.hashes:
+					self.hashes[current] = '_' + self.hashes[current[1:]]
+					stack.pop()
+				else:
+					stack.append(current[1:])
+				continue
+			(node_name, time_stamp, parents, nonce) = self.records[int(current)]
+			missing = [parent for parent in parents if parent not in self.hashes]
+			if missing:
+				stack.extend(missing)
+				continue
+			base_tx = (node_name, time_stamp, [self.hashes[parent] for parent in parents])
+			if nonce is not None:
+				base_tx += (nonce,)
+			self.hashes[current] = hashlib.sha3_224(str(base_tx).encode()).hexdigest()
+			stack.pop()
+		return self.hashes[tx]
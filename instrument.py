@@ -0,0 +1,88 @@
+import json
+from time import perf_counter
+from collections import Counter
+
+import numpy as np
+
+# Optional run instrumentation. Tangles, nodes and the simulation hold an
+# `instruments` attribute that is None unless instrumentation is switched on,
+# and every hook is guarded by that check, so a run without it pays for
+# nothing but the test. Phase timers are inclusive (listen contains the
+# integrate and conflict work it triggers), counters are plain totals, and
+# per-tick series live in arrays allocated up front for the whole run.
+
+class Phase():
+
+	def __init__(self, instruments, name):
+		self.instruments = instruments
+		self.name = name
+
+	def __enter__(self):
+		self.started = perf_counter()
+
+	def __exit__(self, *exception):
+		self.instruments.seconds[self.name] += perf_counter() - self.started
+		self.instruments.calls[self.name] += 1
+
+class Instruments():
+
+	def __init__(self, ticks=0):
+		self.ticks = ticks
+		self.seconds = Counter()
+		self.calls = Counter()
+		self.counters = Counter()
+		self.series = {}
+		self.caches = {}
+
+	def phase(self, name):
+		return Phase(self, name)
+
+	def count(self, name, n=1):
+		self.counters[name] += n
+
+	def record(self, name, tick, value):
+		values = self.series.get(name)
+		if values is None:
+			values = np.zeros(self.ticks, dtype=np.float64)
+			self.series[name] = values
+		if 0 <= tick < len(values):
+			values[tick] = value
+
+	def watch_cache(self, name, cache):
+		# Anything with lru_cache's cache_info(); read when summarizing, and
+		# summed over all caches watched under one name.
+		self.caches.setdefault(name, []).append(cache)
+
+	def cache_stats(self):
+		stats = {}
+		for name, caches in self.caches.items():
+			infos = [cache.cache_info() for cache in caches]
+			hits = sum(info.hits for info in infos)
+			misses = sum(info.misses for info in infos)
+			size = sum(info.currsize for info in infos)
+			stats[name] = {'hits': hits, 'misses': misses, 'size': size, 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+		return stats
+
+	def summary(self):
+		return {
+			'phases': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in self.seconds},
+			'counters': dict(self.counters),
+			'caches': self.cache_stats(),
+			'series': {name: values.tolist() for name, values in self.series.items()},
+		}
+
+	def report(self):
+		lines = []
+		for name in sorted(self.seconds, key=lambda name: -self.seconds[name]):
+			lines.append('{n:>12}: {s:9.3f}s over {c} calls'.format(n=name, s=self.seconds[name], c=self.calls[name]))
+		for name in sorted(self.counters):
+			lines.append('{n:>12}: {c}'.format(n=name, c=self.counters[name]))
+		for name, stats in sorted(self.cache_stats().items()):
+			lines.append('{n:>12}: {h} hits, {m} misses ({r:.1%}), {s} entries'.format(n=name, h=stats['hits'], m=stats['misses'], r=stats['hit_rate'], s=stats['size']))
+		for name, values in sorted(self.series.items()):
+			lines.append('{n:>12}: mean {m:.3f}, max {x:.3f} per tick'.format(n=name, m=values.mean() if len(values) else 0, x=values.max() if len(values) else 0))
+		return '\n'.join(lines)
+
+	def dump(self, path):
+		with open(path, 'w') as handle:
+			json.dump(self.summary(), handle, indent=1, sort_keys=True)
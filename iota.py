@@ -1,29 +1,131 @@
 from math import floor, exp
-from random import choice, randint, random, sample
+import random
 from collections import Counter, deque
 
-from functools import lru_cache
-
 import numpy as np
 import networkx as nx
 
 import hashlib
 
+from dag import ArrayDAG, DAGView, ArrayWeights
+from tips import TipSet
+from bus import MessageBus, LISTEN_POLICIES, fair_shares
+from ids import GENESIS
+from cache import LRUCache, MISSING
+from ancestors import AncestorIndex
+from conflicts import ConflictIndex, Blacklist
+
+BACKENDS = ('networkx', 'array', 'view')
+ARRAY_BACKENDS = ('array', 'view')
+
+WALK_CACHE_SIZE = 2048
+PARENT_CACHE_SIZE = 2048
+CHILD_CACHE_SIZE = 1024
+
+# Start depth for 'mcmc_jump' tip selection, deep enough that walkers start
+# in settled history rather than among the tips.
+JUMP_DEPTH = 100
+
+COMPACTION_KEYS = ('max_age', 'max_depth', 'every', 'horizon')
+
 class Tangle():
 
-	def __init__(self, verbose=False):
-		self.dag = nx.DiGraph()
-		self.tips = []
+	def __init__(self, verbose=False, backend='networkx', store=None, rng=random, np_rng=np.random, allocator=None, compaction=None):
+		if backend not in BACKENDS:
+			raise ValueError("Unknown tangle backend {b}.".format(b=backend))
+		self.backend = backend
+		if backend == 'view':
+			if store is None or store.backend != 'array':
+				raise ValueError("A view tangle needs an array-backed store tangle.")
+			self.dag = DAGView(store.dag)
+		elif backend == 'array':
+			self.dag = ArrayDAG()
+		else:
+			self.dag = nx.DiGraph()
+		# Randomness goes through rng/np_rng, which default to the global
+		# random and np.random modules; giving each node its own generators
+		# makes its behaviour independent of how other nodes are scheduled.
+		self.rng = rng
+		self.np_rng = np_rng
+		self.tips = TipSet(rng=rng)
 		#self.tips = deque(maxlen=100)
 		self.n_tips = 0
-		self.cumulative_weight = Counter()
+		if backend in ARRAY_BACKENDS:
+			self.cumulative_weight = ArrayWeights(self.dag)
+		else:
+			self.cumulative_weight = Counter()
 		self.verbose = verbose
 		#self.log = {"tps": Counter(), "uctps": Counter(), "ctps": Counter(), 'verbose': []}
-		self.genesis = self.make_transaction(None, None, [])
-		self.blacklist = []
+		# With an IdAllocator, transactions get counter ids instead of sha3
+		# hashes; content_hash recovers the hash for results that leave the run.
+		self.allocator = allocator
+		if allocator is not None:
+			self.genesis = GENESIS
+		else:
+			self.genesis = self.make_transaction(None, None, [])
+		# Losing alternatives and their cones.
+		self.blacklist = Blacklist()
+		self.conflicts = ConflictIndex()
+		# Approval index: every tracked transaction owns one bit, and each
+		# transaction's mask holds the bits of the tracked transactions it
+		# approves (itself included), inherited from its parents on add_edge.
+		self.tracked = {}
+		self.approvals = {}
+		self.free_bits = []
+		self.journal = None
+		self.instruments = None
+		# Per-tangle memos for walk_back, get_parents and get_children. Graph
+		# mutations go through add_node, add_edge and remove, which drop the
+		# entries they make stale.
+		self.walk_cache = LRUCache(WALK_CACHE_SIZE)
+		# The depths each transaction has been walked back from, as a bit
+		# mask. A walk weighs its path only the first time, as it did under
+		# walk_back's original unbounded memo, however often the bounded one
+		# above evicts or drops it; entries go when their transaction does.
+		self.weighed = {}
+		self.parent_cache = LRUCache(PARENT_CACHE_SIZE)
+		self.child_cache = LRUCache(CHILD_CACHE_SIZE)
+		self.ancestors = AncestorIndex()
+		# Compaction retires old, confirmed history into the solid set: it
+		# leaves the DAG, so walks stop at the frontier it leaves behind, and
+		# is never integrated again. `compaction` holds max_age (ticks since
+		# arrival) and/or max_depth (parent hops from the nearest tip), and
+		# runs from step every `every` ticks. Retired transactions stay in
+		# solid, with the tick they retired at, for `horizon` ticks (max_age
+		# unless given; without either, for good), long enough for late
+		# copies and children of them to be recognised.
+		if compaction is not None:
+			unknown = set(compaction) - set(COMPACTION_KEYS)
+			if unknown:
+				raise ValueError("Unknown compaction settings {u}.".format(u=sorted(unknown)))
+		self.compaction = compaction
+		self.solid = {}
+		self.arrival_ticks = {}
+		self.now = 0
 
-	def make_transaction(self, node_name, time_stamp, parents):
+	def __getstate__(self):
+		# The random and np.random modules cannot be pickled; a tangle drawing
+		# from them is restored drawing from them again.
+		state = self.__dict__.copy()
+		if self.rng is random:
+			state['rng'] = None
+		if self.np_rng is np.random:
+			state['np_rng'] = None
+		return state
+
+	def __setstate__(self, state):
+		if state['rng'] is None:
+			state['rng'] = random
+		if state['np_rng'] is None:
+			state['np_rng'] = np.random
+		self.__dict__.update(state)
+
+	def make_transaction(self, node_name, time_stamp, parents, nonce=None):
+		if self.allocator is not None:
+			return self.allocator.allocate(node_name, time_stamp, parents, nonce)
 		base_tx = (node_name, time_stamp, parents)
+		if nonce is not None:
+			base_tx += (nonce,)
 		tx = hashlib.sha3_224(str(base_tx).encode()).hexdigest()
 
 		#if (self.verbose):
@@ -32,26 +134,221 @@ class Tangle():
 
 		if time_stamp:
 			#self.log['tps'][int(time_stamp)] += 1
-			nx.set_node_attributes(self.dag, name='time_stamp', values={tx: time_stamp})
+			self.set_time_stamp(tx, time_stamp)
+		return tx
+
+	def content_hash(self, tx):
+		if self.allocator is not None:
+			return self.allocator.content_hash(tx)
 		return tx
 
-	
-	@lru_cache(maxsize=None)
+	def set_time_stamp(self, tx, time_stamp):
+		if self.backend in ARRAY_BACKENDS:
+			self.dag.set_time_stamp(tx, time_stamp)
+		else:
+			nx.set_node_attributes(self.dag, name='time_stamp', values={tx: time_stamp})
+
+	def add_node(self, tx):
+		# Once a jump has started the ancestor index, new transactions join
+		# it as they arrive.
+		if self.ancestors and tx not in self.dag:
+			self.ancestors.root(tx)
+		self.dag.add_node(tx)
+		self.index_node(tx)
+
+	def add_edge(self, parent, tx):
+		self.dag.add_edge(parent, tx)
+		self.index_edge(parent, tx)
+
+	def index_node(self, tx):
+		self.conflicts.add(tx, self.dag)
+		if self.compaction is not None:
+			self.arrival_ticks.setdefault(tx, self.now)
+		self.parent_cache.discard(tx)
+		self.child_cache.discard(tx)
+
+	def index_edge(self, parent, tx):
+		self.parent_cache.discard(tx)
+		self.parent_cache.discard(parent)
+		self.child_cache.discard(tx)
+		self.child_cache.discard(parent)
+		if self.ancestors:
+			self.ancestors.extend(tx, parent)
+		mask = self.approvals.get(parent)
+		if mask:
+			self.approvals[tx] = self.approvals.get(tx, 0) | mask
+
+	def publish(self, tx, parents):
+		self.add_node(tx)
+		self.tips.add(tx)
+
+		for parent in parents:
+			self.add_edge(parent, tx)
+			if parent in self.tips:
+				#print("Confirmed a tip.")
+				self.tips.remove(parent)
+				#self.log['ctps'][self.time] += 1
+			#else:
+			#	print("Confirmed a non-tip.")
+		#print('')
+
+		if self.journal is not None:
+			self.journal.append((tx, parents))
+
+	def publish_many(self, entries):
+		# publish for a batch of (tx, parents), in order, with the DAG
+		# updated in two bulk inserts; the tangle ends up as it would after
+		# publishing them one by one.
+		dag = self.dag
+		if self.ancestors:
+			for (tx, parents) in entries:
+				if tx not in dag:
+					self.ancestors.root(tx)
+		dag.add_nodes_from([tx for (tx, parents) in entries])
+		dag.add_edges_from([(parent, tx) for (tx, parents) in entries for parent in parents])
+
+		for (tx, parents) in entries:
+			self.index_node(tx)
+			self.tips.add(tx)
+			for parent in parents:
+				self.index_edge(parent, tx)
+				if parent in self.tips:
+					self.tips.remove(parent)
+
+		if self.journal is not None:
+			self.journal.extend(entries)
+
+	def track(self, tx):
+		if tx in self.tracked:
+			return self.tracked[tx]
+		if tx not in self.dag:
+			raise ValueError("Cannot track transactions not in tangle.")
+		if self.free_bits:
+			bit = self.free_bits.pop()
+		else:
+			bit = len(self.tracked)
+		self.tracked[tx] = bit
+		flag = 1 << bit
+		seen = {tx}
+		stack = [tx]
+		while stack:
+			current = stack.pop()
+			self.approvals[current] = self.approvals.get(current, 0) | flag
+			for child in self.dag.successors(current):
+				if child not in seen:
+					seen.add(child)
+					stack.append(child)
+		return bit
+
+	def untrack(self, tx):
+		# Frees tx's bit, clearing it from tx and everything approving it,
+		# the only transactions that carry it.
+		bit = self.tracked.pop(tx, None)
+		if bit is None:
+			return
+		flag = ~(1 << bit)
+		approvals = self.approvals
+		for current in self.cone(tx):
+			mask = approvals.get(current, 0) & flag
+			if mask:
+				approvals[current] = mask
+			else:
+				approvals.pop(current, None)
+		self.free_bits.append(bit)
+
+	def approves(self, tracked_tx, tx):
+		return (self.approvals.get(tx, 0) >> self.tracked[tracked_tx]) & 1 == 1
+
+	def approval_count(self, tracked_tx, tips=None):
+		if tips is None:
+			tips = self.tips
+		bit = self.tracked[tracked_tx]
+		approvals = self.approvals
+		count = 0
+		for tip in tips:
+			count += (approvals.get(tip, 0) >> bit) & 1
+		return count
+
+	def approval_weight(self, tracked_tx):
+		return 1 + self.approval_count(tracked_tx)
+
 	def walk_back(self, start, depth):
+		end = self.walk_cache.lookup((start, depth))
+		if end is not MISSING:
+			return end
 		if start not in self.dag:
 			raise ValueError("Cannot walk transactions not in tangle.")
+		end = start
 		if depth > 0:
 			parents = self.get_parents(start)
 			if parents:
-				if len(parents) > 1:
-					parent = parents[0]
+				weighed = self.weighed.get(start, 0)
+				if (weighed >> depth) & 1:
+					# Weighed before and since dropped from the memo: only
+					# the end is found again.
+					end = self.trace_back(parents[0], depth - 1)
 				else:
-					parent = choice(parents)
-					self.cumulative_weight[parent] += 1
-					#print("Updated weight of {t}.".format(t=parent))
-				return self.walk_back(parent, depth - 1)
+					self.weighed[start] = weighed | (1 << depth)
+					if len(parents) > 1:
+						parent = parents[0]
+					else:
+						parent = self.rng.choice(parents)
+						self.cumulative_weight[parent] += 1
+						#print("Updated weight of {t}.".format(t=parent))
+					end = self.walk_back(parent, depth - 1)
+		self.walk_cache.store((start, depth), end)
+		return end
+
+	def trace_back(self, start, depth):
+		# Where walk_back(start, depth) ends, without weighing or drawing.
+		while depth > 0:
+			parents = self.get_parents(start)
+			if not parents:
+				break
+			start = parents[0]
+			depth -= 1
 		return start
-	
+
+	def ancestor(self, start, depth):
+		# Where walk_back(start, depth) ends, in O(log depth) through the
+		# ancestor index, but without bumping cumulative weights on the way.
+		if start not in self.dag:
+			raise ValueError("Cannot walk transactions not in tangle.")
+		ancestors = self.ancestors
+		if start not in ancestors:
+			chain = []
+			current = start
+			while current not in ancestors:
+				parents = self.get_parents(current)
+				if not parents:
+					ancestors.root(current)
+					break
+				chain.append((current, parents[0]))
+				current = parents[0]
+			for (tx, parent) in reversed(chain):
+				ancestors.link(tx, parent)
+		return ancestors.ancestor(start, depth)
+
+	def weigh_walk(self, start, depth, end):
+		# Bumps the cumulative weights walk_back(start, depth) would, without
+		# recursing: it stops where walk_back would find the walk already
+		# weighed, so walks that meet an earlier one weigh only the part that
+		# is new. That part is still stepped hop by hop, since each hop leaves
+		# the record and weight a later walk_back depends on, so a jump costs
+		# O(log w) for the site and up to O(w) for the weights.
+		while depth > 0:
+			weighed = self.weighed.get(start, 0)
+			if (weighed >> depth) & 1:
+				break
+			self.weighed[start] = weighed | (1 << depth)
+			self.walk_cache.store((start, depth), end)
+			parents = self.get_parents(start)
+			if not parents:
+				break
+			if len(parents) == 1:
+				self.cumulative_weight[parents[0]] += 1
+			start = parents[0]
+			depth -= 1
 
 	def walk_forward(self, start, alpha):
 		if start not in self.dag:
@@ -63,9 +360,9 @@ class Tangle():
 			total_probability = sum(transition_probabilities)
 			transition_probabilities = [tp / total_probability for tp in transition_probabilities]
 			if len(children) > 2: 
-				return np.random.choice(a=children, p=transition_probabilities)
+				return self.np_rng.choice(a=children, p=transition_probabilities)
 			elif len(children) == 2:
-				if random() < transition_probabilities[0]:
+				if self.rng.random() < transition_probabilities[0]:
 					return children[0]
 				else:
 					return children[1]
@@ -74,10 +371,24 @@ class Tangle():
 		else:
 			return start
 
-	def get_sites(self, n_sites, w):
+	def get_sites(self, n_sites, w, jump=False):
 		walkers = []
+		if jump:
+			# Jumping costs the same at any depth, so every walker starts w
+			# deep (or at the end of its chain) however few tips there are.
+			if len(self.tips) >= n_sites:
+				walkers = self.tips.sample(n_sites)
+			else:
+				while len(walkers) < n_sites:
+					walkers.extend(self.tips)
+			sites = []
+			for walker in walkers[:n_sites]:
+				site = self.ancestor(walker, w)
+				self.weigh_walk(walker, w, site)
+				sites.append(site)
+			return sites
 		if len(self.tips) >= w:
-			walkers = sample(self.tips, n_sites)
+			walkers = self.tips.sample(n_sites)
 			return [self.walk_back(walker, w) for walker in walkers]
 		else:
 			while len(walkers) < n_sites:
@@ -108,17 +419,22 @@ class Tangle():
 		return walkers[:n_sites]
 		"""
 
-	def mcmc_select(self, n=2, n_sites=10, w=14, alpha=0.001):
+	def mcmc_select(self, n=2, n_sites=10, w=14, alpha=0.001, jump=False):
+		# With jump, sites come from the ancestor index instead of walk_back,
+		# so w can be large; weigh_walk still leaves the weights walk_back
+		# would for the forward walks to follow.
 		if n_sites < n:
 			raise Exception("Not enough sites specified for MCMC")
 
-		walkers = self.get_sites(n_sites, w)
+		walkers = self.get_sites(n_sites, w, jump)
 
 		selected_tips = []
+		steps = 0
 		while True:
 			previous_sites = walkers[:]
 			for i, old_site in enumerate(previous_sites):
 				new_site = self.walk_forward(start=old_site, alpha=alpha)
+				steps += 1
 
 				if new_site is None:
 					selected_tips.append(old_site)
@@ -131,35 +447,242 @@ class Tangle():
 					walkers.append(new_site)
 
 				if len(selected_tips) == n:
+					if self.instruments is not None:
+						self.instruments.count('mcmc_steps', steps)
 					return selected_tips
 
+	def mcmc_select_batch(self, k, n=2, n_sites=10, w=14, alpha=0.001, jump=False):
+		if n_sites < n:
+			raise Exception("Not enough sites specified for MCMC")
+		if self.backend not in ARRAY_BACKENDS:
+			return [self.mcmc_select(n=n, n_sites=n_sites, w=w, alpha=alpha, jump=jump) for _ in range(k)]
+
+		# All k * n_sites walkers advance together: each step gathers the
+		# padded child rows of the current sites, weighs them in one pass and
+		# makes a single categorical draw for every walker still moving.
+		dag = self.dag
+		sites = []
+		for _ in range(k):
+			sites.extend(self.get_sites(n_sites, w, jump))
+		walkers = np.array([dag.ids.get(site, -1) for site in sites], dtype=np.int64)
+		active = np.ones(len(walkers), dtype=bool)
+		selected_tips = [[] for _ in range(k)]
+
+		steps = 0
+		while active.any():
+			moving = np.flatnonzero(active)
+			steps += len(moving)
+			current = walkers[moving]
+			children, valid = dag.child_matrix(np.maximum(current, 0))
+			valid &= (current >= 0)[:, None]
+			counts = valid.sum(axis=1)
+
+			for walker in moving[counts == 0]:
+				group = walker // n_sites
+				if not active[walker]:
+					continue
+				selected_tips[group].append(sites[walker] if walkers[walker] < 0 else dag.names[walkers[walker]])
+				active[walker] = False
+				if len(selected_tips[group]) == n:
+					active[group * n_sites:(group + 1) * n_sites] = False
+
+			stepping = (counts > 0) & active[moving]
+			if not stepping.any():
+				continue
+			moving = moving[stepping]
+			current = current[stepping]
+			children = children[stepping]
+			valid = valid[stepping]
+			child_weights = np.where(valid, dag.weights[np.where(valid, children, 0)], 0)
+			exponents = alpha * (child_weights - dag.weights[current][:, None])
+			exponents = np.where(valid, exponents, -np.inf)
+			probabilities = np.exp(exponents - exponents.max(axis=1, keepdims=True))
+			cumulative = np.cumsum(probabilities, axis=1)
+			draws = self.np_rng.random(len(moving)) * cumulative[:, -1]
+			choices = np.argmax(cumulative > draws[:, None], axis=1)
+			walkers[moving] = children[np.arange(len(moving)), choices]
+
+		if self.instruments is not None:
+			self.instruments.count('mcmc_steps', steps)
+		return selected_tips
+
 	def step(self, now):
 		self.n_tips = len(self.tips)
+		self.now = now
+		if self.backend == 'view':
+			self.dag.now = now
+		if self.compaction is not None and now % self.compaction.get('every', 1) == 0:
+			self.compact(now)
 		#self.log['uctps'][now] = self.n_tips
 
-	@lru_cache(maxsize=None)
 	def get_parents(self, tx):
-		if tx in self.dag:
-			return list(self.dag.predecessors(tx))
-		else:
-			return []
+		parents = self.parent_cache.lookup(tx)
+		if parents is MISSING:
+			if tx in self.dag:
+				parents = list(self.dag.predecessors(tx))
+			else:
+				parents = []
+			self.parent_cache.store(tx, parents)
+		return parents
 
-	@lru_cache(maxsize=2048)
 	def get_children(self, tx):
-		if tx in self.dag:
-			return list(self.dag.successors(tx))
-		else:
-			return []
+		children = self.child_cache.lookup(tx)
+		if children is MISSING:
+			if tx in self.dag:
+				children = list(self.dag.successors(tx))
+			else:
+				children = []
+			self.child_cache.store(tx, children)
+		return children
+
+	def settled_against(self, tx):
+		return self.conflicts.settled_against(tx, self.solid)
+
+	def topological(self, txs, through=None):
+		# txs (all in this tangle) with parents before children. Array
+		# backends number transactions in insertion order, which already is
+		# one; otherwise a depth-first pass over parents, which also follows
+		# ancestors outside txs that the predicate `through` accepts.
+		if self.backend in ARRAY_BACKENDS:
+			return sorted(txs, key=self.dag.index)
+		members = set(txs)
+		seen = set()
+		ordered = []
+		for tx in txs:
+			stack = [(tx, False)]
+			while stack:
+				(current, expanded) = stack.pop()
+				if expanded:
+					if current in members:
+						ordered.append(current)
+					continue
+				if current in seen:
+					continue
+				seen.add(current)
+				stack.append((current, True))
+				for parent in self.get_parents(current):
+					if parent not in seen and (parent in members or (through is not None and through(parent))):
+						stack.append((parent, False))
+		return ordered
+
+	def caches(self):
+		return {'walk_back': self.walk_cache, 'get_parents': self.parent_cache, 'get_children': self.child_cache}
+
+	def cone(self, tx):
+		# tx and every transaction approving it, in depth-first preorder.
+		cone = []
+		seen = set()
+		stack = [tx]
+		while stack:
+			current = stack.pop()
+			if current in seen:
+				continue
+			seen.add(current)
+			cone.append(current)
+			stack.extend(reversed(self.get_children(current)))
+		return cone
 
 	def remove(self, tx):
-		self.blacklist.append(tx)
+		cone = self.cone(tx)
+		members = set(cone)
+		outside = set()
+		for current in cone:
+			outside.update(parent for parent in self.get_parents(current) if parent not in members)
+
+		self.blacklist.extend(cone)
 		#print('Removed {t}.'.format(t=tx))
-		if tx in self.tips:
-			self.tips.remove(tx)
-		for child in self.get_children(tx):
-			self.dag.remove_edge(tx, child)
-			self.remove(child)
-		self.dag.remove_node(tx)
+		for current in cone:
+			self.forget(current)
+			if current in self.tracked:
+				self.free_bits.append(self.tracked.pop(current))
+		self.dag.remove_nodes_from(cone)
+
+		for parent in outside:
+			self.child_cache.discard(parent)
+		# Any cached walk may have passed through the cone.
+		self.walk_cache.clear()
+
+	def forget(self, tx):
+		self.tips.discard(tx)
+		self.approvals.pop(tx, None)
+		self.arrival_ticks.pop(tx, None)
+		self.parent_cache.discard(tx)
+		self.child_cache.discard(tx)
+		self.ancestors.discard(tx)
+		self.weighed.pop(tx, None)
+		self.conflicts.discard(tx)
+		if self.backend not in ARRAY_BACKENDS:
+			self.cumulative_weight.pop(tx, None)
+
+	def compact(self, now):
+		max_age = self.compaction.get('max_age')
+		max_depth = self.compaction.get('max_depth')
+
+		if max_age is not None:
+			candidates = []
+			for (tx, tick) in self.arrival_ticks.items():
+				if tick >= now - max_age:
+					break
+				candidates.append(tx)
+		else:
+			candidates = list(self.arrival_ticks)
+
+		if max_depth is not None:
+			live = set()
+			frontier = list(self.tips)
+			for depth in range(max_depth + 1):
+				following = []
+				for tx in frontier:
+					if tx not in live:
+						live.add(tx)
+						following.extend(self.get_parents(tx))
+				frontier = following
+			candidates = [tx for tx in candidates if tx not in live]
+		elif max_age is None:
+			candidates = []
+
+		retired = self.retire(candidates)
+		horizon = self.compaction.get('horizon', max_age)
+		if horizon is not None:
+			expired = []
+			for (tx, tick) in self.solid.items():
+				if tick >= now - horizon:
+					break
+				expired.append(tx)
+			for tx in expired:
+				del self.solid[tx]
+		return retired
+
+	def retire(self, txs):
+		# Tips are unconfirmed and tracked transactions are still watched,
+		# so both stay however old they are.
+		retired = [tx for tx in txs if tx in self.dag and tx not in self.tips and tx not in self.tracked]
+		frontier = set()
+		parents = set()
+		for tx in retired:
+			frontier.update(self.get_children(tx))
+			parents.update(self.get_parents(tx))
+		# The index holds whole chains, so it only has entries through the
+		# retired transactions if it has one of them.
+		indexed = any(tx in self.ancestors for tx in retired)
+		for tx in retired:
+			self.conflicts.settle(tx)
+			self.forget(tx)
+			self.solid[tx] = self.now
+		self.dag.remove_nodes_from(retired)
+
+		for tx in frontier:
+			self.parent_cache.discard(tx)
+		# Parents left behind lose the retired children.
+		for tx in parents:
+			self.child_cache.discard(tx)
+		if retired:
+			# Chains through the frontier now end there (or turn to a
+			# surviving parent), so every walk below it is stale.
+			self.walk_cache.clear()
+		if indexed:
+			self.ancestors.clear()
+		return retired
 
 	"""
 	#@lru_cache(maxsize=2048)
@@ -183,7 +706,7 @@ class Tangle():
 
 class Node():
 
-	def __init__(self, name, gt, lt, tps, bw, inc, out, communications):
+	def __init__(self, name, gt, lt, tps, bw, inc, out, communications, tip_selection='mcmc'):
 		self.name = name
 		self.gt = gt
 		self.lt = lt
@@ -195,21 +718,30 @@ class Node():
 		self.bw = bw
 		self.time = 0
 		self.check_conflicts = True
+		self.tip_selection = tip_selection
+		# With a listen policy (see listen_batch) incoming links are drained
+		# by per-link quotas; link_weights maps connections to their weight
+		# under the 'weighted' policy, which otherwise weighs by backlog.
+		self.listen_policy = None
+		self.link_weights = None
+		self.instruments = None
 		self.integrate(self.lt.genesis)
 
 	def get_tips(self, mode='mcmc'):
 		if mode == 'uniform':
-			return [choice(self.lt.tips) for _ in range(2)]
+			return [self.lt.tips.choice() for _ in range(2)]
 		if mode == 'priority_soft':
 			proportion = 0.1
 			ratio = 1.0 / proportion 
-			last_n = floor(self.lt.n_tips/ratio)
-			return [choice(self.lt.tips[-last_n:]) for _ in range(2)]
+			last_n = floor(self.lt.n_tips/ratio) or len(self.lt.tips)
+			return [self.lt.tips.choice_recent(last_n) for _ in range(2)]
 		if mode == 'priority_hard':
-			last_n = min(100, self.lt.n_tips)
-			return [choice(self.lt.tips[-last_n:]) for _ in range(2)]				
+			last_n = min(100, self.lt.n_tips) or len(self.lt.tips)
+			return [self.lt.tips.choice_recent(last_n) for _ in range(2)]				
 		if mode == 'mcmc':
 			return self.lt.mcmc_select(n=2, n_sites=10, w=14)
+		if mode == 'mcmc_jump':
+			return self.lt.mcmc_select(n=2, n_sites=10, w=JUMP_DEPTH, jump=True)
 		return None
 
 	def make_conflict(self, tx):
@@ -219,36 +751,41 @@ class Node():
 			return '_' + tx
 
 	def has_conflict(self, tx):
-		return self.make_conflict(tx) in self.lt.dag
+		return bool(self.lt.conflicts.rivals(tx))
 
 	def resolve_conflict(self, tx1, tx2):
-		weight_1 = 1
-		weight_2 = 1
+		return self.resolve([tx1, tx2])
 
-		for tip in self.lt.tips:
-			if nx.has_path(self.lt.dag, tx1, tip):
-				weight_1 += 1
-			if nx.has_path(self.lt.dag, tx2, tip):
-				weight_2 += 1
-
-		if weight_2 > weight_1:
-			return tx2
-		else:
-			return tx1
+	def resolve(self, alternatives):
+		# The heaviest alternative wins; ties go to the one seen first.
+		for tx in alternatives:
+			self.lt.track(tx)
+		weights = [self.lt.approval_weight(tx) for tx in alternatives]
+		return alternatives[weights.index(max(weights))]
 
 	def integrate(self, tx):
+		if tx in self.lt.solid:
+			return
 		if self.check_conflicts:
 			if tx in self.lt.blacklist:
 				#print("{t} has already been blacklisted by {n}.".format(t=tx, n=self.name))
 				return
+			if self.lt.settled_against(tx):
+				# A transaction it conflicts with is settled history.
+				self.lt.blacklist.append(tx)
+				return
 
-		self.lt.tips.append(tx)
-		self.lt.dag.add_node(tx)
+		self.lt.tips.add(tx)
+		self.lt.add_node(tx)
+		if self.instruments is not None:
+			self.instruments.count('integrated')
 		parents = self.gt.get_parents(tx)
 		for parent in parents:
+			if parent in self.lt.solid:
+				continue
 			if parent not in self.lt.dag:
 				self.integrate(parent)
-			self.lt.dag.add_edge(parent, tx)
+			self.lt.add_edge(parent, tx)
 			#if self.lt.cumulative_weight[parent] == 1:
 			if parent in self.lt.tips:
 				self.lt.tips.remove(parent)
@@ -259,16 +796,111 @@ class Node():
 		if self.check_conflicts:
 			if self.has_conflict(tx):
 				#print("{name} found a conflict.".format(name=self.name))
-				conflict = self.make_conflict(tx)
-				winner = self.resolve_conflict(conflict, tx)
-				#print("Resolved a conflict in favor of {t}.".format(t=winner))
-				if winner is tx:
-					self.lt.remove(conflict)
-				else:
-					self.lt.remove(tx)
-					return
+				if self.instruments is not None:
+					self.instruments.count('conflicts')
+					with self.instruments.phase('conflicts'):
+						return self.settle_conflict(tx)
+				return self.settle_conflict(tx)
+
+	def settle_conflict(self, tx):
+		alternatives = self.lt.conflicts.rivals(tx) + [tx]
+		winner = self.resolve(alternatives)
+		#print("Resolved a conflict in favor of {t}.".format(t=winner))
+		for loser in alternatives:
+			if loser != winner and loser in self.lt.dag:
+				self.lt.remove(loser)
+		# Settled: the winner need not be watched (or kept from compaction)
+		# until another rival turns up.
+		self.lt.untrack(winner)
 
 	def listen(self):
+		if self.listen_policy is not None:
+			return self.listen_batch()
+		if isinstance(self.communications, MessageBus):
+			dropped = self.communications.dropped
+			incast_queue = deque(self.communications.drain(self.name, self.bw))
+			if self.instruments is not None:
+				self.instruments.count('dropped', self.communications.dropped - dropped)
+		else:
+			incast_queue = self.pull()
+
+		while incast_queue:
+			tx = incast_queue.popleft()
+			if self.receive(tx):
+				self.broadcast_queue.append(tx)
+			elif self.instruments is not None:
+				self.instruments.count('duplicates')
+
+	def listen_batch(self):
+		# Takes at most bw transactions off the incoming links, split between
+		# them by quotas fixed before anything is pulled: equal shares
+		# ('round_robin'), shares by link weight ('weighted'), or the bw that
+		# arrived first ('fifo', which needs the message bus's arrival
+		# stamps). What the quotas leave behind is dropped. The batch is
+		# deduplicated against the local tangle in one pass and integrated
+		# parents first, so no transaction of it is pulled in recursively.
+		policy = self.listen_policy
+		if policy not in LISTEN_POLICIES:
+			raise ValueError("Unknown listen policy {p}.".format(p=policy))
+		communications = self.communications
+		if isinstance(communications, MessageBus):
+			dropped = communications.dropped
+			if policy == 'fifo':
+				quotas = communications.earliest(self.name, self.bw)
+			else:
+				quotas = fair_shares(communications.backlog(self.name), self.bw, self.weights(policy))
+			batch = communications.take(self.name, quotas, oldest=policy == 'fifo')
+			dropped = communications.dropped - dropped
+		else:
+			if policy == 'fifo':
+				raise ValueError("FIFO draining needs the message bus, which stamps arrivals.")
+			links = [communications[connection] for connection in self.inc]
+			quotas = fair_shares([len(messages) for messages in links], self.bw, self.weights(policy))
+			batch = []
+			dropped = 0
+			for (messages, quota) in zip(links, quotas.tolist()):
+				batch.extend(reversed(messages[len(messages) - quota:]))
+				dropped += len(messages) - quota
+				messages.clear()
+
+		lt = self.lt
+		fresh = [tx for tx in dict.fromkeys(batch) if tx not in lt.dag and tx not in lt.solid and not (self.check_conflicts and tx in lt.blacklist)]
+		received = 0
+		missing = lambda tx: tx not in lt.dag and tx not in lt.solid
+		for tx in self.gt.topological(fresh, through=missing):
+			# Settling a conflict earlier in the batch can blacklist a cone
+			# that later transactions belong to.
+			if self.receive(tx):
+				self.broadcast_queue.append(tx)
+				received += 1
+
+		if self.instruments is not None:
+			self.instruments.count('dropped', dropped)
+			self.instruments.count('duplicates', len(batch) - received)
+
+	def weights(self, policy):
+		# Link weights for fair_shares, in the order of self.inc (which is
+		# also the bus's order of the node's in-edges); None for equal shares.
+		if policy != 'weighted':
+			return None
+		if self.link_weights is not None:
+			return [self.link_weights.get(connection, 1.0) for connection in self.inc]
+		if isinstance(self.communications, MessageBus):
+			return self.communications.backlog(self.name)
+		return [len(self.communications[connection]) for connection in self.inc]
+
+	def receive(self, tx):
+		# Integrates one incoming transaction unless it is known already or
+		# blacklisted, and says whether it was new.
+		if tx in self.lt.dag or tx in self.lt.solid:
+			return False
+		if self.check_conflicts:
+			if tx in self.lt.blacklist:
+				return False
+		self.integrate(tx)
+		return True
+
+	def pull(self):
 		incast_queue = deque(maxlen=100)
 		while len(incast_queue) <= self.bw:
 			n_empty = 0
@@ -281,21 +913,22 @@ class Node():
 			if n_empty == len(self.inc):
 				break
 
+		if self.instruments is not None:
+			self.instruments.count('dropped', sum(len(self.communications[connection]) for connection in self.inc))
 		for connection in self.inc:
 			self.communications[connection].clear()
 
-		while incast_queue:
-			tx = incast_queue.popleft()
-			if tx not in self.lt.dag:
-				if self.check_conflicts:
-					if tx in self.lt.blacklist:
-						continue
-				self.broadcast_queue.append(tx)
-				self.integrate(tx)
+		return incast_queue
 
 	def transact(self):
-		for i in range(np.random.poisson(self.tps)):
-			tx_parents = self.get_tips(mode='mcmc')
+		n_transactions = self.lt.np_rng.poisson(self.tps)
+		if self.tip_selection == 'mcmc_batch':
+			entries = self.prepare(n_transactions)
+			self.gt.publish_many(entries)
+			self.adopt(entries)
+			return
+		for i in range(n_transactions):
+			tx_parents = self.get_tips(mode=self.tip_selection)
 			if not tx_parents:
 				break
 			tx = self.lt.make_transaction(self.name, self.time,
@@ -304,7 +937,51 @@ class Node():
 			self.integrate(tx)
 			self.broadcast_queue.append(tx)
 
+	def select_batch(self, k):
+		if self.tip_selection in ('mcmc', 'mcmc_batch'):
+			return self.lt.mcmc_select_batch(k, n=2, n_sites=10, w=14)
+		if self.tip_selection == 'mcmc_jump':
+			return self.lt.mcmc_select_batch(k, n=2, n_sites=10, w=JUMP_DEPTH, jump=True)
+		return [self.get_tips(mode=self.tip_selection) for _ in range(k)]
+
+	def prepare(self, n_transactions):
+		# Makes this tick's transactions without publishing them. Parents
+		# are drawn in one batch against the tangle as it was at the start
+		# of the tick, so a walker that ends on a tip one of this tick's own
+		# transactions already approves carries on to that transaction, as
+		# it would have with one walk per transaction.
+		batch = self.select_batch(n_transactions)
+		approved_by = {}
+		entries = []
+		for i in range(n_transactions):
+			if not batch[i]:
+				break
+			tx_parents = []
+			for parent in batch[i]:
+				while parent in approved_by:
+					parent = self.lt.rng.choice(approved_by[parent])
+				tx_parents.append(parent)
+			tx = self.lt.make_transaction(self.name, self.time,
+				tx_parents, i)
+			entries.append((tx, tx_parents))
+			for parent in set(tx_parents):
+				approved_by.setdefault(parent, []).append(tx)
+		return entries
+
+	def adopt(self, entries):
+		# Own transactions, once they are in the global tangle.
+		for (tx, tx_parents) in entries:
+			self.integrate(tx)
+			self.broadcast_queue.append(tx)
+
 	def gossip(self):
+		if isinstance(self.communications, MessageBus):
+			outgoing = []
+			while self.broadcast_queue and len(outgoing) < self.bw:
+				outgoing.append(self.broadcast_queue.popleft())
+			self.communications.broadcast(self.name, outgoing)
+			return
+
 		for i in range(self.bw):
 			if self.broadcast_queue:
 				outgoing_tx = self.broadcast_queue.popleft()
@@ -313,47 +990,59 @@ class Node():
 					self.communications[connection].append(outgoing_tx)
 
 	def publish(self, tx, parents):
-		self.gt.dag.add_node(tx)
-		self.gt.tips.append(tx)
-
-		for parent in parents:
-			self.gt.dag.add_edge(parent, tx)
-			if parent in self.gt.tips:
-				#print("{x} confirmed a tip.".format(x=self.name))
-				self.gt.tips.remove(parent)
-				#self.gt.log['ctps'][self.time] += 1
-			#else:
-			#	print("{x} confirmed a non-tip.".format(x=self.name))
-		#print('')
+		self.gt.publish(tx, parents)
 
 	def step(self):
+		if self.instruments is not None:
+			return self.instrumented_step()
 		self.listen()
 		self.transact()
 		self.gossip()
 		self.lt.step(self.time)
 		self.time += 1
 
+	def instrumented_step(self):
+		instruments = self.instruments
+		with instruments.phase('listen'):
+			self.listen()
+		with instruments.phase('transact'):
+			self.transact()
+		with instruments.phase('gossip'):
+			self.gossip()
+		self.lt.step(self.time)
+		self.time += 1
+
 class Adversary(Node):
 
-	def __init__(self, name, gt, lt, tps, bw, inc, out, communications):
-		Node.__init__(self, name, gt, lt, tps, bw, inc, out, communications)
+	def __init__(self, name, gt, lt, tps, bw, inc, out, communications, tip_selection='mcmc'):
+		Node.__init__(self, name, gt, lt, tps, bw, inc, out, communications, tip_selection)
 		self.original = None
 		self.double_spend = None
+		# Batches of originals still to be double-spent, oldest first.
+		self.pending = deque()
 		self.check_conflicts = True
 
-	def transact_single_spend(self):
-		tx_parents = self.get_tips(mode='mcmc')
-		tx = self.lt.make_transaction(self.name, self.time,
-				tx_parents)
-		self.original = tx
-		print("Made original transaction {t}".format(t=tx))
-		self.publish(tx, tx_parents)
-		self.lt.blacklist.append(tx)
-		#self.integrate(tx)
-		self.broadcast_queue.append(tx)
-
-	def get_double_spend_tips(self):
-		tips = [tip for tip in self.lt.tips if not nx.has_path(self.gt.dag, self.original, tip)]
+	def transact_single_spend(self, n=1):
+		batch = []
+		for i in range(n):
+			tx_parents = self.get_tips(mode='mcmc')
+			tx = self.lt.make_transaction(self.name, self.time,
+					tx_parents, i or None)
+			if i == 0:
+				self.original = tx
+			print("Made original transaction {t}".format(t=tx))
+			self.publish(tx, tx_parents)
+			self.lt.blacklist.append(tx)
+			#self.integrate(tx)
+			self.broadcast_queue.append(tx)
+			batch.append(tx)
+		self.pending.append(batch)
+
+	def get_double_spend_tips(self, original=None):
+		if original is None:
+			original = self.original
+		self.gt.track(original)
+		tips = [tip for tip in self.lt.tips if not self.gt.approves(original, tip)]
 		if len(tips) > 1:
 			return tips[:2]
 		else:
@@ -390,24 +1079,41 @@ class Adversary(Node):
 	"""
 
 	def transact_double_spend(self):
-		if self.original is None:
+		if not self.pending:
 			print('No original transaction to double-spend.')
 			return
-		tx_parents = self.get_double_spend_tips()
-		tx = self.make_conflict(self.original)
-		self.double_spend = tx
-		print("Made double-spend transaction {t}".format(t=tx))
+		made = []
+		for original in self.pending.popleft():
+			# Originals the simulation is not already watching are only
+			# tracked to pick these tips.
+			watched = original in self.gt.tracked
+			try:
+				tx_parents = self.get_double_spend_tips(original)
+			except Exception:
+				# Only the run's first double-spend has to succeed; later
+				# originals the whole tangle already approves are skipped.
+				if self.double_spend is None and not made:
+					raise
+				continue
+			finally:
+				if not watched:
+					self.gt.untrack(original)
+			tx = self.make_conflict(original)
+			made.append(tx)
+			print("Made double-spend transaction {t}".format(t=tx))
 		
-		#if (self.lt.verbose):
-		#	self.lt.log['verbose'].append("@{tim}, transaction: {t}\n\t{p}\n".format(tim=time_stamp, t=tx, p=parents))
-		#print('Generated a double spend {t} with parents {p}!'.format(t=tx, p=parents))
+			#if (self.lt.verbose):
+			#	self.lt.log['verbose'].append("@{tim}, transaction: {t}\n\t{p}\n".format(tim=time_stamp, t=tx, p=parents))
+			#print('Generated a double spend {t} with parents {p}!'.format(t=tx, p=parents))
 
-		#self.lt.log['tps'][self.time] += 1
-		nx.set_node_attributes(self.lt.dag, name='time_stamp', values={tx: self.time})
-		self.publish(tx, tx_parents)
-		self.integrate(tx)
-		self.check_conflicts = True
-		self.broadcast_queue.append(tx)
+			#self.lt.log['tps'][self.time] += 1
+			self.lt.set_time_stamp(tx, self.time)
+			self.publish(tx, tx_parents)
+			self.integrate(tx)
+			self.check_conflicts = True
+			self.broadcast_queue.append(tx)
+		if made:
+			self.double_spend = made[0]
 
 	def double_spend_step(self):
 		self.listen()
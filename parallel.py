@@ -0,0 +1,194 @@
+from random import Random
+from multiprocessing import Process, Pipe
+import random
+
+import numpy as np
+
+from iota import Tangle, Node, Adversary
+from tips import TipSet
+from simulation_5 import Simulation
+from topology import make_topology
+
+# Sharded stepping for simulation_5. Nodes are split into contiguous shards,
+# each stepped by its own worker process against a replica of the global
+# tangle. Every gossip message, local or cross-shard, is delivered at the next
+# tick boundary, and each tick's new transactions are merged into the global
+# tangle in (node, issue order), so a seed gives the same run for any number
+# of shards.
+
+def node_generators(seed, name):
+	state = np.random.SeedSequence([seed, name]).generate_state(2)
+	return Random(int(state[0])), np.random.RandomState(int(state[1]))
+
+def shard_worker(pipe, names, connections, params, seed):
+	members = set(names)
+	global_tangle = Tangle(backend=params['backend'])
+	global_tangle.add_node(global_tangle.genesis)
+	global_tangle.tips.add(global_tangle.genesis)
+
+	communications = {}
+	incoming = {}
+	outgoing = {}
+	for connection in connections:
+		(x, y) = connection
+		if x in members or y in members:
+			communications[connection] = []
+		if y in members:
+			incoming.setdefault(y, []).append(connection)
+		if x in members:
+			outgoing.setdefault(x, []).append(connection)
+	boundary = [connection for connection in connections if connection[0] in members and connection[1] not in members]
+
+	nodes = []
+	for i in names:
+		rng, np_rng = node_generators(seed, i)
+		local_tangle = Tangle(backend=params['backend'], rng=rng, np_rng=np_rng, compaction=params['compaction'])
+		node_type = Adversary if i == 0 else Node
+		nodes.append(node_type(i, global_tangle, local_tangle, params['tps'] / params['n_nodes'], params['bw'],
+			incoming.get(i, []), outgoing.get(i, []), communications, params['tip_selection']))
+
+	while True:
+		message = pipe.recv()
+		if message[0] == 'stop':
+			break
+		(_, time_step, publishes, deliveries) = message
+
+		for (tx, parents) in publishes:
+			if tx not in global_tangle.dag:
+				global_tangle.publish(tx, parents)
+		global_tangle.journal = []
+		for (connection, txs) in deliveries:
+			communications[connection].extend(txs)
+
+		# Every node listens before any node gossips, so messages sent this
+		# tick wait for the boundary even between nodes of the same shard.
+		for node in nodes:
+			node.listen()
+
+		published = []
+		events = {}
+		for node in nodes:
+			start = len(global_tangle.journal)
+			if time_step == params['make_original_at'] and type(node) is Adversary:
+				node.transact_single_spend()
+				events['original'] = node.original
+
+			if time_step == params['start_attack_at'] and type(node) is Adversary:
+				node.transact_double_spend()
+				events['double_spend'] = node.double_spend
+			else:
+				node.transact()
+			node.gossip()
+			node.lt.step(node.time)
+			node.time += 1
+			published.extend((node.name, tx, parents) for (tx, parents) in global_tangle.journal[start:])
+
+			if type(node) is Adversary:
+				events['adversary_tips'] = list(node.lt.tips)
+
+		sent = []
+		for connection in boundary:
+			if communications[connection]:
+				sent.append((connection, communications[connection]))
+				communications[connection] = []
+
+		pipe.send((published, sent, events))
+
+class RemoteTangle():
+
+	def __init__(self):
+		self.tips = TipSet()
+
+class ShardedSimulation(Simulation):
+
+	def __init__(self, n_shards=2, seed=0, **params):
+		self.n_shards = n_shards
+		self.seed = seed
+		Simulation.__init__(self, **params)
+
+	def initialize(self):
+		if self.backend not in ('networkx', 'array'):
+			raise ValueError("Sharded runs need private local tangles, not the {b} backend.".format(b=self.backend))
+		if self.ids != 'hash':
+			raise ValueError("Sharded runs need content-hash ids; counter ids would collide across shards.")
+		if self.issuance != 'node':
+			raise ValueError("Sharded runs issue transactions per shard, not per tick.")
+		if self.listen_policy is not None:
+			raise ValueError("Sharded runs drain links as Node.listen always has and take no listen policy.")
+		if (self.adversaries, self.attacks, self.attack_period) != (1, 1, None):
+			raise ValueError("Sharded runs support a single adversary making a single attack.")
+		random.seed(self.seed)
+		np.random.seed(self.seed)
+
+		self.tangle = Tangle(backend=self.backend)
+		self.tangle.add_node(self.tangle.genesis)
+		self.tangle.tips.add(self.tangle.genesis)
+		self.adversary_tangle = RemoteTangle()
+		self.nodes = []
+
+		connections = make_topology(self.topology, self.n_nodes, self.npn).connections()
+		params = {
+			'n_nodes': self.n_nodes,
+			'tps': self.tps,
+			'bw': self.bw,
+			'backend': self.backend,
+			'tip_selection': self.tip_selection,
+			'make_original_at': self.make_original_at,
+			'start_attack_at': self.start_attack_at,
+			'compaction': self.compaction,
+		}
+
+		self.shard_of = {}
+		self.pipes = []
+		self.workers = []
+		for shard, names in enumerate(np.array_split(np.arange(self.n_nodes), self.n_shards)):
+			names = [int(name) for name in names]
+			for name in names:
+				self.shard_of[name] = shard
+			pipe, worker_pipe = Pipe()
+			worker = Process(target=shard_worker, args=(worker_pipe, names, connections, params, self.seed), daemon=True)
+			worker.start()
+			self.pipes.append(pipe)
+			self.workers.append(worker)
+
+		self.publishes = []
+		self.deliveries = [[] for _ in range(self.n_shards)]
+
+	def advance(self):
+		for shard, pipe in enumerate(self.pipes):
+			pipe.send(('step', self.time_step, self.publishes, self.deliveries[shard]))
+
+		published = []
+		self.deliveries = [[] for _ in range(self.n_shards)]
+		for pipe in self.pipes:
+			(shard_published, sent, events) = pipe.recv()
+			published.extend(shard_published)
+			for (connection, txs) in sent:
+				self.deliveries[self.shard_of[connection[1]]].append((connection, txs))
+			if 'original' in events:
+				self.tx_original = events['original']
+			if 'double_spend' in events:
+				self.tx_double_spend = events['double_spend']
+			if 'adversary_tips' in events:
+				self.adversary_tangle.tips = TipSet(events['adversary_tips'])
+
+		published.sort(key=lambda entry: entry[0])
+		self.publishes = [(tx, parents) for (name, tx, parents) in published]
+		for (tx, parents) in self.publishes:
+			self.tangle.publish(tx, parents)
+		self.tangle.step(self.time_step)
+
+	def __getstate__(self):
+		raise TypeError("Sharded simulations keep their nodes in worker processes and cannot be snapshotted.")
+
+	def close(self):
+		for pipe in self.pipes:
+			pipe.send(('stop',))
+		for worker in self.workers:
+			worker.join()
+
+	def run(self):
+		try:
+			return Simulation.run(self)
+		finally:
+			self.close()
@@ -1,12 +1,17 @@
 import os, time, json, gzip
-from math import floor
-from random import sample
+from contextlib import nullcontext
 
 import numpy as np
 import matplotlib.pyplot as plt
-import networkx as nx
 
 from iota import Tangle, Node, Adversary
+from bus import MessageBus, LISTEN_POLICIES
+from trajectory import TrajectoryWriter
+from data_to_pomdp import ACTIONS
+from discretization import Discretization
+from instrument import Instruments
+from ids import IdAllocator
+from topology import Topology, make_topology
 
 N_NODES = 100
 NEIGHBORS_PER_NODE = 8
@@ -20,70 +25,288 @@ MAKE_ORIGINAL_AT = 200
 START_ATTACK_AT = 400
 
 SAMPLE_SIZE = 10
-
-def initialize_simulation(n, npn, tps, bw):
-	global_tangle = Tangle()
-	global_tangle.dag.add_node(global_tangle.genesis)
-	global_tangle.tips.append(global_tangle.genesis)
-
-	topology = nx.random_regular_graph(npn, n)
-	while not nx.is_connected(topology):
-		topology = nx.random_regular_graph(npn, n)
-
-	connections = list(topology.edges()) + [tuple(reversed(x)) for x in list(topology.edges)]
-	communications = {}
-	for connection in connections:
-		communications[connection] = []
+DISCRETIZATION = Discretization(buckets=SAMPLE_SIZE + 1)
+
+BACKEND = 'networkx'
+TIP_SELECTION = 'mcmc'
+MESSAGE_BUS = False
+INSTRUMENT = False
+IDS = 'hash'
+COMPACTION = None
+ISSUANCE = 'node'
+TOPOLOGY = None
+LISTEN_POLICY = None
+
+def draw_issuance(nodes):
+	# This tick's transaction count for every node, in one Poisson draw for
+	# the nodes that share np.random; nodes with generators of their own
+	# draw from those, so their runs stay independent of the others.
+	counts = np.zeros(len(nodes), dtype=np.int64)
+	shared = [i for (i, node) in enumerate(nodes) if node.lt.np_rng is np.random]
+	if shared:
+		counts[shared] = np.random.poisson([nodes[i].tps for i in shared])
+	for (i, node) in enumerate(nodes):
+		if node.lt.np_rng is not np.random:
+			counts[i] = node.lt.np_rng.poisson(node.tps)
+	return counts
+
+def initialize_simulation(n, npn, tps, bw, backend='networkx', tip_selection='mcmc', message_bus=False, ids='hash', compaction=None, adversaries=1, topology=None, listen_policy=None):
+	# With the 'view' backend every local tangle is a visibility view over the
+	# array-backed global tangle instead of a full copy of it. With 'counter'
+	# ids all tangles draw transaction ids from one shared allocator.
+	# Compaction (see Tangle) only applies to the local tangles; the global
+	# tangle keeps the full history that observe() and integrate() read.
+	if ids not in ('hash', 'counter'):
+		raise ValueError("Unknown id mode {i}.".format(i=ids))
+	if listen_policy is not None and listen_policy not in LISTEN_POLICIES:
+		raise ValueError("Unknown listen policy {p}.".format(p=listen_policy))
+	if listen_policy == 'fifo' and not message_bus:
+		raise ValueError("FIFO draining needs the message bus, which stamps arrivals.")
+	allocator = IdAllocator() if ids == 'counter' else None
+	if backend == 'view':
+		global_tangle = Tangle(backend='array', allocator=allocator)
+	else:
+		global_tangle = Tangle(backend=backend, allocator=allocator)
+	global_tangle.add_node(global_tangle.genesis)
+	global_tangle.tips.add(global_tangle.genesis)
+
+	# See make_topology for the settings a topology can be given as.
+	network = make_topology(topology, n, npn)
+	connections = network.connections()
+	if message_bus:
+		communications = MessageBus(connections, capacity=max(4 * bw, 16))
+	else:
+		communications = {}
+		for connection in connections:
+			communications[connection] = []
 
 	nodes = []
 	local_tangles = []
-	for i in range(N_NODES):
-		local_tangle = Tangle()
+	for i in range(n):
+		local_tangle = Tangle(backend=backend, store=global_tangle, allocator=allocator, compaction=compaction)
 		local_tangles.append(local_tangle)
-		income = [(x, y) for (x, y) in connections if y == i]
-		outgo = [(x, y) for (x, y) in connections if x == i]
-		if i == 0:
-			node = Adversary(i, global_tangle, local_tangle, tps/n, bw, income, outgo, communications)
+		income = network.incoming(i)
+		outgo = network.outgoing(i)
+		if i < adversaries:
+			node = Adversary(i, global_tangle, local_tangle, tps/n, bw, income, outgo, communications, tip_selection)
 		else:
-			node = Node(i, global_tangle, local_tangle, tps/n, bw, income, outgo, communications)
+			node = Node(i, global_tangle, local_tangle, tps/n, bw, income, outgo, communications, tip_selection)
+		node.listen_policy = listen_policy
 		nodes.append(node)
 
 	return global_tangle, nodes
 
 
-def main():
-	tangle, nodes = initialize_simulation(n=N_NODES, npn=NEIGHBORS_PER_NODE, tps=TPS, bw=BANDWIDTH_LIMIT)
-
-	adversary_tangle = nodes[0].lt
-
-	data = {}
-	data['global'] = []
-	data['local'] = []
-
-	uctps = []
-
-	tx_original = None
-	tx_double_spend = None
-
-	original_weights = []
-	double_spend_weights = []
-
-	observed_original_weights = []
-	observed_double_spend_weights = []
-
-	for time_step in range(TIME_STEPS):
-		print("Executing step #{t}...".format(t=time_step))
-		for node in nodes:
-			if time_step is MAKE_ORIGINAL_AT and type(node) is Adversary:
-				node.transact_single_spend()
-				tx_original = node.original
+class Simulation():
+
+	def __init__(self, n_nodes=N_NODES, npn=NEIGHBORS_PER_NODE, tps=TPS, bw=BANDWIDTH_LIMIT,
+			time_steps=TIME_STEPS, make_original_at=MAKE_ORIGINAL_AT, start_attack_at=START_ATTACK_AT,
+			backend=BACKEND, tip_selection=TIP_SELECTION, message_bus=MESSAGE_BUS, verbose=True, trajectory=None, discretization=None, instruments=None, ids=IDS, compaction=COMPACTION, issuance=ISSUANCE,
+			adversaries=1, attacks=1, attack_period=None, topology=TOPOLOGY, listen_policy=LISTEN_POLICY):
+		self.n_nodes = n_nodes
+		self.npn = npn
+		self.tps = tps
+		self.bw = bw
+		self.time_steps = time_steps
+		self.make_original_at = make_original_at
+		self.start_attack_at = start_attack_at
+		self.backend = backend
+		self.tip_selection = tip_selection
+		self.message_bus = message_bus
+		self.ids = ids
+		self.compaction = compaction
+		self.topology = topology
+		self.listen_policy = listen_policy
+		if issuance not in ('node', 'tick'):
+			raise ValueError("Unknown issuance mode {i}.".format(i=issuance))
+		self.issuance = issuance
+		# The first adversary's first original and double-spend are the ones
+		# observed. Each adversary makes `attacks` originals at once, and with
+		# an attack_period keeps making (and double-spending) new batches.
+		self.adversaries = adversaries
+		self.attacks = attacks
+		self.attack_period = attack_period
+		self.verbose = verbose
+		self.discretization = discretization or DISCRETIZATION
+
+		self.initialize()
+		self.time_step = 0
+
+		# Pass True (or an Instruments) to time phases and count events.
+		if instruments is True:
+			instruments = Instruments(ticks=time_steps)
+		self.instruments = instruments
+		if instruments is not None:
+			tangles = [self.tangle]
+			for node in self.nodes:
+				node.instruments = instruments
+				tangles.append(node.lt)
+			for tangle in tangles:
+				tangle.instruments = instruments
+				for (name, cache) in tangle.caches().items():
+					instruments.watch_cache(name, cache)
+
+		self.data = {}
+		self.data['global'] = []
+		self.data['local'] = []
+
+		self.tx_original = None
+		self.tx_double_spend = None
+
+		self.original_weights = []
+		self.double_spend_weights = []
+
+		self.observed_original_weights = []
+		self.observed_double_spend_weights = []
+
+		self.writer = None
+		if trajectory:
+			self.open_trajectory(trajectory)
+
+	def __getstate__(self):
+		# The trajectory file stays with this simulation; a restored copy
+		# opens its own with open_trajectory.
+		state = self.__dict__.copy()
+		if self.writer:
+			self.writer.flush()
+		state['writer'] = None
+		return state
+
+	def open_trajectory(self, path, append=False):
+		states = self.discretization.states()
+		self.writer = TrajectoryWriter(path, states, ACTIONS, states, params=self.params(), append=append)
+
+	def params(self):
+		return {
+			'n_nodes': self.n_nodes,
+			'npn': self.npn,
+			'tps': self.tps,
+			'bw': self.bw,
+			'time_steps': self.time_steps,
+			'make_original_at': self.make_original_at,
+			'start_attack_at': self.start_attack_at,
+			'backend': self.backend,
+			'tip_selection': self.tip_selection,
+			'message_bus': self.message_bus,
+			'ids': self.ids,
+			'compaction': self.compaction,
+			'issuance': self.issuance,
+			'adversaries': self.adversaries,
+			'attacks': self.attacks,
+			'attack_period': self.attack_period,
+			'listen_policy': self.listen_policy,
+			'topology': 'custom' if isinstance(self.topology, Topology) else self.topology,
+			'discretization': self.discretization.config(),
+		}
+
+	def initialize(self):
+		self.tangle, self.nodes = initialize_simulation(n=self.n_nodes, npn=self.npn, tps=self.tps, bw=self.bw, backend=self.backend, tip_selection=self.tip_selection, message_bus=self.message_bus, ids=self.ids, compaction=self.compaction, adversaries=self.adversaries, topology=self.topology, listen_policy=self.listen_policy)
+		self.adversary_tangle = self.nodes[0].lt
+
+	def step(self):
+		if self.verbose:
+			print("Executing step #{t}...".format(t=self.time_step))
+		if self.instruments is not None:
+			self.instrumented_step()
+		else:
+			self.advance()
+			self.observe()
+		self.time_step += 1
+
+	def instrumented_step(self):
+		instruments = self.instruments
+		started = time.perf_counter()
+		size = len(self.tangle.dag)
+		with instruments.phase('advance'):
+			self.advance()
+		with instruments.phase('observe'):
+			self.observe()
+		instruments.record('seconds', self.time_step, time.perf_counter() - started)
+		instruments.record('transactions', self.time_step, len(self.tangle.dag) - size)
+		instruments.record('tips', self.time_step, len(self.tangle.tips))
+
+	def advance(self):
+		if self.issuance == 'tick':
+			return self.advance_by_phase()
+		time_step = self.time_step
+		launch = self.scheduled(time_step, self.make_original_at)
+		strike = self.scheduled(time_step, self.start_attack_at)
+		for node in self.nodes:
+			if launch and type(node) is Adversary:
+				self.launch(node)
 			
-			if time_step == START_ATTACK_AT and type(node) is Adversary:
+			if strike and type(node) is Adversary:
 				node.double_spend_step()
-				tx_double_spend = node.double_spend
+				self.struck(node)
 			else:
 				node.step()
-		tangle.step(time_step)
+		self.tangle.step(time_step)
+
+	def scheduled(self, time_step, first):
+		if time_step == first:
+			return True
+		period = self.attack_period
+		return period is not None and time_step > first and (time_step - first) % period == 0
+
+	def launch(self, node):
+		node.transact_single_spend(self.attacks)
+		if self.tx_original is None:
+			self.tx_original = node.original
+
+	def struck(self, node):
+		if self.tx_double_spend is None:
+			self.tx_double_spend = node.double_spend
+
+	def advance_by_phase(self):
+		# Tick issuance: every node listens, the whole network's issuance
+		# counts come from one draw, each node makes its transactions from
+		# one batch of tip selections (see Node.prepare), the tick's
+		# transactions go into the global tangle in one bulk insert, in node
+		# then issue order, and only then do nodes integrate their own and
+		# gossip. Gossip sent this tick is heard at the next one.
+		time_step = self.time_step
+		nodes = self.nodes
+		strike = self.scheduled(time_step, self.start_attack_at)
+		for node in nodes:
+			if self.scheduled(time_step, self.make_original_at) and type(node) is Adversary:
+				self.launch(node)
+
+		with self.phase('listen'):
+			for node in nodes:
+				node.listen()
+
+		with self.phase('transact'):
+			counts = draw_issuance(nodes)
+			issued = []
+			for (node, count) in zip(nodes, counts):
+				if strike and type(node) is Adversary:
+					node.transact_double_spend()
+					self.struck(node)
+					issued.append([])
+				else:
+					issued.append(node.prepare(count))
+			self.tangle.publish_many([entry for entries in issued for entry in entries])
+			for (node, entries) in zip(nodes, issued):
+				node.adopt(entries)
+
+		with self.phase('gossip'):
+			for node in nodes:
+				node.gossip()
+				node.lt.step(node.time)
+				node.time += 1
+		self.tangle.step(time_step)
+
+	def phase(self, name):
+		if self.instruments is None:
+			return nullcontext()
+		return self.instruments.phase(name)
+
+	def observe(self):
+		tangle = self.tangle
+		adversary_tangle = self.adversary_tangle
+
+		tx_original = self.tx_original
+		tx_double_spend = self.tx_double_spend
 
 		weight_original = 0
 		weight_double_spend = 0
@@ -93,85 +316,71 @@ def main():
 
 		action = None
 
+		# The original and the double-spend are watched transactions of the
+		# global tangle, so every tip can be checked with a bit test instead
+		# of a path search over a sample of them.
 		if tx_original:
 			action = 'wait'
 
-			sample_tips = []
-			if len(tangle.tips) > SAMPLE_SIZE:
-				sample_tips = sample(tangle.tips, SAMPLE_SIZE)
-			else:
-				sample_tips = tangle.tips
+			tangle.track(tx_original)
+			weight_original = self.approval_bucket(tx_original, tangle.tips)
+			observed_weight_original = self.approval_bucket(tx_original, adversary_tangle.tips)
+	
+		if tx_double_spend:
+			action = 'build'
 
-			adversary_tips = []
-			if len(adversary_tangle.tips) > SAMPLE_SIZE:
-				adversary_tips = sample(adversary_tangle.tips, SAMPLE_SIZE)
-			else:
-				adversary_tips = adversary_tangle.tips
+			tangle.track(tx_double_spend)
+			weight_double_spend = self.approval_bucket(tx_double_spend, tangle.tips)
+			observed_weight_double_spend = self.approval_bucket(tx_double_spend, adversary_tangle.tips)
 
+		self.original_weights.append(weight_original)
+		self.double_spend_weights.append(weight_double_spend)
 
-			for tip in sample_tips:
-				if nx.has_path(tangle.dag, tx_original, tip):
-					weight_original += 1 * (SAMPLE_SIZE / len(sample_tips))
-			for tip in adversary_tips:
-				if nx.has_path(tangle.dag, tx_original, tip):
-					observed_weight_original += 1 * (SAMPLE_SIZE / len(adversary_tips))
-		
-		if tx_double_spend:
-			action = 'build'
+		self.observed_original_weights.append(observed_weight_original)
+		self.observed_double_spend_weights.append(observed_weight_double_spend)
 
-			sample_tips = []
-			if len(tangle.tips) > SAMPLE_SIZE:
-				sample_tips = sample(tangle.tips, SAMPLE_SIZE)
-			else:
-				sample_tips = tangle.tips
+		discretization = self.discretization
+		since_attack = self.time_step - self.start_attack_at
+		global_features = discretization.feature_buckets(len(tangle.tips), since_attack)
+		local_features = discretization.feature_buckets(len(adversary_tangle.tips), since_attack)
 
-			adversary_tips = []
-			if len(adversary_tangle.tips) > SAMPLE_SIZE:
-				adversary_tips = sample(adversary_tangle.tips, SAMPLE_SIZE)
-			else:
-				adversary_tips = adversary_tangle.tips
-
-			for tip in sample_tips:
-				if nx.has_path(tangle.dag, tx_double_spend, tip):
-					weight_double_spend += 1 * (SAMPLE_SIZE / len(sample_tips))
-			for tip in adversary_tips:
-				if nx.has_path(tangle.dag, tx_double_spend, tip):
-					observed_weight_double_spend += 1 * (SAMPLE_SIZE / len(adversary_tips))
-
-		weight_original = floor(weight_original)
-		weight_double_spend = floor(weight_double_spend)
-		observed_weight_original = floor(observed_weight_original)
-		observed_weight_double_spend = floor(observed_weight_double_spend)
-
-		original_weights.append(weight_original)
-		double_spend_weights.append(weight_double_spend)
-
-		observed_original_weights.append(observed_weight_original)
-		observed_double_spend_weights.append(observed_weight_double_spend)
-
-		alphabet = {}
-		alphabet[0] = 'a'
-		alphabet[1] = 'b'
-		alphabet[2] = 'c'
-		alphabet[3] = 'd'
-		alphabet[4] = 'e'
-		alphabet[5] = 'f'
-		alphabet[6] = 'g'
-		alphabet[7] = 'h'
-		alphabet[8] = 'i'
-		alphabet[9] = 'j'
-		alphabet[10] = 'k'
-
-		global_state = '{to}-{td}'.format(to=alphabet[weight_original], td=alphabet[weight_double_spend])
-		local_state = '{oo}-{od}'.format(oo=alphabet[observed_weight_original], od=alphabet[observed_weight_double_spend])
-
-		print('S={g} and O={l}'.format(g=global_state, l=local_state))
+		global_state = discretization.label([weight_original, weight_double_spend] + global_features)
+		local_state = discretization.label([observed_weight_original, observed_weight_double_spend] + local_features)
+
+		if self.verbose:
+			print('S={g} and O={l}'.format(g=global_state, l=local_state))
 
 		if action:
-			data['global'].append([global_state, action])
-			data['local'].append(local_state)
+			self.data['global'].append([global_state, action])
+			self.data['local'].append(local_state)
+			if self.writer:
+				self.writer.append(global_state, action, local_state)
+
+	def approval_bucket(self, tx, tips):
+		if not len(tips):
+			return 0
+		return self.discretization.weight_bucket(self.tangle.approval_count(tx, tips), len(tips))
+
+	def run(self):
+		while self.time_step < self.time_steps:
+			self.step()
+		if self.writer:
+			self.writer.close()
+		if self.instruments is not None and self.verbose:
+			print(self.instruments.report())
+		return self.data
+
+def output_name(n_nodes, npn, tps, bw):
+	return "N{nn}NPN{npn}TPS{tps}BW{bw}".format(nn=n_nodes, npn=npn, tps=tps, bw=bw)
 
-	np.save("N{nn}NPN{npn}TPS{tps}BW{bw}".format(nn=N_NODES, npn=NEIGHBORS_PER_NODE, tps=TPS, bw=BANDWIDTH_LIMIT) + '.npy', data) 
+def main():
+	simulation = Simulation(n_nodes=N_NODES, npn=NEIGHBORS_PER_NODE, tps=TPS, bw=BANDWIDTH_LIMIT,
+		time_steps=TIME_STEPS, make_original_at=MAKE_ORIGINAL_AT, start_attack_at=START_ATTACK_AT,
+		backend=BACKEND, tip_selection=TIP_SELECTION, message_bus=MESSAGE_BUS, ids=IDS, compaction=COMPACTION, issuance=ISSUANCE, topology=TOPOLOGY, listen_policy=LISTEN_POLICY,
+		trajectory=output_name(N_NODES, NEIGHBORS_PER_NODE, TPS, BANDWIDTH_LIMIT) + '.traj', instruments=INSTRUMENT or None)
+	simulation.run()
+	if simulation.instruments is not None:
+		simulation.instruments.dump(output_name(N_NODES, NEIGHBORS_PER_NODE, TPS, BANDWIDTH_LIMIT) + '.instruments.json')
 
 if __name__ == '__main__':
 	main()
@@ -0,0 +1,58 @@
+import gzip, pickle, random
+
+import numpy as np
+
+# Checkpoints of a whole simulation_5 run: the global tangle, every node with
+# its local tangle and broadcast queue, the communication buffers and the
+# state of the global random generators, pickled in one pass (so shared
+# objects stay shared) and optionally gzip'd to disk. A checkpoint taken after
+# the honest warm-up can be forked into any number of attack variants.
+# Tangles pickle with their walk caches, so a restored run carries on exactly
+# as the original would have.
+
+def capture(simulation):
+	return pickle.dumps((simulation, random.getstate(), np.random.get_state()), protocol=pickle.HIGHEST_PROTOCOL)
+
+def restore(checkpoint):
+	(simulation, random_state, np_random_state) = pickle.loads(checkpoint)
+	random.setstate(random_state)
+	np.random.set_state(np_random_state)
+	return simulation
+
+def save(simulation, path, compresslevel=1):
+	with gzip.open(path, 'wb', compresslevel=compresslevel) as handle:
+		handle.write(capture(simulation))
+
+def load(path):
+	with gzip.open(path, 'rb') as handle:
+		return restore(handle.read())
+
+def read(path):
+	with gzip.open(path, 'rb') as handle:
+		return handle.read()
+
+def fork(checkpoint, seed=None, trajectory=None, **overrides):
+	# A fresh copy of the checkpointed simulation. `overrides` replace its
+	# attributes (e.g. start_attack_at or time_steps), and a seed reseeds the
+	# global generators so that variants drawn from one checkpoint diverge.
+	simulation = restore(checkpoint)
+	for (name, value) in overrides.items():
+		if not hasattr(simulation, name):
+			raise AttributeError("Simulation has no attribute {n}.".format(n=name))
+		setattr(simulation, name, value)
+	if seed is not None:
+		random.seed(seed)
+		np.random.seed(seed)
+	if trajectory:
+		simulation.open_trajectory(trajectory)
+	return simulation
+
+def warm_up(simulation, ticks):
+	while simulation.time_step < ticks:
+		simulation.step()
+	return capture(simulation)
+
+def branch(checkpoint, variants):
+	# Runs one fork per variant (a dict of fork arguments) and yields its data.
+	for variant in variants:
+		yield fork(checkpoint, **variant).run()
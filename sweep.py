@@ -0,0 +1,197 @@
+import os, sys, json, gzip, time, hashlib, argparse, itertools, traceback, random
+from multiprocessing import Pool
+
+import numpy as np
+
+import simulation_5
+from simulation_5 import Simulation
+from discretization import Discretization
+from trials import trial_seeds
+
+# Parameter sweeps over simulation_5. A spec names the base parameters, the
+# axes to vary (a full grid, or random samples from each axis) and the number
+# of seeds per cell. Every run is keyed by a hash of its complete parameters
+# and seed, and its result (weights, logged steps and instrument counters such
+# as drops and duplicates) is written to <cache>/<hash>.json.gz once the run
+# finishes, through a temporary file so an interrupted sweep never leaves a
+# partial result behind. Rerunning a spec (or a larger one sharing cells with
+# it) runs only what is missing. Runs are handed to the pool most expensive
+# first, so a long cell does not start last and hold up the whole sweep. The
+# original and double-spend are recorded by content hash, so results name them
+# the same whichever ids a run used.
+#
+# {"base": {"time_steps": 600},
+#  "grid": {"n_nodes": [50, 100], "tps": [10, 20]},
+#  "seeds": 4, "seed": 0}
+#
+# With "random" instead of "grid", "samples" cells are drawn from the axes,
+# each a list of values or {"low": ..., "high": ..., "log": bool, "int": bool}.
+# The draws come from the spec's seed, so a resumed sweep draws the same cells.
+
+CACHE_VERSION = 2
+
+DEFAULTS = {
+	'n_nodes': simulation_5.N_NODES,
+	'npn': simulation_5.NEIGHBORS_PER_NODE,
+	'tps': simulation_5.TPS,
+	'bw': simulation_5.BANDWIDTH_LIMIT,
+	'time_steps': simulation_5.TIME_STEPS,
+	'make_original_at': simulation_5.MAKE_ORIGINAL_AT,
+	'start_attack_at': simulation_5.START_ATTACK_AT,
+	'backend': simulation_5.BACKEND,
+	'tip_selection': simulation_5.TIP_SELECTION,
+	'message_bus': simulation_5.MESSAGE_BUS,
+	'ids': simulation_5.IDS,
+	'compaction': simulation_5.COMPACTION,
+	'issuance': simulation_5.ISSUANCE,
+	'adversaries': 1,
+	'attacks': 1,
+	'attack_period': None,
+	'topology': simulation_5.TOPOLOGY,
+	'listen_policy': simulation_5.LISTEN_POLICY,
+	'discretization': simulation_5.DISCRETIZATION.config(),
+}
+
+def grid_cells(axes):
+	names = sorted(axes)
+	for values in itertools.product(*[axes[name] for name in names]):
+		yield dict(zip(names, values))
+
+def draw(axis, np_rng):
+	if isinstance(axis, list):
+		return axis[np_rng.randint(len(axis))]
+	(low, high) = (axis['low'], axis['high'])
+	if axis.get('log'):
+		value = float(np.exp(np_rng.uniform(np.log(low), np.log(high))))
+	else:
+		value = float(np_rng.uniform(low, high))
+	return int(round(value)) if axis.get('int') else value
+
+def random_cells(axes, samples, seed):
+	np_rng = np.random.RandomState(seed)
+	names = sorted(axes)
+	for _ in range(samples):
+		yield {name: draw(axes[name], np_rng) for name in names}
+
+def cells(spec):
+	if 'grid' in spec and 'random' in spec:
+		raise ValueError("A sweep spec takes either a grid or random axes, not both.")
+	if 'random' in spec:
+		varied = random_cells(spec['random'], spec['samples'], spec.get('seed', 0))
+	else:
+		varied = grid_cells(spec.get('grid', {}))
+	for cell in varied:
+		params = dict(DEFAULTS)
+		params.update(spec.get('base', {}))
+		params.update(cell)
+		unknown = set(params) - set(DEFAULTS)
+		if unknown:
+			raise ValueError("Unknown sweep parameters {u}.".format(u=sorted(unknown)))
+		yield params
+
+def config_hash(params, seed):
+	key = json.dumps({'version': CACHE_VERSION, 'params': params, 'seed': seed}, sort_keys=True)
+	return hashlib.sha256(key.encode()).hexdigest()[:20]
+
+def cost(params):
+	# Rough work per run: every transaction issued is gossiped over every
+	# link, and each node keeps a tangle that grows with the run.
+	return params['time_steps'] * params['tps'] * params['n_nodes'] * params['npn']
+
+def result_path(cache, key):
+	return os.path.join(cache, key + '.json.gz')
+
+def write_atomic(path, result):
+	partial = "{p}.{pid}.tmp".format(p=path, pid=os.getpid())
+	with gzip.open(partial, 'wt') as handle:
+		json.dump(result, handle)
+	os.replace(partial, path)
+
+def read_result(path):
+	with gzip.open(path, 'rt') as handle:
+		return json.load(handle)
+
+def jobs(spec, cache):
+	# Every run of the spec as (key, params, seed), and whether it is done.
+	seeds = trial_seeds(spec.get('seed', 0), spec.get('seeds', 1))
+	for params in cells(spec):
+		for seed in seeds:
+			key = config_hash(params, seed)
+			yield (key, params, seed), os.path.exists(result_path(cache, key))
+
+def content_hash(tangle, tx):
+	return None if tx is None else tangle.content_hash(tx)
+
+def run_cell(job):
+	(key, params, seed), cache = job
+	try:
+		random.seed(seed)
+		np.random.seed(seed)
+		started = time.perf_counter()
+		simulation = Simulation(verbose=False, instruments=True, **dict(params, discretization=Discretization.from_config(params['discretization'])))
+		data = simulation.run()
+		write_atomic(result_path(cache, key), {
+			'params': params,
+			'seed': seed,
+			'seconds': time.perf_counter() - started,
+			'original': content_hash(simulation.tangle, simulation.tx_original),
+			'double_spend': content_hash(simulation.tangle, simulation.tx_double_spend),
+			'original_weights': simulation.original_weights,
+			'double_spend_weights': simulation.double_spend_weights,
+			'counters': dict(simulation.instruments.counters),
+			'data': data,
+		})
+		return key, None
+	except Exception:
+		return key, traceback.format_exc()
+
+def run_sweep(spec, cache, processes=None):
+	os.makedirs(cache, exist_ok=True)
+	pending = []
+	finished = 0
+	for job, done in jobs(spec, cache):
+		if done:
+			finished += 1
+		else:
+			pending.append(job)
+	pending.sort(key=lambda job: cost(job[1]), reverse=True)
+	print("{f} runs cached, {p} to go.".format(f=finished, p=len(pending)))
+
+	failures = []
+	if pending:
+		with Pool(processes) as pool:
+			for i, (key, error) in enumerate(pool.imap_unordered(run_cell, [(job, cache) for job in pending])):
+				if error:
+					failures.append(key)
+					print("Run {k} failed:\n{e}".format(k=key, e=error))
+					continue
+				print("Run {k} finished ({i} of {p}).".format(k=key, i=i + 1, p=len(pending)))
+
+	print("{d} of {k} runs finished.".format(d=finished + len(pending) - len(failures), k=finished + len(pending)))
+	return failures
+
+def load(spec, cache):
+	# The cached result of every finished run of the spec, in spec order.
+	return [read_result(result_path(cache, job[0])) for job, done in jobs(spec, cache) if done]
+
+def main(arguments):
+	parser = argparse.ArgumentParser(description="Run a cached parameter sweep of simulation_5.")
+	parser.add_argument('spec')
+	parser.add_argument('--cache', default='sweep')
+	parser.add_argument('--processes', type=int, default=None)
+	parser.add_argument('--dry-run', action='store_true')
+	options = parser.parse_args(arguments[1:])
+
+	with open(options.spec) as handle:
+		spec = json.load(handle)
+	if options.dry_run:
+		for (key, params, seed), done in jobs(spec, options.cache):
+			varied = {name: value for (name, value) in params.items() if value != DEFAULTS[name]}
+			print("{k} {s} {d} {v}".format(k=key, s=seed, d='done' if done else 'todo', v=json.dumps(varied, sort_keys=True)))
+		return
+
+	if run_sweep(spec, options.cache, processes=options.processes):
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main(sys.argv)
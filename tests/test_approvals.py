@@ -0,0 +1,72 @@
+import random
+
+import numpy as np
+import networkx as nx
+import pytest
+
+from iota import Tangle, Node
+from simulation_5 import Simulation
+
+# The approval bitsets answer what nx.has_path did on a real tangle: for the
+# run's original and double-spend, tracked early and carried along as the
+# tangle grew, for transactions tracked only at the end, and for bits freed
+# by untrack and handed out again. A node stops watching a conflict once it
+# is settled, and the global tangle only the pair the simulation observes.
+
+def grown(backend):
+	random.seed(3)
+	np.random.seed(3)
+	simulation = Simulation(n_nodes=12, npn=4, time_steps=45, make_original_at=10, start_attack_at=20, verbose=False, backend=backend)
+	simulation.run()
+	return simulation.tangle
+
+def check(tangle, tracked):
+	graph = nx.DiGraph()
+	graph.add_nodes_from(tangle.dag)
+	graph.add_edges_from((parent, tx) for tx in tangle.dag for parent in tangle.get_parents(tx))
+	for source in tracked:
+		for tx in tangle.dag:
+			assert tangle.approves(source, tx) == nx.has_path(graph, source, tx)
+		assert tangle.approval_count(source) == sum(nx.has_path(graph, source, tip) for tip in tangle.tips)
+
+@pytest.mark.parametrize('backend', ['networkx', 'array'])
+def test_approvals_match_has_path(backend):
+	tangle = grown(backend)
+	assert len(tangle.tracked) == 2
+	rng = random.Random(4)
+	late = rng.sample(sorted(tangle.dag), 6)
+	for tx in late:
+		tangle.track(tx)
+	check(tangle, list(tangle.tracked))
+	for tx in late[:3]:
+		tangle.untrack(tx)
+	assert len(tangle.free_bits) == 3
+	again = rng.sample(sorted(tangle.dag), 3)
+	for tx in again:
+		tangle.track(tx)
+	assert not tangle.free_bits
+	check(tangle, list(tangle.tracked))
+
+def test_settled_conflicts_are_untracked():
+	gt = Tangle()
+	genesis = gt.genesis
+	gt.add_node(genesis)
+	for (tx, parents) in (('a', [genesis]), ('x', ['a']), ('b', ['x']), ('c', ['b']), ('_x', ['a'])):
+		gt.publish(tx, parents)
+	node = Node(1, gt, Tangle(), 1, 10, [], [], {})
+	node.lt.add_node(genesis)
+	for tx in ('a', 'x', 'b', 'c', '_x'):
+		node.integrate(tx)
+	assert '_x' not in node.lt.dag and '_x' in node.lt.blacklist
+	assert not node.lt.tracked
+	assert not node.lt.approvals
+	node.lt.retire(['a'])
+	assert 'a' in node.lt.solid
+
+def test_attacks_leave_only_the_watched_pair_tracked(capsys):
+	random.seed(7)
+	np.random.seed(7)
+	simulation = Simulation(n_nodes=20, npn=4, time_steps=50, make_original_at=20, start_attack_at=24, attack_period=10, adversaries=2, attacks=3, verbose=False)
+	simulation.run()
+	assert capsys.readouterr().out.count('Made double-spend') > 2
+	assert set(simulation.tangle.tracked) == {simulation.tx_original, simulation.tx_double_spend}
@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+import pytest
+
+from simulation_5 import Simulation
+
+# Storage backends and the message bus change how a run is computed, not what
+# it computes: with one seed every variant logs the same steps and weights and
+# grows a tangle of the same size.
+
+PARAMS = dict(n_nodes=20, npn=4, time_steps=80, make_original_at=20, start_attack_at=40, verbose=False)
+
+def run(**params):
+	random.seed(1)
+	np.random.seed(1)
+	simulation = Simulation(**dict(PARAMS, **params))
+	data = simulation.run()
+	return data, simulation.original_weights, simulation.double_spend_weights, len(simulation.tangle.dag)
+
+@pytest.fixture(scope='module')
+def reference():
+	return run()
+
+@pytest.mark.parametrize('backend', ['array', 'view'])
+def test_backend_matches_networkx(reference, backend):
+	assert run(backend=backend) == reference
+
+def test_view_jump_matches_array():
+	assert run(backend='view', tip_selection='mcmc_jump') == run(backend='array', tip_selection='mcmc_jump')
+
+def test_message_bus_matches_lists(reference):
+	assert run(backend='array', message_bus=True) == reference
@@ -0,0 +1,86 @@
+import random
+
+import numpy as np
+import pytest
+
+from bus import MessageBus, fair_shares
+
+# fair_shares splits a node's bandwidth over its links max-min fairly, in
+# proportion to the link weights. MessageBus links keep what plain lists
+# capped at the buffer capacity would, through any number of wraparounds.
+
+def test_shares_fill_bandwidth_fairly():
+	assert fair_shares([3, 3], 10).tolist() == [3, 3]
+	assert fair_shares([10, 10, 10], 9).tolist() == [3, 3, 3]
+	# What the short link leaves goes to the others; the spare message to
+	# the earlier of the tied links.
+	assert fair_shares([1, 10, 10], 8).tolist() == [1, 4, 3]
+	assert fair_shares([10, 10], 9, [2, 1]).tolist() == [6, 3]
+	rng = np.random.RandomState(1)
+	for _ in range(200):
+		lengths = rng.randint(0, 20, size=6)
+		bandwidth = rng.randint(1, 40)
+		quotas = fair_shares(lengths, bandwidth, rng.uniform(0.1, 3, size=6))
+		assert quotas.sum() == min(bandwidth, lengths.sum())
+		assert (quotas <= lengths).all() and (quotas >= 0).all()
+
+def test_empty_links_may_have_zero_weight():
+	# The weighted policy weighs links by their backlog, so empty ones weigh 0.
+	assert fair_shares([0, 8, 4], 6, [0, 8, 4]).tolist() == [0, 4, 2]
+
+@pytest.mark.parametrize('weights', [[0, 0], [1, 0], [-1, 2]])
+def test_waiting_links_need_positive_weights(weights):
+	with pytest.raises(ValueError):
+		fair_shares([10, 10], 5, weights)
+
+@pytest.mark.parametrize('drop_remaining', [True, False])
+def test_drain_drops_or_keeps_the_rest(drop_remaining):
+	bus = MessageBus([(0, 1), (2, 1)], capacity=8, drop_remaining=drop_remaining, queue_limit=None)
+	bus.broadcast(0, ['a', 'b', 'c', 'd', 'e'])
+	bus.broadcast(2, ['v', 'w'])
+	# Newest first, one from each link per pass, as Node.listen pulls them.
+	assert bus.drain(1, 3) == ['e', 'w', 'd', 'v']
+	if drop_remaining:
+		assert bus.backlog(1).tolist() == [0, 0]
+		assert bus.dropped == 3
+		assert bus.drain(1, 10) == []
+	else:
+		assert bus.backlog(1).tolist() == [3, 0]
+		assert bus.dropped == 0
+		assert bus.drain(1, 10) == ['c', 'b', 'a']
+
+def test_ring_buffers_wrap_like_lists():
+	rng = random.Random(4)
+	capacity = 5
+	bus = MessageBus([(0, 2), (1, 2)], capacity=capacity, drop_remaining=False, queue_limit=None)
+	# Each link as a list of (stamp, tx), oldest first.
+	queues = [[], []]
+	(clock, overflowed, n_txs) = (0, 0, 0)
+	for _ in range(500):
+		if rng.random() < 0.5:
+			sender = rng.randrange(2)
+			txs = ['t{i}'.format(i=n_txs + i) for i in range(rng.randint(1, 2 * capacity))]
+			n_txs += len(txs)
+			bus.broadcast(sender, txs)
+			block = txs[-capacity:]
+			overflowed += max(len(queues[sender]) + len(txs) - capacity, 0)
+			queues[sender] = (queues[sender] + [(clock + i, tx) for (i, tx) in enumerate(block)])[-capacity:]
+			clock += len(block)
+		else:
+			quotas = [rng.randint(0, capacity) for _ in queues]
+			oldest = rng.random() < 0.5
+			taken = []
+			for (e, quota) in enumerate(quotas):
+				quota = min(quota, len(queues[e]))
+				if oldest:
+					taken.extend(queues[e][:quota])
+					queues[e] = queues[e][quota:]
+				else:
+					taken.extend(reversed(queues[e][len(queues[e]) - quota:]))
+					queues[e] = queues[e][:len(queues[e]) - quota]
+			if oldest:
+				taken.sort()
+			assert bus.take(2, quotas, oldest=oldest) == [tx for (stamp, tx) in taken]
+		assert bus.backlog(2).tolist() == [len(queue) for queue in queues]
+		assert bus.overflowed == overflowed
+	assert n_txs > 20 * capacity
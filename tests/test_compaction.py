@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+
+from iota import Tangle
+from simulation_5 import Simulation
+
+# Compaction keeps a node's memory level: arrival ticks only for what is still
+# in its tangle, and retired transactions only within the horizon. Retiring
+# leaves no stale parents or children cached behind.
+
+def test_compaction_stays_bounded():
+	random.seed(1)
+	np.random.seed(1)
+	simulation = Simulation(n_nodes=10, npn=4, time_steps=120, make_original_at=40, start_attack_at=80, verbose=False, compaction={'max_age': 10, 'every': 5, 'horizon': 15})
+	simulation.run()
+	for node in simulation.nodes[1:]:
+		lt = node.lt
+		assert set(lt.arrival_ticks) == set(lt.dag)
+		assert lt.solid
+		assert min(lt.solid.values()) >= lt.now - 15 - 5
+		assert not set(lt.solid) & set(lt.dag)
+
+def test_retire_drops_stale_links():
+	tangle = Tangle()
+	genesis = tangle.genesis
+	tangle.add_node(genesis)
+	tangle.tips.add(genesis)
+	tangle.publish('a', [genesis])
+	tangle.publish('b', ['a'])
+	tangle.publish('c', ['a', genesis])
+	assert tangle.get_children(genesis) == ['a', 'c']
+	assert tangle.get_parents('c') == ['a', genesis]
+	assert tangle.retire(['a']) == ['a']
+	assert tangle.get_children(genesis) == ['c']
+	assert tangle.get_parents('c') == [genesis]
+	assert tangle.get_parents('b') == []
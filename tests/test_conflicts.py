@@ -0,0 +1,103 @@
+import random
+
+import numpy as np
+
+from conflicts import ConflictIndex, Blacklist, spend_of
+from iota import Tangle, Node, Adversary
+from simulation_5 import Simulation
+
+# Alternatives of a spend are found by lookup, the heaviest one wins (ties to
+# the first seen), the losers' cones stay out for good, and several
+# adversaries attacking repeatedly leave every node at most one alternative of
+# each spend.
+
+def test_index_groups_alternatives_of_a_spend():
+	dag = {'x'}
+	index = ConflictIndex()
+	index.add('x', dag)
+	index.add('y', dag)
+	assert len(index) == 0
+	assert spend_of('__x') == 'x'
+	index.add('_x', dag)
+	index.add('__x', dag)
+	assert index.rivals('x') == ['_x', '__x']
+	assert index.rivals('__x') == ['x', '_x']
+	assert index.rivals('y') == []
+	index.discard('_x')
+	assert index.rivals('x') == ['__x']
+	index.discard('x')
+	index.discard('__x')
+	assert len(index) == 0
+
+def test_settled_spends_refuse_other_alternatives():
+	index = ConflictIndex()
+	index.add('x', {'x'})
+	index.add('_x', {'x'})
+	index.settle('x')
+	assert index.settled_against('_x', solid={})
+	assert not index.settled_against('x', solid={})
+	# A retired original settles its double-spends even unindexed.
+	assert ConflictIndex().settled_against('_y', solid={'y': 0})
+
+def test_blacklist_membership():
+	blacklist = Blacklist(['a'])
+	blacklist.append('b')
+	blacklist.extend(['c', 'b'])
+	assert len(blacklist) == 3
+	assert set(blacklist) == {'a', 'b', 'c'}
+	assert 'c' in blacklist and 'd' not in blacklist
+
+def node_with(txs, check_conflicts=True):
+	# A node that has integrated `txs`, (tx, parents) pairs, in order.
+	gt = Tangle()
+	gt.add_node(gt.genesis)
+	for (tx, parents) in txs:
+		gt.publish(tx, [gt.genesis if parent is None else parent for parent in parents])
+	node = Node(1, gt, Tangle(), 1, 10, [], [], {})
+	node.check_conflicts = check_conflicts
+	node.lt.add_node(gt.genesis)
+	for (tx, parents) in txs:
+		node.integrate(tx)
+	return node
+
+def test_heaviest_alternative_wins():
+	# __x arrives last but has the most approving tips.
+	node = node_with([('x', [None]), ('_x', [None]), ('a', ['_x']), ('__x', [None]), ('b', ['__x']), ('c', ['__x'])], check_conflicts=False)
+	assert node.lt.conflicts.rivals('__x') == ['x', '_x']
+	assert node.resolve(['x', '_x', '__x']) == '__x'
+	node.check_conflicts = True
+	node.settle_conflict('__x')
+	for tx in ('x', '_x', 'a'):
+		assert tx not in node.lt.dag and tx in node.lt.blacklist
+	assert '__x' in node.lt.dag
+	assert node.lt.conflicts.rivals('__x') == []
+	assert not node.receive('x')
+	assert 'x' not in node.lt.dag
+
+def test_ties_go_to_the_first_seen():
+	node = node_with([('x', [None]), ('_x', [None])], check_conflicts=False)
+	assert node.resolve(['x', '_x']) == 'x'
+	assert node.resolve(['_x', 'x']) == '_x'
+	# On arrival the newcomer weighs as much as an unapproved original.
+	node = node_with([('x', [None]), ('_x', [None])])
+	assert 'x' in node.lt.dag and '_x' not in node.lt.dag
+
+def run(seed):
+	random.seed(seed)
+	np.random.seed(seed)
+	simulation = Simulation(n_nodes=20, npn=4, time_steps=50, make_original_at=20, start_attack_at=24, attack_period=10, adversaries=2, attacks=3, verbose=False)
+	data = simulation.run()
+	return simulation, (data, simulation.original_weights, simulation.double_spend_weights)
+
+def test_several_adversaries_and_attacks():
+	(simulation, outcome) = run(7)
+	assert run(7)[1] == outcome
+	adversaries = [node for node in simulation.nodes if type(node) is Adversary]
+	assert len(adversaries) == 2
+	assert all(adversary.double_spend is not None for adversary in adversaries)
+	double_spends = [tx for tx in simulation.tangle.dag if tx[0] == '_']
+	assert len(double_spends) > len(adversaries)
+	for node in simulation.nodes:
+		assert all(len(alternatives) <= 1 for alternatives in node.lt.conflicts.spends.values())
+		for tx in node.lt.dag:
+			assert tx[0] != '_' or tx[1:] not in node.lt.dag
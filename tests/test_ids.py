@@ -0,0 +1,45 @@
+import random
+
+import numpy as np
+import pytest
+
+from sweep import load, run_sweep
+from simulation_5 import Simulation
+
+# A counter-id run builds the tangle a hash-id run with the same seeds does:
+# mapped through content_hash, every counter id is the hash the other run gave
+# that transaction, so the transactions, their parents and the weights agree,
+# and a sweep records the same original and double-spend in either mode.
+
+def run(ids, backend):
+	random.seed(1)
+	np.random.seed(1)
+	simulation = Simulation(n_nodes=20, npn=4, time_steps=60, make_original_at=20, start_attack_at=40, verbose=False, ids=ids, backend=backend)
+	data = simulation.run()
+	return simulation, (data, simulation.original_weights, simulation.double_spend_weights)
+
+def edges(tangle, name):
+	return {(name(parent), name(tx)) for tx in tangle.dag for parent in tangle.get_parents(tx)}
+
+@pytest.mark.parametrize('backend', ['networkx', 'array'])
+def test_counter_ids_keep_the_hash_run(backend):
+	(hashed, outcome) = run('hash', backend)
+	(counted, counted_outcome) = run('counter', backend)
+	assert counted_outcome == outcome
+	tangle = counted.tangle
+	assert tangle.genesis != hashed.tangle.genesis
+	assert {tangle.content_hash(tx) for tx in tangle.dag} == set(hashed.tangle.dag)
+	assert edges(tangle, tangle.content_hash) == edges(hashed.tangle, str)
+	assert tangle.content_hash(counted.tx_original) == hashed.tx_original
+	assert tangle.content_hash(counted.tx_double_spend) == hashed.tx_double_spend
+	assert counted.tx_double_spend == '_' + counted.tx_original
+
+def test_sweeps_record_hashes_in_either_mode(tmp_path):
+	base = {'n_nodes': 12, 'npn': 4, 'tps': 10, 'bw': 5, 'time_steps': 25, 'make_original_at': 8, 'start_attack_at': 10}
+	spec = {'base': base, 'grid': {'ids': ['hash', 'counter']}, 'seeds': 1}
+	assert not run_sweep(spec, str(tmp_path), processes=1)
+	[first, second] = load(spec, str(tmp_path))
+	assert {first['params']['ids'], second['params']['ids']} == {'hash', 'counter'}
+	assert first['original'] and first['double_spend'] == '_' + first['original']
+	for field in ('original', 'double_spend', 'original_weights', 'double_spend_weights', 'data'):
+		assert first[field] == second[field]
@@ -0,0 +1,16 @@
+from parallel import ShardedSimulation
+
+# A seed gives the same sharded run whatever the number of shards.
+
+PARAMS = dict(n_nodes=16, npn=4, time_steps=40, make_original_at=10, start_attack_at=25, verbose=False, seed=3)
+
+def run(n_shards):
+	simulation = ShardedSimulation(n_shards=n_shards, **PARAMS)
+	data = simulation.run()
+	return data, simulation.original_weights, simulation.double_spend_weights
+
+def test_shard_count_does_not_change_the_run():
+	reference = run(1)
+	assert reference[0]['global']
+	assert run(2) == reference
+	assert run(3) == reference
@@ -0,0 +1,144 @@
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from data_to_pomdp import data_to_pomdp, get_T, get_O, ModelCounts, ACTIONS
+from discretization import Discretization
+
+# The numpy counts match a plain loop over the steps, chunked counting matches
+# counting everything at once, and the sparse and dense .POMDP writers
+# describe the same model.
+
+def make_data(n_steps=400, seed=5, discretization=None):
+	rng = random.Random(seed)
+	states = (discretization or Discretization(buckets=4)).states()
+	# A few states visited often, so that some rows have data and most none.
+	visited = rng.sample(states, 6)
+	data = {'global': [], 'local': []}
+	for _ in range(n_steps):
+		data['global'].append([rng.choice(visited), rng.choice(ACTIONS[1:])])
+		data['local'].append(rng.choice(visited))
+	return data
+
+def loop_counts(data):
+	transitions = Counter()
+	observations = Counter()
+	steps = data['global']
+	for (state, action), observation in zip(steps, data['local']):
+		observations[(state, observation)] += 1
+	for (start, action), (end, _) in zip(steps, steps[1:]):
+		transitions[(action, start, end)] += 1
+	return transitions, observations
+
+def read_pomdp(path):
+	# The T and O entries of a file as dense arrays, applied in file order
+	# the way a solver reads them.
+	with open(path) as handle:
+		lines = [line.strip() for line in handle]
+	header = dict(line.split(':', 1) for line in lines if line.split(':')[0] in ('states', 'actions', 'observations'))
+	S = header['states'].split()
+	A = header['actions'].split()
+	O_states = header['observations'].split()
+	T = np.zeros((len(A), len(S), len(S)))
+	O = np.zeros((len(S), len(O_states)))
+
+	def pick(label, labels):
+		return slice(None) if label == '*' else labels.index(label)
+
+	i = 0
+	while i < len(lines):
+		line = lines[i]
+		kind = line.split(':')[0]
+		if kind not in ('T', 'O'):
+			i += 1
+			continue
+		fields = [field.strip() for field in line[2:].split(':')]
+		if kind == 'T':
+			(matrix, labels) = (T, [A, S, S])
+		else:
+			(matrix, labels) = (O, [S, O_states])
+			fields = fields[1:]
+		if len(fields) == len(labels):
+			# An entry: the last field also holds the probability.
+			(last, probability) = fields[-1].split()
+			index = tuple(pick(field, group) for field, group in zip(fields[:-1] + [last], labels))
+			matrix[index] = float(probability)
+			i += 1
+		else:
+			index = tuple(pick(field, group) for field, group in zip(fields, labels))
+			row = lines[i + 1]
+			width = len(labels[-1])
+			matrix[index] = 1.0 / width if row == 'uniform' else np.array([float(p) for p in row.split()])
+			i += 2
+	return T, O
+
+def test_counts_match_loop():
+	discretization = Discretization(buckets=4)
+	data = make_data(discretization=discretization)
+	counts = ModelCounts(discretization.states(), ACTIONS)
+	counts.update(data)
+	(transitions, observations) = loop_counts(data)
+	for (action, start, end), n in transitions.items():
+		assert counts.transitions[counts.action_codes[action], counts.state_codes[start], counts.state_codes[end]] == n
+	for (state, observation), n in observations.items():
+		assert counts.observations[counts.state_codes[state], counts.observation_codes[observation]] == n
+	assert counts.transitions.sum() == sum(transitions.values())
+	assert counts.observations.sum() == sum(observations.values())
+
+def test_chunked_counts_match():
+	discretization = Discretization(buckets=4)
+	data = make_data(discretization=discretization)
+	whole = ModelCounts(discretization.states(), ACTIONS)
+	whole.update(data)
+	chunked = ModelCounts(discretization.states(), ACTIONS)
+	for start in range(0, len(data['global']), 37):
+		chunked.update({'global': data['global'][start:start + 37], 'local': data['local'][start:start + 37]})
+	assert (chunked.transitions == whole.transitions).all()
+	assert (chunked.observations == whole.observations).all()
+
+@pytest.mark.parametrize('prior', [1, 0.5, 0])
+def test_sparse_file_matches_dense(tmp_path, prior):
+	discretization = Discretization(buckets=4)
+	data = make_data(discretization=discretization)
+	(sparse, dense) = (str(tmp_path / 'sparse.POMDP'), str(tmp_path / 'dense.POMDP'))
+	data_to_pomdp(data, fname=sparse, discretization=discretization, prior=prior, sparse=True)
+	data_to_pomdp(data, fname=dense, discretization=discretization, prior=prior, sparse=False)
+	(T_sparse, O_sparse) = read_pomdp(sparse)
+	(T_dense, O_dense) = read_pomdp(dense)
+	assert np.allclose(T_sparse, T_dense)
+	assert np.allclose(O_sparse, O_dense)
+	assert np.allclose(T_sparse.sum(axis=-1), 1)
+	assert np.allclose(O_sparse.sum(axis=-1), 1)
+
+def test_dense_rows_match_counts():
+	discretization = Discretization(buckets=4)
+	data = make_data(discretization=discretization)
+	S = discretization.states()
+	counts = ModelCounts(S, ACTIONS)
+	counts.update(data)
+	T = {(a, s, e): p for (a, s, e, p) in get_T(S, ACTIONS[1:], counts)}
+	O = {(s, o): p for (s, o, p) in get_O(S, ACTIONS, counts)}
+	(transitions, observations) = loop_counts(data)
+	for action in ACTIONS[1:]:
+		for start in S:
+			total = sum(transitions[(action, start, end)] for end in S) + len(S)
+			for end in S:
+				assert T[(action, start, end)] == pytest.approx((transitions[(action, start, end)] + 1) / total)
+	for state in S:
+		total = sum(observations[(state, observation)] for observation in S) + len(S)
+		assert O[(state, S[0])] == pytest.approx((observations[(state, S[0])] + 1) / total)
+
+def test_rows_without_data_are_uniform_without_prior():
+	discretization = Discretization(buckets=4)
+	data = make_data(discretization=discretization)
+	S = discretization.states()
+	T = np.array([p for (a, s, e, p) in get_T(S, ACTIONS[1:], data, prior=0)]).reshape(2, len(S), len(S))
+	O = np.array([p for (s, o, p) in get_O(S, ACTIONS, data, prior=0)]).reshape(len(S), len(S))
+	assert not np.isnan(T).any() and not np.isnan(O).any()
+	assert np.allclose(T.sum(axis=-1), 1)
+	assert np.allclose(O.sum(axis=-1), 1)
+	visited = {state for (state, action) in data['global']}
+	empty = [i for (i, state) in enumerate(S) if state not in visited]
+	assert np.allclose(O[empty], 1.0 / len(S))
@@ -0,0 +1,37 @@
+import random
+
+import numpy as np
+import pytest
+
+import snapshot
+from simulation_5 import Simulation
+
+# A run checkpointed part way and restored carries on exactly as the
+# uninterrupted run does.
+
+PARAMS = dict(n_nodes=20, npn=4, time_steps=60, make_original_at=20, start_attack_at=40, verbose=False)
+
+def fresh(**params):
+	random.seed(1)
+	np.random.seed(1)
+	return Simulation(**dict(PARAMS, **params))
+
+def outcome(simulation):
+	data = simulation.run()
+	return data, simulation.original_weights, simulation.double_spend_weights
+
+@pytest.mark.parametrize('backend', ['networkx', 'array', 'view'])
+def test_fork_continues_the_run(backend):
+	reference = outcome(fresh(backend=backend))
+	checkpoint = snapshot.warm_up(fresh(backend=backend), 30)
+	assert outcome(snapshot.fork(checkpoint)) == reference
+	assert outcome(snapshot.fork(checkpoint)) == reference
+
+def test_saved_checkpoint_continues_the_run(tmp_path):
+	reference = outcome(fresh())
+	simulation = fresh()
+	while simulation.time_step < 30:
+		simulation.step()
+	path = str(tmp_path / 'run.ckpt')
+	snapshot.save(simulation, path)
+	assert outcome(snapshot.load(path)) == reference
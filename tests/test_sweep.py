@@ -0,0 +1,39 @@
+import os
+
+import numpy as np
+
+from sweep import cells, jobs, load, result_path, run_sweep
+
+# A sweep reruns only what is missing, draws the same random cells when it is
+# resumed, and leaves nothing cached for a run that failed.
+
+BASE = {'n_nodes': 12, 'npn': 4, 'tps': 10, 'bw': 5, 'time_steps': 25, 'make_original_at': 8, 'start_attack_at': 10}
+
+def test_rerun_skips_cached_cells(tmp_path, capsys):
+	cache = str(tmp_path)
+	# The second cell cannot build its tangles.
+	spec = {'base': BASE, 'grid': {'backend': ['array', 'nope']}, 'seeds': 1}
+	assert len(run_sweep(spec, cache, processes=1)) == 1
+	assert sorted(os.listdir(cache)) == sorted(os.path.basename(result_path(cache, job[0])) for job, done in jobs(spec, cache) if done)
+	[(job, done), (failed, failed_done)] = sorted(jobs(spec, cache), key=lambda entry: entry[0][1]['backend'])
+	assert done and not failed_done
+	stamp = os.stat(result_path(cache, job[0])).st_mtime_ns
+	[result] = load(spec, cache)
+	assert result['params']['backend'] == 'array' and result['original_weights']
+
+	capsys.readouterr()
+	assert len(run_sweep(spec, cache, processes=1)) == 1
+	assert '1 runs cached, 1 to go.' in capsys.readouterr().out
+	assert os.stat(result_path(cache, job[0])).st_mtime_ns == stamp
+	assert len(os.listdir(cache)) == 1
+
+def test_random_cells_repeat_on_resume(tmp_path):
+	cache = str(tmp_path)
+	spec = {'base': BASE, 'random': {'time_steps': {'low': 15, 'high': 30, 'int': True}, 'ids': ['hash', 'counter']}, 'samples': 2, 'seeds': 1, 'seed': 3}
+	drawn = list(cells(spec))
+	keys = [job[0] for job, done in jobs(spec, cache)]
+	np.random.seed(11)
+	assert list(cells(spec)) == drawn
+	assert not run_sweep(spec, cache, processes=1)
+	assert [(job[0], done) for job, done in jobs(spec, cache)] == [(key, True) for key in keys]
+	assert [result['params'] for result in load(spec, cache)] == drawn
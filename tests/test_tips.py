@@ -0,0 +1,38 @@
+import random
+
+from tips import TipSet
+
+# Through any mix of adds and removes, TipSet holds the tips a plain list would,
+# in insertion order, and choice_recent draws what random.choice over the last
+# n of that list would. choice and sample draw from the swap-removal dense
+# order instead, so they only promise live tips.
+
+def test_matches_ordered_list():
+	rng = random.Random(7)
+	tips = TipSet(rng=random.Random(11))
+	reference = []
+	reference_rng = random.Random(11)
+	for i in range(3000):
+		if reference and rng.random() < 0.45:
+			tx = rng.choice(reference)
+			tips.remove(tx)
+			reference.remove(tx)
+		else:
+			tips.add(i)
+			reference.append(i)
+		assert len(tips) == len(reference)
+		if i % 7 == 0 and reference:
+			n = rng.randint(1, len(reference) + 3)
+			last = reference[-min(n, len(reference)):]
+			assert tips.choice_recent(n) == reference_rng.choice(last)
+	assert list(tips) == reference
+	assert all(tx in tips for tx in reference)
+
+def test_choice_and_sample_draw_from_live_tips():
+	tips = TipSet(range(50), rng=random.Random(2))
+	for tx in range(0, 50, 3):
+		tips.discard(tx)
+	live = set(range(50)) - set(range(0, 50, 3))
+	assert all(tips.choice() in live for _ in range(200))
+	sample = tips.sample(10)
+	assert len(set(sample)) == 10 and set(sample) <= live
@@ -0,0 +1,68 @@
+import numpy as np
+import networkx as nx
+import pytest
+
+from topology import KINDS, Topology, build_topology, components, connected
+
+# Every generator gives a simple, connected graph of about npn links per node,
+# the CSR lists hand each node what scanning the connections would, and the
+# union-find agrees with networkx on components.
+
+def graph(n, edges):
+	g = nx.Graph()
+	g.add_nodes_from(range(n))
+	g.add_edges_from(edges.tolist())
+	return g
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_generators_are_simple_and_connected(kind):
+	(n, npn) = (300, 6)
+	topology = build_topology(n, npn, kind=kind, seed=4)
+	edges = topology.edges()
+	assert (edges[:, 0] != edges[:, 1]).all()
+	assert len(np.unique(np.sort(edges, axis=1), axis=0)) == len(edges)
+	assert topology.connected()
+	assert nx.is_connected(graph(n, edges))
+	degrees = np.bincount(edges.ravel(), minlength=n)
+	assert degrees.min() >= 1
+	if kind == 'regular':
+		assert (degrees == npn).all()
+	elif kind == 'scale_free':
+		# npn // 2 links for every node after the first npn // 2 + 1.
+		m = npn // 2
+		assert len(edges) == m * (m + 1) // 2 + (n - m - 1) * m
+	else:
+		assert abs(degrees.mean() - npn) < 1.5
+
+@pytest.mark.parametrize('kind', KINDS)
+def test_seeded_topologies_repeat(kind, tmp_path):
+	first = build_topology(100, 4, kind=kind, seed=9)
+	assert (build_topology(100, 4, kind=kind, seed=9).edges() == first.edges()).all()
+	cached = build_topology(100, 4, kind=kind, seed=9, cache=str(tmp_path))
+	loaded = build_topology(100, 4, kind=kind, seed=9, cache=str(tmp_path))
+	assert len(list(tmp_path.iterdir())) == 1
+	assert (cached.edges() == first.edges()).all()
+	assert (loaded.edges() == first.edges()).all()
+
+def test_csr_lists_match_scans():
+	topology = build_topology(80, 4, kind='scale_free', seed=2)
+	connections = topology.connections()
+	assert len(connections) == 2 * len(topology.edges())
+	for i in range(topology.n):
+		assert topology.outgoing(i) == [(x, y) for (x, y) in connections if x == i]
+		assert topology.incoming(i) == [(x, y) for (x, y) in connections if y == i]
+
+def test_components_match_networkx():
+	rng = np.random.RandomState(3)
+	n = 200
+	# Sparse enough to leave many components, merged in every order.
+	edges = rng.randint(n, size=(120, 2))
+	labels = components(n, edges)
+	groups = {}
+	for (x, label) in enumerate(labels.tolist()):
+		groups.setdefault(label, set()).add(x)
+	expected = sorted(sorted(c) for c in nx.connected_components(graph(n, edges)))
+	assert sorted(sorted(group) for group in groups.values()) == expected
+	assert not connected(n, edges)
+	assert connected(3, np.array([[2, 1], [0, 2]]))
+	assert not Topology.from_edges(4, [(0, 1), (2, 3)]).connected()
@@ -0,0 +1,75 @@
+import random
+
+import pytest
+
+from iota import Tangle
+
+# Jumping to a walker's site through the ancestor index must leave the same
+# sites and cumulative weights behind as walking back to it step by step.
+
+def grow(seed, n_txs=400, width=8, backend='networkx', index=False):
+	rng = random.Random(seed)
+	tangle = Tangle(backend=backend, rng=random.Random(seed))
+	tangle.add_node(tangle.genesis)
+	tangle.tips.add(tangle.genesis)
+	if index:
+		tangle.ancestor(tangle.genesis, 0)
+	for i in range(n_txs):
+		if i % width == 0:
+			tips = list(tangle.tips)
+		parents = rng.sample(tips, min(rng.choice([1, 2]), len(tips)))
+		tangle.publish(tangle.make_transaction('test', i // width + 1, parents, i), parents)
+	return tangle
+
+def weights(tangle):
+	return {tx: tangle.cumulative_weight[tx] for tx in tangle.dag if tangle.cumulative_weight[tx]}
+
+@pytest.mark.parametrize('backend', ['networkx', 'array'])
+def test_jump_weighs_like_walk_back(backend):
+	walked = grow(5, backend=backend)
+	jumped = grow(5, backend=backend)
+	rng = random.Random(7)
+	starts = [(rng.choice(list(walked.dag)), rng.choice([0, 3, 14, 100])) for _ in range(300)]
+	for (start, depth) in starts:
+		site = jumped.ancestor(start, depth)
+		jumped.weigh_walk(start, depth, site)
+		assert walked.walk_back(start, depth) == site
+	assert weights(jumped) == weights(walked)
+	assert weights(jumped)
+
+def test_jump_sites_weigh_like_walk_back():
+	walked = grow(5, width=20)
+	jumped = grow(5, width=20)
+	assert len(walked.tips) >= 14
+	for i in range(20):
+		# walk_back draws from rng on its way, so both start each round afresh.
+		walked.rng.seed(i)
+		jumped.rng.seed(i)
+		assert jumped.get_sites(10, 14, jump=True) == walked.get_sites(10, 14)
+		assert weights(jumped) == weights(walked)
+	assert weights(jumped)
+
+@pytest.mark.parametrize('backend', ['networkx', 'array'])
+def test_index_kept_as_tangle_grows(backend):
+	# Started before anything was published, the index is kept whole by
+	# publish and holds what walking every chain afresh would build.
+	kept = grow(5, backend=backend, index=True)
+	assert len(kept.ancestors) == len(kept.dag)
+	built = grow(5, backend=backend)
+	for tx in built.dag:
+		built.ancestor(tx, 0)
+	assert kept.ancestors.entries == built.ancestors.entries
+
+def test_walks_weigh_once_whatever_the_memo_holds():
+	# A walk dropped from the bounded memo ends in the same place when
+	# repeated, but neither weighs its path nor draws a second time.
+	tangle = grow(5)
+	rng = random.Random(3)
+	starts = [(rng.choice(list(tangle.dag)), rng.choice([3, 14])) for _ in range(200)]
+	ends = [tangle.walk_back(start, depth) for (start, depth) in starts]
+	before = weights(tangle)
+	state = tangle.rng.getstate()
+	tangle.walk_cache.clear()
+	assert [tangle.walk_back(start, depth) for (start, depth) in starts] == ends
+	assert weights(tangle) == before
+	assert tangle.rng.getstate() == state
@@ -0,0 +1,117 @@
+import random
+
+# Tip pool for a Tangle. A dense list with a position index gives O(1)
+# insert, delete, membership and uniform sampling (deletes swap the last tip
+# into the hole). Recency is kept separately as insertion-ordered slots with a
+# Fenwick tree over the live ones, so drawing from the newest n tips is a
+# rank lookup rather than a slice copy; dead slots are compacted away once
+# they outnumber the live ones.
+
+class TipSet():
+
+	def __init__(self, tips=(), rng=random):
+		self.rng = rng
+		self._dense = []
+		self._position = {}
+		self._order = []
+		self._slot = {}
+		self._tree = [0]
+		for tip in tips:
+			self.add(tip)
+
+	def __len__(self):
+		return len(self._dense)
+
+	def __contains__(self, tx):
+		return tx in self._position
+
+	def __iter__(self):
+		return (tx for tx in self._order if tx is not None)
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		if self.rng is random:
+			state['rng'] = None
+		return state
+
+	def __setstate__(self, state):
+		if state['rng'] is None:
+			state['rng'] = random
+		self.__dict__.update(state)
+
+	def __repr__(self):
+		return 'TipSet({t})'.format(t=list(self))
+
+	def add(self, tx):
+		if tx in self._position:
+			return
+		self._position[tx] = len(self._dense)
+		self._dense.append(tx)
+		self._slot[tx] = len(self._order)
+		self._order.append(tx)
+		i = len(self._order)
+		self._tree.append(1 + self._prefix(i - 1) - self._prefix(i - (i & -i)))
+
+	def discard(self, tx):
+		position = self._position.pop(tx, None)
+		if position is None:
+			return
+		last = self._dense.pop()
+		if last != tx:
+			self._dense[position] = last
+			self._position[last] = position
+		slot = self._slot.pop(tx)
+		self._order[slot] = None
+		self._update(slot + 1, -1)
+		if len(self._order) > 2 * len(self._dense) + 64:
+			self._compact()
+
+	def remove(self, tx):
+		if tx not in self._position:
+			raise KeyError(tx)
+		self.discard(tx)
+
+	def choice(self):
+		return self._dense[self.rng.randrange(len(self._dense))]
+
+	def sample(self, k):
+		return self.rng.sample(self._dense, k)
+
+	def choice_recent(self, n):
+		n = min(max(n, 1), len(self._dense))
+		rank = len(self._dense) - n + self.rng.randrange(n)
+		return self._order[self._find(rank)]
+
+	def _prefix(self, i):
+		total = 0
+		while i > 0:
+			total += self._tree[i]
+			i -= i & -i
+		return total
+
+	def _update(self, i, delta):
+		while i < len(self._tree):
+			self._tree[i] += delta
+			i += i & -i
+
+	def _find(self, rank):
+		# Slot index of the (rank + 1)-th live tip in insertion order.
+		position = 0
+		remaining = rank + 1
+		step = 1 << (len(self._tree) - 1).bit_length()
+		while step:
+			following = position + step
+			if following < len(self._tree) and self._tree[following] < remaining:
+				position = following
+				remaining -= self._tree[position]
+			step >>= 1
+		return position
+
+	def _compact(self):
+		self._order = [tx for tx in self._order if tx is not None]
+		self._slot = {tx: slot for slot, tx in enumerate(self._order)}
+		self._tree = [0] + [1] * len(self._order)
+		for i in range(1, len(self._tree)):
+			parent = i + (i & -i)
+			if parent < len(self._tree):
+				self._tree[parent] += self._tree[i]
@@ -0,0 +1,238 @@
+import os
+from math import pi, sqrt, ceil
+from random import Random
+
+import numpy as np
+import networkx as nx
+
+# Peer-to-peer topologies for simulation_5. A Topology keeps its directed
+# connections (every undirected link in both directions, forward ones first,
+# the order initialize_simulation has always listed them in) as CSR
+# adjacency: the targets of node i's outgoing connections are
+# out_targets[out_offsets[i]:out_offsets[i + 1]], and likewise for incoming
+# ones, so handing every node its lists is linear in the number of links. Connectivity is checked with a union-find over the
+# links instead of building a graph.
+#
+# Generators return undirected links as an (m, 2) array:
+#   regular      random npn-regular graph (networkx), redrawn until connected
+#   small_world  Watts-Strogatz ring of npn neighbours, each link rewired with
+#                probability p, redrawn until connected
+#   scale_free   Barabasi-Albert growth, npn // 2 links per arriving node
+#   geographic   points in the unit square linked within the radius that
+#                gives npn neighbours on average; stray components are joined
+#                to the nearest point of the largest one
+#
+# With a seed a topology is reproducible, and with a cache directory it is
+# generated once and then loaded from <cache>/<kind>-N<n>-NPN<npn>-S<seed>.npz.
+
+KINDS = ('regular', 'small_world', 'scale_free', 'geographic')
+
+class Topology():
+
+	def __init__(self, n, sources, targets):
+		self.n = n
+		self.sources = np.asarray(sources, dtype=np.int64)
+		self.targets = np.asarray(targets, dtype=np.int64)
+		(self.out_offsets, self.out_targets) = csr(n, self.sources, self.targets)
+		(self.in_offsets, self.in_sources) = csr(n, self.targets, self.sources)
+
+	@classmethod
+	def from_edges(cls, n, edges):
+		edges = np.asarray(edges, dtype=np.int64).reshape(-1, 2)
+		return cls(n, np.concatenate([edges[:, 0], edges[:, 1]]), np.concatenate([edges[:, 1], edges[:, 0]]))
+
+	def __len__(self):
+		return len(self.sources)
+
+	def edges(self):
+		# The undirected links, as generated.
+		half = len(self.sources) // 2
+		return np.stack([self.sources[:half], self.targets[:half]], axis=1)
+
+	def connections(self):
+		return list(zip(self.sources.tolist(), self.targets.tolist()))
+
+	def outgoing(self, i):
+		return [(i, y) for y in self.out_targets[self.out_offsets[i]:self.out_offsets[i + 1]].tolist()]
+
+	def incoming(self, i):
+		return [(x, i) for x in self.in_sources[self.in_offsets[i]:self.in_offsets[i + 1]].tolist()]
+
+	def components(self):
+		return components(self.n, self.edges())
+
+	def connected(self):
+		return connected(self.n, self.edges())
+
+def csr(n, keys, values):
+	# A stable sort keeps each node's connections in generation order.
+	order = np.argsort(keys, kind='stable')
+	offsets = np.zeros(n + 1, dtype=np.int64)
+	np.cumsum(np.bincount(keys, minlength=n), out=offsets[1:])
+	return offsets, values[order]
+
+def find(parent, x):
+	while parent[x] != x:
+		parent[x] = parent[parent[x]]
+		x = parent[x]
+	return x
+
+def components(n, edges):
+	# Union-find with path halving and union by size; returns every node's
+	# component label (its root).
+	parent = list(range(n))
+	size = [1] * n
+	for (x, y) in edges.tolist():
+		x = find(parent, x)
+		y = find(parent, y)
+		if x == y:
+			continue
+		if size[x] < size[y]:
+			(x, y) = (y, x)
+		parent[y] = x
+		size[x] += size[y]
+	return np.array([find(parent, x) for x in range(n)], dtype=np.int64)
+
+def connected(n, edges):
+	if n == 0:
+		return True
+	if len(edges) < n - 1:
+		return False
+	labels = components(n, edges)
+	return bool((labels == labels[0]).all())
+
+def simple(edges):
+	# Drops self-loops and repeated links, whichever direction they take.
+	edges = np.sort(edges, axis=1)
+	edges = edges[edges[:, 0] != edges[:, 1]]
+	return np.unique(edges, axis=0)
+
+def relabel(edges, n, np_rng):
+	# Nodes step in id order, so generators that number nodes by position
+	# (around a ring, or by arrival) are shuffled; otherwise gossip would run
+	# along the ring within a tick, and the adversary, node 0, would be the
+	# oldest hub.
+	return np_rng.permutation(n)[edges]
+
+def regular(n, npn, seed=None):
+	# networkx draws from the random module when unseeded, which keeps
+	# unseeded runs identical to those drawing the regular graph directly.
+	rng = Random(seed) if seed is not None else None
+	while True:
+		edges = np.array(list(nx.random_regular_graph(npn, n, seed=rng).edges()), dtype=np.int64).reshape(-1, 2)
+		if connected(n, edges):
+			return edges
+
+def small_world(n, npn, np_rng, p=0.1):
+	k = max(npn // 2, 1)
+	while True:
+		sources = np.repeat(np.arange(n), k)
+		targets = (sources + np.tile(np.arange(1, k + 1), n)) % n
+		rewired = np_rng.random_sample(len(targets)) < p
+		targets[rewired] = np_rng.randint(n, size=int(rewired.sum()))
+		edges = simple(np.stack([sources, targets], axis=1))
+		if connected(n, edges):
+			return relabel(edges, n, np_rng)
+
+def scale_free(n, npn, np_rng):
+	m = max(npn // 2, 1)
+	seed_nodes = min(m + 1, n)
+	edges = [(x, y) for x in range(seed_nodes) for y in range(x + 1, seed_nodes)]
+	# Every link's endpoints, so a uniform pick from it is a pick by degree.
+	ends = [x for edge in edges for x in edge]
+	for x in range(seed_nodes, n):
+		chosen = set()
+		while len(chosen) < m:
+			for i in np_rng.randint(len(ends), size=m - len(chosen)).tolist():
+				chosen.add(ends[i])
+		for y in sorted(chosen):
+			edges.append((y, x))
+			ends.extend((y, x))
+	return relabel(np.array(edges, dtype=np.int64).reshape(-1, 2), n, np_rng)
+
+def geographic(n, npn, np_rng):
+	radius = sqrt(npn / (pi * n))
+	points = np_rng.random_sample((n, 2))
+	side = max(int(ceil(1 / radius)), 1)
+	cells = np.minimum((points / radius).astype(np.int64), side - 1)
+	cell = cells[:, 0] * side + cells[:, 1]
+	order = np.argsort(cell, kind='stable')
+	starts = np.searchsorted(cell[order], np.arange(side * side + 1))
+
+	# Each pair of points is compared once: within a cell, and against the
+	# cells above, right, and diagonally right of it.
+	pairs = []
+	for (dx, dy) in ((0, 0), (0, 1), (1, -1), (1, 0), (1, 1)):
+		(x, y) = (cells[:, 0] + dx, cells[:, 1] + dy)
+		inside = (x < side) & (y >= 0) & (y < side)
+		nodes = np.nonzero(inside)[0]
+		neighbour = x[inside] * side + y[inside]
+		counts = starts[neighbour + 1] - starts[neighbour]
+		first = np.repeat(nodes, counts)
+		offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+		second = order[np.repeat(starts[neighbour], counts) + offsets]
+		if (dx, dy) == (0, 0):
+			keep = first < second
+			(first, second) = (first[keep], second[keep])
+		pairs.append(np.stack([first, second], axis=1))
+	pairs = np.concatenate(pairs)
+	distances = np.linalg.norm(points[pairs[:, 0]] - points[pairs[:, 1]], axis=1)
+	edges = simple(pairs[distances <= radius])
+
+	labels = components(n, edges)
+	(roots, sizes) = np.unique(labels, return_counts=True)
+	largest = np.nonzero(labels == roots[np.argmax(sizes)])[0]
+	joins = []
+	for root in roots:
+		if root == labels[largest[0]]:
+			continue
+		member = np.nonzero(labels == root)[0][0]
+		nearest = largest[np.argmin(np.linalg.norm(points[largest] - points[member], axis=1))]
+		joins.append((min(member, nearest), max(member, nearest)))
+	if joins:
+		edges = np.concatenate([edges, np.array(joins, dtype=np.int64)])
+	return edges
+
+def generate(kind, n, npn, seed=None, **options):
+	if kind not in KINDS:
+		raise ValueError("Unknown topology {k}.".format(k=kind))
+	if kind == 'regular':
+		return regular(n, npn, seed)
+	np_rng = np.random.RandomState(seed) if seed is not None else np.random
+	if kind == 'small_world':
+		return small_world(n, npn, np_rng, **options)
+	if kind == 'scale_free':
+		return scale_free(n, npn, np_rng)
+	return geographic(n, npn, np_rng)
+
+def cache_path(cache, kind, n, npn, seed, options):
+	name = "{k}-N{n}-NPN{npn}-S{s}".format(k=kind, n=n, npn=npn, s=seed)
+	name += ''.join("-{o}{v}".format(o=option, v=value) for (option, value) in sorted(options.items()))
+	return os.path.join(cache, name + '.npz')
+
+def build_topology(n, npn, kind='regular', seed=None, cache=None, **options):
+	# Unseeded topologies draw from the global generators and are never cached.
+	if cache is None or seed is None:
+		return Topology.from_edges(n, generate(kind, n, npn, seed, **options))
+	path = cache_path(cache, kind, n, npn, seed, options)
+	if os.path.exists(path):
+		with np.load(path) as stored:
+			return Topology.from_edges(n, stored['edges'])
+	edges = generate(kind, n, npn, seed, **options)
+	os.makedirs(cache, exist_ok=True)
+	partial = "{p}.{pid}.tmp".format(p=path, pid=os.getpid())
+	with open(partial, 'wb') as handle:
+		np.savez(handle, edges=edges)
+	os.replace(partial, path)
+	return Topology.from_edges(n, edges)
+
+def make_topology(topology, n, npn):
+	# A Simulation's topology setting: None for the unseeded regular graph,
+	# a kind, a dict of build_topology() arguments, or a ready Topology.
+	if isinstance(topology, Topology):
+		return topology
+	if topology is None:
+		return build_topology(n, npn)
+	if isinstance(topology, str):
+		return build_topology(n, npn, kind=topology)
+	return build_topology(n, npn, **topology)
@@ -0,0 +1,104 @@
+import os, json, struct
+
+import numpy as np
+
+# Columnar trajectory files. A file is an 8-byte magic, a little-endian uint32
+# header length and a JSON header (run parameters plus the state, action and
+# observation labels), padded to a multiple of 8 bytes. The rest is a flat
+# array of fixed-width records holding label codes (RECORD, or WIDE_RECORD
+# for state spaces past 2^16 labels, as named in the header), so a file can be
+# appended to while a simulation runs and read back with np.memmap without
+# unpickling anything. Older np.save'd dicts are still read by load_data.
+
+MAGIC = b'TNGLTRJ1'
+RECORD = np.dtype([('state', '<u2'), ('action', 'u1'), ('observation', '<u2')])
+WIDE_RECORD = np.dtype([('state', '<u4'), ('action', 'u1'), ('observation', '<u4')])
+
+def record_type(header):
+	return np.dtype([tuple(field) for field in header.get('record', RECORD.descr)])
+
+def write_header(handle, header):
+	encoded = json.dumps(header, sort_keys=True).encode()
+	padding = (-(len(MAGIC) + 4 + len(encoded))) % 8
+	encoded += b' ' * padding
+	handle.write(MAGIC)
+	handle.write(struct.pack('<I', len(encoded)))
+	handle.write(encoded)
+
+def is_trajectory(path):
+	with open(path, 'rb') as handle:
+		return handle.read(len(MAGIC)) == MAGIC
+
+def read_header(path):
+	with open(path, 'rb') as handle:
+		if handle.read(len(MAGIC)) != MAGIC:
+			raise ValueError("{p} is not a trajectory file.".format(p=path))
+		(length,) = struct.unpack('<I', handle.read(4))
+		header = json.loads(handle.read(length).decode())
+	return header, len(MAGIC) + 4 + length
+
+class TrajectoryWriter():
+
+	def __init__(self, path, states, actions, observations, params=None, append=False, buffer_size=1024):
+		self.path = path
+		self.buffer_size = buffer_size
+		if append and os.path.exists(path) and os.path.getsize(path) > 0:
+			header, _ = read_header(path)
+			if header['states'] != list(states) or header['actions'] != list(actions) or header['observations'] != list(observations):
+				raise ValueError("{p} was written with different labels.".format(p=path))
+			self.handle = open(path, 'ab')
+		else:
+			self.handle = open(path, 'wb')
+			record = RECORD if max(len(states), len(observations)) <= 1 << 16 else WIDE_RECORD
+			if len(actions) > 1 << 8:
+				raise ValueError("Too many actions for {p}.".format(p=path))
+			header = {'states': list(states), 'actions': list(actions), 'observations': list(observations), 'params': params or {}, 'record': record.descr}
+			write_header(self.handle, header)
+		self.header = header
+		self.record = record_type(header)
+		self.state_codes = {state: i for i, state in enumerate(header['states'])}
+		self.action_codes = {action: i for i, action in enumerate(header['actions'])}
+		self.observation_codes = {observation: i for i, observation in enumerate(header['observations'])}
+		self.buffer = []
+
+	def append(self, state, action, observation):
+		self.buffer.append((self.state_codes[state], self.action_codes[action], self.observation_codes[observation]))
+		if len(self.buffer) >= self.buffer_size:
+			self.flush()
+
+	def flush(self):
+		if self.buffer:
+			np.array(self.buffer, dtype=self.record).tofile(self.handle)
+			self.buffer = []
+		self.handle.flush()
+
+	def close(self):
+		self.flush()
+		self.handle.close()
+
+def load(path):
+	header, offset = read_header(path)
+	record = record_type(header)
+	n_records = (os.path.getsize(path) - offset) // record.itemsize
+	if n_records == 0:
+		return header, np.zeros(0, dtype=record)
+	return header, np.memmap(path, dtype=record, mode='r', offset=offset, shape=(n_records,))
+
+def chunks(path, chunk_size=1 << 20):
+	header, records = load(path)
+	for start in range(0, len(records), chunk_size):
+		yield header, records[start:start + chunk_size]
+
+def decode(header, records):
+	states = np.array(header['states'], dtype=object)
+	actions = np.array(header['actions'], dtype=object)
+	observations = np.array(header['observations'], dtype=object)
+	data = {}
+	data['global'] = [[state, action] for state, action in zip(states[records['state']], actions[records['action']])]
+	data['local'] = list(observations[records['observation']])
+	return data
+
+def load_data(path):
+	if is_trajectory(path):
+		return decode(*load(path))
+	return np.load(path, allow_pickle=True).item()
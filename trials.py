@@ -0,0 +1,146 @@
+import sys, random, traceback, argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+import simulation_5
+from simulation_5 import Simulation
+from data_to_pomdp import ACTIONS
+from discretization import Discretization
+from trajectory import TrajectoryWriter
+from topology import KINDS
+from bus import LISTEN_POLICIES
+
+def trial_seeds(seed, k):
+	# One independent stream per trial, so a trial's result depends only on
+	# the root seed and its index, not on which worker happens to run it.
+	return [int(s.generate_state(1)[0]) for s in np.random.SeedSequence(seed).spawn(k)]
+
+def run_trial(job):
+	index, seed, params = job
+	try:
+		random.seed(seed)
+		np.random.seed(seed)
+		data = Simulation(verbose=False, **params).run()
+		return index, data, None
+	except Exception:
+		return index, None, traceback.format_exc()
+
+def run_trials(k, params, seed=0, processes=None):
+	jobs = [(index, trial_seed, params) for index, trial_seed in enumerate(trial_seeds(seed, k))]
+
+	data = {}
+	data['global'] = []
+	data['local'] = []
+	failures = []
+
+	with Pool(processes) as pool:
+		for index, trial, error in pool.imap(run_trial, jobs):
+			if error:
+				failures.append(index)
+				print("Trial {i} failed:\n{e}".format(i=index, e=error))
+				continue
+			data['global'].extend(trial['global'])
+			data['local'].extend(trial['local'])
+			print("Trial {i} finished with {s} logged steps.".format(i=index, s=len(trial['global'])))
+
+	print("{d} of {k} trials finished.".format(d=k - len(failures), k=k))
+	return data, failures
+
+def edges(value):
+	return [int(edge) for edge in value.split(',') if edge]
+
+def compaction(options):
+	if options.compaction_age is None and options.compaction_depth is None:
+		return None
+	settings = {'every': options.compaction_every}
+	if options.compaction_age is not None:
+		settings['max_age'] = options.compaction_age
+	if options.compaction_depth is not None:
+		settings['max_depth'] = options.compaction_depth
+	if options.compaction_horizon is not None:
+		settings['horizon'] = options.compaction_horizon
+	return settings
+
+def topology(options):
+	if options.topology == 'regular' and options.topology_seed is None:
+		return None
+	return {'kind': options.topology, 'seed': options.topology_seed, 'cache': options.topology_cache}
+
+def main(arguments):
+	parser = argparse.ArgumentParser(description="Run independent simulation_5 trials on a process pool.")
+	parser.add_argument('--trials', type=int, default=8)
+	parser.add_argument('--processes', type=int, default=None)
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--n-nodes', type=int, default=simulation_5.N_NODES)
+	parser.add_argument('--npn', type=int, default=simulation_5.NEIGHBORS_PER_NODE)
+	parser.add_argument('--tps', type=float, default=simulation_5.TPS)
+	parser.add_argument('--bw', type=int, default=simulation_5.BANDWIDTH_LIMIT)
+	parser.add_argument('--time-steps', type=int, default=simulation_5.TIME_STEPS)
+	parser.add_argument('--make-original-at', type=int, default=simulation_5.MAKE_ORIGINAL_AT)
+	parser.add_argument('--start-attack-at', type=int, default=simulation_5.START_ATTACK_AT)
+	parser.add_argument('--backend', default=simulation_5.BACKEND)
+	parser.add_argument('--tip-selection', default=simulation_5.TIP_SELECTION)
+	parser.add_argument('--message-bus', action='store_true', default=simulation_5.MESSAGE_BUS)
+	parser.add_argument('--ids', default=simulation_5.IDS, choices=('hash', 'counter'))
+	parser.add_argument('--issuance', default=simulation_5.ISSUANCE, choices=('node', 'tick'))
+	parser.add_argument('--adversaries', type=int, default=1)
+	parser.add_argument('--attacks', type=int, default=1)
+	parser.add_argument('--attack-period', type=int, default=None)
+	parser.add_argument('--listen-policy', default=simulation_5.LISTEN_POLICY, choices=LISTEN_POLICIES)
+	parser.add_argument('--topology', default='regular', choices=KINDS)
+	parser.add_argument('--topology-seed', type=int, default=None)
+	parser.add_argument('--topology-cache', default=None)
+	parser.add_argument('--compaction-age', type=int, default=None)
+	parser.add_argument('--compaction-depth', type=int, default=None)
+	parser.add_argument('--compaction-every', type=int, default=1)
+	parser.add_argument('--compaction-horizon', type=int, default=None)
+	parser.add_argument('--buckets', type=int, default=simulation_5.DISCRETIZATION.buckets)
+	parser.add_argument('--tip-edges', type=edges, default=())
+	parser.add_argument('--since-attack-edges', type=edges, default=())
+	parser.add_argument('--output', default=None)
+	options = parser.parse_args(arguments[1:])
+
+	params = {
+		'n_nodes': options.n_nodes,
+		'npn': options.npn,
+		'tps': options.tps,
+		'bw': options.bw,
+		'time_steps': options.time_steps,
+		'make_original_at': options.make_original_at,
+		'start_attack_at': options.start_attack_at,
+		'backend': options.backend,
+		'tip_selection': options.tip_selection,
+		'message_bus': options.message_bus,
+		'ids': options.ids,
+		'compaction': compaction(options),
+		'issuance': options.issuance,
+		'adversaries': options.adversaries,
+		'attacks': options.attacks,
+		'attack_period': options.attack_period,
+		'topology': topology(options),
+		'listen_policy': options.listen_policy,
+		'discretization': Discretization(options.buckets, tips=options.tip_edges, since_attack=options.since_attack_edges),
+	}
+	data, failures = run_trials(options.trials, params, seed=options.seed, processes=options.processes)
+
+	output = options.output
+	if output is None:
+		output = simulation_5.output_name(options.n_nodes, options.npn, options.tps, options.bw) + "K{k}S{s}.traj".format(k=options.trials, s=options.seed)
+	if output.endswith('.npy'):
+		np.save(output, data)
+	else:
+		discretization = params['discretization']
+		header = dict(params, discretization=discretization.config(), trials=options.trials, seed=options.seed, failures=failures)
+		states = discretization.states()
+		writer = TrajectoryWriter(output, states, ACTIONS, states, params=header)
+		for (state, action), observation in zip(data['global'], data['local']):
+			writer.append(state, action, observation)
+		writer.close()
+	print("Saved merged trials to {o}.".format(o=output))
+
+	if failures:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main(sys.argv)